@@ -49,6 +49,11 @@ resource "aws_instance" "blue" {
     destination = "/home/${var.ssh_user}/app_${each.key}.py"
   }
 
+  provisioner "file" {
+    source      = "${path.module}/scripts/blog"
+    destination = "/home/${var.ssh_user}"
+  }
+
   provisioner "file" {
     source      = "${path.root}/${var.jenkins_file_path}"
     destination = "/home/${var.ssh_user}/Jenkinsfile"
@@ -124,6 +129,11 @@ resource "aws_instance" "green" {
     destination = "/home/${var.ssh_user}/app_${each.key}.py"
   }
 
+  provisioner "file" {
+    source      = "${path.module}/scripts/blog"
+    destination = "/home/${var.ssh_user}"
+  }
+
   provisioner "file" {
     source      = "${path.root}/${var.jenkins_file_path}"
     destination = "/home/${var.ssh_user}/Jenkinsfile"
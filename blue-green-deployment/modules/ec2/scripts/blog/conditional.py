@@ -0,0 +1,77 @@
+"""Conditional GET for the blog pages.
+
+Every page is derived from the post store, so the store's ``data_version``
+(bumped by every write) is enough to validate any of them. Pages carry a
+strong ``ETag`` built from it and a ``Last-Modified`` of the last write;
+a request whose ``If-None-Match`` / ``If-Modified-Since`` still matches is
+answered with ``304 Not Modified`` before the view runs, so nothing is
+rendered at all.
+
+The ETag also contains a random per-process id: after a restart, or when
+the ALB moves from blue to green, the data version starts over and must
+not validate pages cached from the other process.
+
+``Last-Modified`` has whole-second resolution, so a second write in the
+same second as the one a client's page carries would look unmodified to
+``If-Modified-Since``. A page rendered in the same second as the last
+write is therefore sent with its ETag only; a client can only hold a
+``Last-Modified`` once every write stamped with it is in the page.
+"""
+import datetime
+import uuid
+
+from flask import Response, g, request
+
+from blog.compression import etag_variants
+
+# Views whose output depends only on the store and the URL
+DEFAULT_ENDPOINTS = ("home", "view_post", "search")
+
+
+def init_app(app, store, endpoints=DEFAULT_ENDPOINTS):
+    boot_id = uuid.uuid4().hex[:8]
+    endpoints = frozenset(endpoints)
+
+    @app.before_request
+    def answer_not_modified():
+        if request.method not in ("GET", "HEAD") or request.endpoint not in endpoints:
+            return None
+        # Read both before rendering: if a write lands mid-render the page is
+        # labelled with the older version and simply revalidates next time
+        etag = f"{boot_id}-{store.data_version}"
+        last_modified = store.last_modified
+        if last_modified >= _this_second():
+            # More writes may still land in this second: validate on the ETag only
+            last_modified = None
+        g.blog_validators = (etag, last_modified)
+        if request.if_none_match:
+            # The client may hold a compressed variant, tagged "<etag>-gzip"
+            matched = next((tag for tag in etag_variants(etag) if request.if_none_match.contains(tag)), None)
+        elif (request.if_modified_since is not None and last_modified is not None
+              and last_modified <= request.if_modified_since):
+            matched = etag
+        else:
+            matched = None
+        if matched:
+            return _validated(Response(status=304), matched, last_modified)
+        return None
+
+    @app.after_request
+    def add_validators(response):
+        validators = g.pop("blog_validators", None)
+        if validators is not None and response.status_code == 200:
+            _validated(response, *validators)
+        return response
+
+
+def _validated(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Always revalidate rather than let browsers guess a freshness lifetime
+    response.cache_control.no_cache = True
+    return response
+
+
+def _this_second():
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
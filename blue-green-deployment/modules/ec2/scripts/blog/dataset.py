@@ -0,0 +1,231 @@
+"""Synthetic blogs for scale testing.
+
+``generate(count, seed)`` yields ``count`` posts, oldest first, built from
+the seed alone: the same arguments give the same posts on any machine.
+One post is built at a time, so a dataset of any size streams through in
+constant memory. The posts look like the apps' own:
+
+Ids
+    Eight hex digits, as ``create_post`` makes them; a permutation of the
+    post's number, so they are unique up to 2**32 posts.
+Titles and content
+    Words drawn from a vocabulary with Zipf-like frequencies (a few words
+    in most posts, a long tail of rare ones), so search terms range from
+    matching most of the blog to matching a handful of posts. Content
+    length is log-normal: a median of about 90 words, a few posts of
+    thousands.
+Authors
+    A pool of ``AUTHORS`` names, also Zipf-distributed: a few prolific
+    authors and many with a post or two.
+Dates
+    Spread evenly over ``DAYS`` days ending 2024-12-31, oldest first.
+Comments
+    A Pareto-distributed count: most posts have none, a few hundreds (at
+    most ``MAX_COMMENTS``). Comments are dated on or after their post.
+
+Loading
+    ``fill(store, posts)`` adds posts to any store in batches of
+    ``BATCH`` through its ``extend``, so only one batch is ever held
+    outside the store. ``python -m blog.dataset`` writes a service's data
+    for the persistent backends straight from the generator instead: the
+    ``wal`` snapshot (``snapshot.jsonl``), the ``mmap`` snapshot
+    (``snapshot.map``) or the ``sqlite`` database, under
+    ``BLOG_DATA_DIR``, for the app to open as if it had written them::
+
+        python -m blog.dataset blue-green-app-1 --posts 1000000 --store mmap
+
+    With ``BLOG_SYNTHETIC_POSTS=N`` (and ``BLOG_SYNTHETIC_SEED``) an app
+    whose store starts out empty fills it with ``N`` generated posts
+    instead of its seed posts.
+"""
+import argparse
+import bisect
+import datetime
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from blog import journal, snapshot
+from blog.sqlite_store import SQLitePostStore
+from blog.store import DATA_DIR
+
+SYNTHETIC_POSTS = int(os.environ.get("BLOG_SYNTHETIC_POSTS", "0"))
+SYNTHETIC_SEED = int(os.environ.get("BLOG_SYNTHETIC_SEED", "0"))
+
+BATCH = 10000
+AUTHORS = 2000
+MAX_COMMENTS = 500
+DAYS = 3650
+LAST_DAY = datetime.date(2024, 12, 31)
+
+# The most frequent words first; the rest of the vocabulary is made up
+COMMON_WORDS = (
+    "the of and to a in is it that for on with as was this by are be from at or an have not "
+    "deployment blue green traffic release service environment rollback version switch load balancer "
+    "listener target group health check task container cluster image pipeline terraform instance "
+    "downtime users production staging canary alarm metrics latency logs database migration cache "
+    "request response route app team build test deploy config scaling capacity region zone network"
+).split()
+SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pra", "sto", "gri", "den", "mar", "lin", "tor")
+FIRST_NAMES = ("Alex", "Sam", "Jordan", "Priya", "Wei", "Maria", "Omar", "Lena", "Kenji", "Ana", "Tom", "Aisha",
+               "Lucas", "Mei", "Ivan", "Sofia", "Raj", "Emma", "Diego", "Hana")
+LAST_NAMES = ("Smith", "Patel", "Chen", "Garcia", "Kim", "Novak", "Okafor", "Rossi", "Silva", "Tanaka", "Müller",
+              "Khan", "Lopez", "Nguyen", "Haddad", "Berg", "Costa", "Ivanova", "Brown", "Sato")
+VOCABULARY_SIZE = 20000
+
+
+def _vocabulary():
+    words = list(COMMON_WORDS)
+    for length in itertools.count(2):
+        for parts in itertools.product(SYLLABLES, repeat=length):
+            if len(words) == VOCABULARY_SIZE:
+                return words
+            words.append("".join(parts))
+
+
+def _zipf_weights(n, exponent):
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+WORDS = _vocabulary()
+_WORD_WEIGHTS = _zipf_weights(len(WORDS), 1.07)
+AUTHOR_NAMES = [f"{first} {initial}. {last}"
+                for initial, last, first in itertools.product("ABCDEFGHJKLMNPRSTW", LAST_NAMES, FIRST_NAMES)][:AUTHORS]
+_AUTHOR_WEIGHTS = _zipf_weights(AUTHORS, 1.0)
+
+
+def generate(count, seed=0):
+    """Yield ``count`` synthetic posts, oldest first, the same for the same arguments."""
+    rng = random.Random(seed)
+    # An odd multiplier makes i -> id a permutation of 32-bit numbers
+    multiplier = rng.getrandbits(32) | 1
+    offset = rng.getrandbits(32)
+    for i in range(count):
+        date = LAST_DAY - datetime.timedelta(days=DAYS * (count - 1 - i) // max(count, 1))
+        n_comments = min(int(rng.paretovariate(1.4)) - 1, MAX_COMMENTS)
+        yield {
+            "id": f"{(i * multiplier + offset) & 0xFFFFFFFF:08x}",
+            "title": _sentence(rng, rng.randint(3, 9)).rstrip("."),
+            "content": _text(rng, min(int(rng.lognormvariate(4.5, 0.7)) + 5, 5000)),
+            "author": _author(rng),
+            "date": date.isoformat(),
+            "comments": [_comment(rng, date) for _ in range(n_comments)],
+        }
+
+
+def _sentence(rng, n):
+    return " ".join(rng.choices(WORDS, cum_weights=_WORD_WEIGHTS, k=n)).capitalize() + "."
+
+
+def _text(rng, n):
+    words = rng.choices(WORDS, cum_weights=_WORD_WEIGHTS, k=n)
+    sentences = []
+    i = 0
+    while i < n:
+        end = i + rng.randint(6, 20)
+        sentences.append(" ".join(words[i:end]).capitalize() + ".")
+        i = end
+    return " ".join(sentences)
+
+
+def _author(rng):
+    return AUTHOR_NAMES[bisect.bisect(_AUTHOR_WEIGHTS, rng.random() * _AUTHOR_WEIGHTS[-1])]
+
+
+def _comment(rng, post_date):
+    return {
+        "id": f"{rng.getrandbits(32):08x}",
+        "content": _text(rng, min(int(rng.lognormvariate(2.7, 0.8)) + 1, 400)),
+        "author": _author(rng),
+        "date": min(post_date + datetime.timedelta(days=int(rng.expovariate(0.1))), LAST_DAY).isoformat(),
+    }
+
+
+def batches(posts, size=BATCH):
+    """Split an iterable of posts into lists of at most ``size``."""
+    posts = iter(posts)
+    while True:
+        batch = list(itertools.islice(posts, size))
+        if not batch:
+            return
+        yield batch
+
+
+def fill(store, posts, batch=BATCH):
+    """Add ``posts`` (oldest first) to ``store`` a batch at a time; returns how many."""
+    count = 0
+    for chunk in batches(posts, batch):
+        store.extend(chunk)
+        count += len(chunk)
+    return count
+
+
+def write_service(backend, service_name, posts, data_dir=None):
+    """Write ``posts`` (oldest first) as service ``service_name``'s data for ``backend``; returns the path.
+
+    The service must not have any data yet.
+    """
+    data_dir = data_dir or DATA_DIR
+    if backend == "sqlite":
+        path = os.path.join(data_dir, service_name + ".sqlite3")
+        if os.path.exists(path):
+            raise FileExistsError(f"{path} already exists")
+        os.makedirs(data_dir, exist_ok=True)
+        store = SQLitePostStore(path)
+        try:
+            fill(store, posts)
+        finally:
+            store.close()
+        return path
+    directory = os.path.join(data_dir, service_name)
+    if os.path.isdir(directory) and os.listdir(directory):
+        raise FileExistsError(f"{directory} is not empty")
+    os.makedirs(directory, exist_ok=True)
+    if backend == "mmap":
+        path = os.path.join(directory, journal.MAPPED_SNAPSHOT_FILE)
+        snapshot.write_snapshot(path, posts)
+        return path
+    if backend == "wal":
+        # The header carries the post count, only known once they are written
+        path = os.path.join(directory, journal.SNAPSHOT_FILE)
+        with open(path + ".tmp", "wb") as f, tempfile.TemporaryFile() as records:
+            count = 0
+            for post in posts:
+                records.write(journal.encode(post))
+                count += 1
+            f.write(journal.encode({"segment": 0, "posts": count}))
+            records.seek(0)
+            shutil.copyfileobj(records, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return path
+    raise ValueError(f"Unknown store backend {backend!r}, expected wal, mmap or sqlite")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic blog as a service's data.")
+    parser.add_argument("service", help="service name, e.g. blue-green-app-1")
+    parser.add_argument("--posts", type=int, default=10000, help="posts to generate (default: 10000)")
+    parser.add_argument("--seed", type=int, default=0, help="generator seed (default: 0)")
+    parser.add_argument("--store", choices=("wal", "mmap", "sqlite"), default=os.environ.get("BLOG_STORE", "mmap"),
+                        help="backend to write for (default: BLOG_STORE or mmap)")
+    parser.add_argument("--data-dir", help="data directory (default: BLOG_DATA_DIR or data)")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    try:
+        path = write_service(args.store, args.service, generate(args.posts, args.seed), args.data_dir)
+    except FileExistsError as e:
+        print(f"Not overwriting existing data: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Wrote {args.posts} posts to {path} ({os.path.getsize(path) / 2**20:.1f} MiB) "
+          f"in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
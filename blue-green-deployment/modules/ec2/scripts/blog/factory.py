@@ -0,0 +1,178 @@
+"""Application factory for the blog apps.
+
+``app_1.py``, ``app_2.py`` and ``app_3.py`` used to be copies of the same
+Flask app that differed only in their path prefix, seed posts and service
+name. ``create_app`` builds that app for any prefix; every call gets its
+own ``PostStore``, caches and template globals, so tenants never see each
+other's posts.
+
+One process can serve several tenants: ``mount`` combines apps into a
+single WSGI app that sends each request to the tenant whose prefix the
+path starts with, and ``/`` and ``/health`` to the first one. The server
+does this when given more than one app::
+
+    python -m blog.server app_1:app app_2:app app_3:app --port 80
+
+``BLOG_IMPORT_FROM`` and ``BLOG_REPLICATE_FROM`` are per process, so such
+a process only starts if they name each app's own source with
+``{prefix}`` or ``{service}`` (see ``blog.handoff.source_for``).
+
+``bench/tenants.py`` compares the resident memory of one such process with
+three single-tenant ones.
+"""
+import datetime
+import uuid
+
+from flask import Flask, redirect, render_template, request, url_for
+
+from blog import compression, conditional, dataset, fragments, handoff, health, merkle, metrics, replication, templates
+from blog.pagination import page_args, paginate
+from blog.store import open_store
+
+
+def create_app(prefix, seed, service_name, platform="ECS", version="V1"):
+    """Build the blog app for the tenant served under ``prefix`` (e.g. "/app1").
+
+    ``seed`` is the list of posts a fresh store starts with. The store's
+    backend comes from ``BLOG_STORE`` (see ``blog.store.open_store``) and
+    is available as ``app.extensions["blog_store"]``.
+    """
+    # No static folder: assets are served by blog.assets under the prefix
+    app = Flask(__name__, template_folder=templates.TEMPLATE_DIR, static_folder=None)
+    app.config["BLOG_PREFIX"] = prefix
+    # BLOG_IMPORT_FROM takes the posts over from the live color instead; a
+    # standby (BLOG_REPLICATE_FROM) starts empty and copies them below
+    import_from = handoff.source_for(handoff.IMPORT_FROM, prefix, service_name)
+    replicate_from = handoff.source_for(replication.REPLICATE_FROM, prefix, service_name)
+    synthetic = dataset.SYNTHETIC_POSTS and not (replicate_from or import_from)
+    if replicate_from or synthetic:
+        blog_posts = open_store(service_name)
+    else:
+        # Imported only if the store starts out empty and will load them
+        blog_posts = open_store(service_name, lambda: handoff.initial_posts(service_name, seed, import_from))
+    if synthetic and not len(blog_posts):
+        # BLOG_SYNTHETIC_POSTS: generated posts instead of the seed, for scale tests
+        dataset.fill(blog_posts, dataset.generate(dataset.SYNTHETIC_POSTS, dataset.SYNTHETIC_SEED))
+    app.extensions["blog_store"] = blog_posts
+
+    # Page templates are compiled once at startup instead of on every request
+    templates.init_app(app, prefix, platform=platform)
+    # Post cards on the listing are rendered once per post version and cached
+    fragments.init_app(app, prefix)
+    # Pages carry an ETag/Last-Modified from the store's data version; matches get a 304
+    conditional.init_app(app, blog_posts)
+    # gzip/brotli for HTML and JSON above the size threshold
+    compression.init_app(app)
+    # Token-protected export of the whole store, for the next color to import
+    handoff.init_app(app, prefix, blog_posts, service_name)
+    # Numbered feed of every write for a standby to follow, or follow the live color's
+    replication.init_app(app, prefix, blog_posts, service_name, source=replicate_from)
+    # Hash tree over the posts, to compare and sync two instances cheaply
+    merkle.init_app(app, prefix, blog_posts)
+    # /health from prebuilt bytes ahead of Flask; ?deep=1 from a background prober
+    health.init_app(app, prefix, blog_posts, service_name, version)
+
+    # Decorators register bottom-up: the prefixed rule is url_for('home')
+    @app.route('/')
+    @app.route(prefix)
+    @app.route(prefix + '/')
+    def home():
+        page = blog_posts.page(*page_args(request.args))
+        return render_template(templates.LIST_TEMPLATE, page=page)
+
+    @app.route(prefix + '/new_post')
+    def new_post():
+        return render_template(templates.FORM_TEMPLATE, post=None)
+
+    @app.route(prefix + '/create_post', methods=['POST'])
+    def create_post():
+        blog_posts.add({
+            "id": str(uuid.uuid4())[:8],
+            "title": request.form.get('title'),
+            "content": request.form.get('content'),
+            "author": request.form.get('author'),
+            "date": datetime.datetime.now().strftime("%Y-%m-%d"),
+            "comments": []
+        })
+        return redirect(url_for('home'))
+
+    @app.route(prefix + '/post/<post_id>')
+    def view_post(post_id):
+        post = blog_posts.get(post_id)
+        if post:
+            return render_template(templates.POST_TEMPLATE, post=post)
+        return redirect(url_for('home'))
+
+    @app.route(prefix + '/edit_post/<post_id>')
+    def edit_post_form(post_id):
+        post = blog_posts.get(post_id)
+        if post:
+            return render_template(templates.FORM_TEMPLATE, post=post)
+        return redirect(url_for('home'))
+
+    @app.route(prefix + '/edit_post/<post_id>', methods=['POST'])
+    def edit_post(post_id):
+        blog_posts.update(post_id,
+                          title=request.form.get('title'),
+                          content=request.form.get('content'),
+                          author=request.form.get('author'))
+        return redirect(url_for('view_post', post_id=post_id))
+
+    @app.route(prefix + '/delete_post/<post_id>')
+    def delete_post(post_id):
+        blog_posts.delete(post_id)
+        return redirect(url_for('home'))
+
+    @app.route(prefix + '/add_comment/<post_id>', methods=['POST'])
+    def add_comment(post_id):
+        blog_posts.add_comment(post_id, {
+            "id": str(uuid.uuid4())[:8],
+            "content": request.form.get('content'),
+            "author": request.form.get('author'),
+            "date": datetime.datetime.now().strftime("%Y-%m-%d")
+        })
+        return redirect(url_for('view_post', post_id=post_id))
+
+    @app.route(prefix + '/search')
+    def search():
+        query = request.args.get('q', '').lower()
+        if query:
+            page = paginate(blog_posts.search(query), *page_args(request.args))
+            return render_template(templates.SEARCH_TEMPLATE, page=page, search_query=query)
+        return redirect(url_for('home'))
+
+    # Per-endpoint counters and latency histograms at /metrics; last, to see every route
+    metrics.init_app(app, prefix, blog_posts, service_name)
+    return app
+
+
+def mount(apps):
+    """Serve several tenant apps from one WSGI app, routed by their prefix.
+
+    Paths outside every prefix (``/``, ``/health``) go to the first app.
+    """
+    check_sources(len(apps))
+    default = apps[0]
+    tenants = {app.config["BLOG_PREFIX"]: app for app in apps}
+
+    def dispatch(environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        # "/app1/post/1" -> "/app1"; the environ is passed on untouched
+        app = tenants.get("/" + path.lstrip("/").partition("/")[0], default)
+        return app(environ, start_response)
+
+    return dispatch
+
+
+def check_sources(apps):
+    """Raise ValueError if ``apps`` apps in one process would import or replicate from one source.
+
+    ``blog.server`` calls it before building the apps, so none has imported yet.
+    """
+    if apps < 2:
+        return
+    sources = (("BLOG_IMPORT_FROM", handoff.IMPORT_FROM), ("BLOG_REPLICATE_FROM", replication.REPLICATE_FROM))
+    for name, source in sources:
+        if source and not any(placeholder in source for placeholder in handoff.SOURCE_PLACEHOLDERS):
+            raise ValueError(f"{name} would be the same for all {apps} apps in this process; "
+                             f"put {{prefix}} or {{service}} in it, or run one app per process")
@@ -0,0 +1,191 @@
+"""Health checks for the blog apps.
+
+Liveness
+    ``GET /health`` and ``GET /appN/health`` are hit by the ALB every 30s
+    on every target, and by ECS on top of that. The body never changes,
+    so it is serialized once at startup and answered in front of Flask:
+    a plain ``GET`` or ``HEAD`` for either path (no query string) gets the
+    prebuilt status line, headers and bytes without routing, a request
+    context or any ``before/after_request`` hook running. Once the store's
+    write-ahead log has failed (see ``blog.journal``) the app can no longer
+    keep writes, and liveness answers a prebuilt 503 instead.
+Deep
+    ``GET /appN/health?deep=1`` reports the app's dependencies instead: the
+    store (a listing page and a lookup), search (whether the newest post is
+    indexed, without running a query), the write-ahead log if there is one,
+    and, on a standby, replication lag (see ``blog.replication``). The
+    probes are run by a background thread every ``BLOG_HEALTH_INTERVAL``
+    seconds (default 10) and the request only returns the latest results,
+    serialized when they were gathered, so a slow or stuck dependency never
+    holds up a request thread. The answer is 200 when every probe passed and
+    503 otherwise (also until the first round has finished), and says when
+    the probes ran. Replication fails the check until the standby has copied
+    the store, and once it is more than ``BLOG_HEALTH_MAX_LAG`` seconds
+    (default 5) behind.
+Readiness
+    ``GET /ready`` and ``GET /appN/ready`` answer 200 until the server
+    starts shutting down, then 503 (see ``blog.server``), also from
+    prebuilt bytes. Liveness stays 200 while the requests in flight
+    finish.
+"""
+import datetime
+import os
+import threading
+import time
+
+from flask import request
+
+from blog import compression
+
+INTERVAL = float(os.environ.get("BLOG_HEALTH_INTERVAL", "10"))
+MAX_LAG = float(os.environ.get("BLOG_HEALTH_MAX_LAG", "5"))
+
+
+class Prober:
+    """Runs the deep probes on an interval and keeps their latest results, serialized."""
+
+    def __init__(self, app, store, service_name, interval=INTERVAL, max_lag=MAX_LAG):
+        self.app = app
+        self.store = store
+        self.service_name = service_name
+        self.interval = interval
+        self.max_lag = max_lag
+        # (status code, serialized payload), replaced whole after every round
+        self.result = (503, compression.Payload.from_json({"status": "starting", "service": service_name}))
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def ensure_running(self):
+        # Threads do not survive a fork: each worker process starts its own
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._run, name="health-probes", daemon=True).start()
+
+    def probe(self):
+        """Run every probe once and publish the results."""
+        probes = {"store": self._probe_store, "search": self._probe_search}
+        if getattr(self.store, "journal", None) is not None:
+            probes["journal"] = self._probe_journal
+        if self.app.extensions.get("blog_replica") is not None:
+            probes["replication"] = self._probe_replication
+        results = {}
+        for name, probe in probes.items():
+            started = time.perf_counter()
+            try:
+                result = probe()
+            except Exception as e:  # a probe reports failures, whatever they are
+                result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            result["ms"] = round((time.perf_counter() - started) * 1000, 2)
+            results[name] = result
+        healthy = all(result["ok"] for result in results.values())
+        self.result = (200 if healthy else 503), compression.Payload.from_json({
+            "status": "healthy" if healthy else "unhealthy",
+            "service": self.service_name,
+            "checked_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "probes": results,
+        })
+
+    def _run(self):
+        while True:
+            self.probe()
+            time.sleep(self.interval)
+
+    def _probe_store(self):
+        page = self.store.page(limit=1)
+        if page.posts:
+            post_id = page.posts[0]["id"]
+            if self.store.get(post_id) is None:
+                return {"ok": False, "error": f"newest post {post_id} not found by id"}
+        return {"ok": True, "posts": len(self.store)}
+
+    def _probe_search(self):
+        # Not a query: that would scan every post (and page in a whole
+        # mapped snapshot) every round. Search must see the newest post
+        page = self.store.page(limit=1)
+        if page.posts and not self.store.indexed(page.posts[0]["id"]):
+            return {"ok": False, "error": f"newest post {page.posts[0]['id']} is not searchable"}
+        return {"ok": True}
+
+    def _probe_journal(self):
+        error = self.store.journal.error
+        if error is not None:
+            return {"ok": False, "error": f"{type(error).__name__}: {error}"}
+        return {"ok": True, "commits": self.store.journal.commits}
+
+    def _probe_replication(self):
+        status = self.app.extensions["blog_replica"].status()
+        # A promoted standby no longer follows anything and is fine
+        lagging = status["following"] and status["lag_seconds"] > self.max_lag
+        return dict(status, ok=status["synced"] and status["error"] is None and not lagging)
+
+
+def init_app(app, app_prefix, store, service_name, version):
+    """Serve liveness from prebuilt bytes and deep checks from a background prober."""
+    paths = frozenset(("/health", app_prefix + "/health"))
+    liveness = compression.Payload.from_json({"status": "healthy", "version": version, "service": service_name})
+    _, headers, _ = _prebuilt("200 OK", liveness)
+    unhealthy = compression.Payload.from_json({"status": "unhealthy", "version": version, "service": service_name,
+                                               "error": "write-ahead log failed"})
+    failed = _prebuilt("503 Service Unavailable", unhealthy)
+    prober = Prober(app, store, service_name)
+    prober.ensure_running()
+
+    ready_paths = frozenset(("/ready", app_prefix + "/ready"))
+    ready = _prebuilt("200 OK", {"status": "ready", "service": service_name})
+    draining = _prebuilt("503 Service Unavailable", {"status": "draining", "service": service_name})
+
+    wsgi_app = app.wsgi_app
+
+    def answer_prebuilt(environ, start_response):
+        method = environ.get("REQUEST_METHOD")
+        if method in ("GET", "HEAD"):
+            path = environ.get("PATH_INFO")
+            if path in paths and not environ.get("QUERY_STRING"):
+                journal = getattr(store, "journal", None)
+                if journal is not None and journal.error is not None:
+                    status, failed_headers, body = failed
+                    environ["blog.endpoint"], environ["blog.status"] = "health", 503
+                    start_response(status, failed_headers)
+                    return [body] if method == "GET" else []
+                # For blog.metrics, as no after_request hook runs
+                environ["blog.endpoint"], environ["blog.status"] = "health", 200
+                start_response("200 OK", headers)
+                return [liveness.body] if method == "GET" else []
+            if path in ready_paths:
+                # Set by blog.server; the development server is always ready
+                is_ready = environ.get("blog.ready", True)
+                status, ready_headers, body = ready if is_ready else draining
+                environ["blog.endpoint"], environ["blog.status"] = "ready", 200 if is_ready else 503
+                start_response(status, ready_headers)
+                return [body] if method == "GET" else []
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = answer_prebuilt
+
+    # Requests with a query string: ?deep=1, or liveness the ordinary way
+    def health():
+        """Health check endpoint required for blue-green deployment"""
+        if request.args.get("deep") not in (None, "", "0"):
+            prober.ensure_running()
+            status, payload = prober.result
+            return payload.response(status)
+        journal = getattr(store, "journal", None)
+        if journal is not None and journal.error is not None:
+            return unhealthy.response(503)
+        return liveness.response()
+
+    # The prefixed rule first, so it is what url_for('health') builds
+    app.add_url_rule(app_prefix + "/health", "health", health)
+    app.add_url_rule("/health", "health", health)
+    return prober
+
+
+def _prebuilt(status, payload):
+    """(status line, headers, body) of a response that is built once."""
+    if not isinstance(payload, compression.Payload):
+        payload = compression.Payload.from_json(payload)
+    headers = [("Content-Type", payload.mimetype), ("Content-Length", str(len(payload.body))),
+               ("Vary", "Accept-Encoding"), ("Cache-Control", "no-store")]
+    return status, headers, payload.body
@@ -0,0 +1,288 @@
+"""Write-ahead log for the in-memory post store.
+
+With ``BLOG_STORE=wal`` the blog keeps serving from the in-memory
+``PostStore`` but records every write (new post, edit, delete, comment)
+in an append-only log under ``BLOG_DATA_DIR/<service>/``, so posts
+survive a restart. The log belongs to a single process: run one worker
+(the default) per data directory.
+
+Group commit
+    Writers append their record to a buffer and wait; one flusher thread
+    writes everything buffered since its last round and fsyncs once. A
+    request returns only after its write is on disk, and while one fsync
+    is in flight the writes arriving behind it pile up for the next, so
+    concurrent writers share the cost instead of queueing an fsync each.
+    If a write or fsync fails (a full or failing disk), the log stops:
+    the writers waiting on it, and every later one, get a ``JournalError``
+    (the write is served from memory but not durable), and ``/health``
+    turns unhealthy (see ``blog.health``) so the task gets replaced.
+
+Compaction
+    A background thread watches the log. Once it has grown past
+    ``BLOG_WAL_COMPACT_BYTES`` it cuts the log into a new segment at a
+    point where no write is in progress, writes every post as of that
+    point to a snapshot file (from the store's immutable snapshot, so
+    requests keep being served), and deletes the segments the snapshot
+    covers.
+
+Recovery
+    On start the snapshot is loaded in bulk (or, with ``BLOG_STORE=mmap``,
+    just mapped; see ``blog.snapshot``) and the log segments written
+    after it are replayed on top. Every record carries a CRC; a torn
+    record at the end of a segment (a crash mid-write) ends that segment.
+    ``exists`` tells a data directory that has never been written from
+    one whose posts have all been deleted, so only the first gets seeded.
+
+Records are JSON lines: ``<crc32 hex> ["add_comment", "<post id>", {...}]``.
+``bench/journal.py`` measures write throughput and recovery time.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from blog.records import json_default
+
+COMPACT_BYTES = int(os.environ.get("BLOG_WAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+COMPACT_INTERVAL = float(os.environ.get("BLOG_WAL_COMPACT_INTERVAL", "10"))
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+# Stores that keep their own snapshot format (blog.snapshot.MappedPostStore)
+# provide load_snapshot()/save_snapshot() and use this file instead
+MAPPED_SNAPSHOT_FILE = "snapshot.map"
+SEGMENT_PATTERN = "log.%08d"
+
+logger = logging.getLogger(__name__)
+
+
+class JournalError(OSError):
+    """The log could not be written; the write is in memory but not durable."""
+
+
+def encode(record):
+    data = json.dumps(record, separators=(",", ":"), default=json_default).encode()
+    return b"%08x %s\n" % (zlib.crc32(data), data)
+
+
+def decode(lines):
+    """Yield the records in ``lines``, stopping at the first torn or corrupt one."""
+    for line in lines:
+        crc, _, data = line.rstrip(b"\n").partition(b" ")
+        try:
+            intact = line.endswith(b"\n") and len(crc) == 8 and int(crc, 16) == zlib.crc32(data)
+        except ValueError:  # not hex
+            intact = False
+        if not intact:
+            logger.warning("Log replay stopped at a torn or corrupt record")
+            return
+        yield json.loads(data)
+
+
+class Journal:
+    """Append-only, group-committed log of the writes to one ``PostStore``."""
+
+    def __init__(self, directory, compact_bytes=COMPACT_BYTES, compact_interval=COMPACT_INTERVAL):
+        self.directory = directory
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+        os.makedirs(directory, exist_ok=True)
+        self._cond = threading.Condition()
+        self._pending = []  # encoded records not yet written
+        self._appended = 0  # records handed to append() so far
+        self._durable = 0  # ... of which written and fsynced
+        self._closed = False
+        self.error = None  # the OSError that stopped the log, if any
+        self._file = None
+        self._segment = 0
+        self._store = None
+        self.commits = 0  # fsyncs done, each covering one group of records
+
+    def exists(self):
+        """True if a snapshot or log segment has ever been written here."""
+        snapshots = (SNAPSHOT_FILE, MAPPED_SNAPSHOT_FILE)
+        return bool(self._segments()) or any(os.path.exists(os.path.join(self.directory, name))
+                                             for name in snapshots)
+
+    def open(self, store):
+        """Load the snapshot and replay the log into ``store``, then start logging its writes.
+
+        Returns the number of records replayed, snapshot posts included;
+        0 means there was nothing on disk.
+        """
+        replayed = 0
+        snapshot = os.path.join(self.directory, SNAPSHOT_FILE)
+        first_segment = 0
+        if hasattr(store, "load_snapshot"):
+            mapped = os.path.join(self.directory, MAPPED_SNAPSHOT_FILE)
+            first_segment = store.load_snapshot(mapped if os.path.exists(mapped) else None)
+            replayed += len(store)
+        elif os.path.exists(snapshot):
+            with open(snapshot, "rb") as f:
+                records = decode(f)
+                first_segment = next(records)["segment"]
+                posts = list(records)
+            store.extend(posts)
+            replayed += len(posts)
+        last_segment = first_segment
+        for segment in self._segments():
+            if segment < first_segment:
+                continue
+            with open(self._path(segment), "rb") as f:
+                for op, *args in decode(f):
+                    apply(store, op, args)
+                    replayed += 1
+            last_segment = segment
+        # Never append after a possibly torn record: always start a new segment
+        self._start_segment(last_segment + 1)
+        self._store = store
+        store.journal = self
+        threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True).start()
+        threading.Thread(target=self._compact_loop, name="journal-compact", daemon=True).start()
+        return replayed
+
+    def append(self, record):
+        """Buffer ``record``; returns the sequence number to ``wait`` on."""
+        line = encode(record)
+        with self._cond:
+            if self.error is None:  # nothing writes the buffer any more
+                self._pending.append(line)
+            self._appended += 1
+            self._cond.notify_all()
+            return self._appended
+
+    def wait(self, seq):
+        """Block until record ``seq`` has been fsynced; raises ``JournalError`` if it never will be."""
+        with self._cond:
+            while self._durable < seq and not self._closed and self.error is None:
+                self._cond.wait()
+            self._raise_if_failed(seq)
+
+    def compact(self):
+        """Snapshot the store and delete the log segments the snapshot covers."""
+        segment = None
+
+        def cut():
+            nonlocal segment
+            # Writes are held off: everything buffered belongs to the old segment
+            self._drain()
+            segment = self._segment + 1
+            self._start_segment(segment)
+            return segment
+
+        if hasattr(self._store, "save_snapshot"):
+            self._store.save_snapshot(os.path.join(self.directory, MAPPED_SNAPSHOT_FILE), cut)
+            count = len(self._store)
+        else:
+            posts = self._store.checkpoint(cut)
+            path = os.path.join(self.directory, SNAPSHOT_FILE)
+            with open(path + ".tmp", "wb") as f:
+                f.write(encode({"segment": segment, "posts": len(posts)}))
+                for post in posts:
+                    f.write(encode(post))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            count = len(posts)
+        _fsync_dir(self.directory)
+        for old in self._segments():
+            if old < segment:
+                os.remove(self._path(old))
+        return count
+
+    def close(self):
+        """Flush what is buffered and stop the background threads."""
+        self._drain()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._file.close()
+
+    def _drain(self):
+        with self._cond:
+            target = self._appended
+            while self._durable < target and not self._closed and self.error is None:
+                self._cond.wait()
+            self._raise_if_failed(target)
+
+    def _raise_if_failed(self, seq):
+        # Caller holds _cond
+        if self._durable < seq and self.error is not None:
+            raise JournalError(f"write-ahead log failed: {self.error}") from self.error
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                batch, self._pending = self._pending, []
+                upto = self._appended
+                f = self._file
+            try:
+                f.write(b"".join(batch))
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError as e:
+                # After a failed fsync the file's contents are unknown: stop
+                # rather than retry, and fail the waiting writers
+                logger.critical("Write-ahead log failed (%s); writes are no longer durable", e)
+                with self._cond:
+                    self.error = e
+                    self._pending = []
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._durable = upto
+                self.commits += 1
+                self._cond.notify_all()
+
+    def _compact_loop(self):
+        while not self._closed:
+            time.sleep(self.compact_interval)
+            try:
+                if not self._closed and os.path.getsize(self._path(self._segment)) >= self.compact_bytes:
+                    started = time.perf_counter()
+                    count = self.compact()
+                    logger.info("Compacted the journal into a snapshot of %d posts in %.1fs",
+                                count, time.perf_counter() - started)
+            except OSError:
+                logger.exception("Journal compaction failed; the log keeps growing")
+
+    def _start_segment(self, segment):
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self._path(segment), "ab")
+            self._segment = segment
+        _fsync_dir(self.directory)
+
+    def _segments(self):
+        names = glob.glob(os.path.join(self.directory, "log.*"))
+        return sorted(int(name.rsplit(".", 1)[1]) for name in names if name.rsplit(".", 1)[1].isdigit())
+
+    def _path(self, segment):
+        return os.path.join(self.directory, SEGMENT_PATTERN % segment)
+
+
+def apply(store, op, args):
+    """Apply the write recorded as ``[op, *args]`` to ``store``; also used by blog.replication."""
+    if op == "update":
+        post_id, fields = args
+        store.update(post_id, **fields)
+    elif op in ("add", "extend", "delete", "add_comment"):
+        getattr(store, op)(*args)
+    else:
+        raise ValueError(f"Unknown journal record {op!r}")
+
+
+def _fsync_dir(directory):
+    # Make a created, renamed or deleted file itself durable
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,284 @@
+"""Merkle tree over the posts, to compare and sync two app instances.
+
+Before the listener is flipped, blue and green should hold the same
+posts. Comparing them by exporting both stores costs the size of the
+blog; with a hash tree it costs the size of the difference.
+
+Tree
+    Each post (comments included) is hashed, and posts are grouped into
+    ``16 ** DEPTH`` leaves by a hash of their id. A leaf's hash covers
+    its posts' ids and hashes; every other node's hash covers its 16
+    children's. Two stores hold the same posts exactly when their root
+    hashes match, and the subtrees that differ lead straight to the posts
+    that do. Listing order is not part of the hash.
+Updates
+    The tree listens to the store's writes and only remembers which posts
+    changed; the next request hashes those posts again and the nodes
+    above them. The SQLite store is written by several processes, so
+    there the tree is rebuilt whenever the store's data version moved.
+Endpoints
+    ``GET /appN/admin/merkle`` returns the root hash and post count.
+    ``POST /appN/admin/merkle`` with ``{"nodes": [<prefix>, ...]}``
+    returns those nodes, named by hex prefix ("" is the root), with their
+    children's hashes or, for leaves, their posts' hashes.
+    ``POST /appN/admin/merkle/records`` with ``{"ids": [...]}`` returns
+    those posts, and ``POST /appN/admin/merkle/apply`` with ``{"posts":
+    [...], "delete": [...]}`` writes them. They need the handoff token
+    (``BLOG_HANDOFF_TOKEN``) and do not exist without one.
+
+Comparing walks both trees one level at a time, fetching only the
+children of nodes that differ, so it takes ``DEPTH + 1`` round trips and
+transfers, per differing post, ``16 * DEPTH`` node hashes and the post
+hashes of one leaf (``posts / 4096`` of them)::
+
+    python -m blog.merkle diff http://blue/app1 http://green/app1
+    python -m blog.merkle sync http://blue/app1 http://green/app1
+
+``diff`` exits 1 if the two differ; ``sync`` makes the second match the
+first by copying only the differing posts. ``bench/merkle.py`` measures
+both against a full export.
+"""
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+import urllib.request
+
+from flask import jsonify, request
+
+from blog import handoff, records
+
+DEPTH = 3
+HEX = "0123456789abcdef"
+# The post fields that are hashed; backends may add their own (comment_count)
+FIELDS = ("id", "title", "content", "author", "date", "comments")
+
+MERKLE_PATH = "/admin/merkle"
+
+
+def post_hash(post):
+    data = json.dumps([post.get(field) for field in FIELDS], separators=(",", ":"), sort_keys=True,
+                      default=records.json_default)
+    # Only ever compared with the same post's hash elsewhere: 64 bits will do,
+    # and keeps the leaves sent over the wire small
+    return hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+
+
+def leaf_of(post_id):
+    return hashlib.blake2b(post_id.encode(), digest_size=8).hexdigest()[:DEPTH]
+
+
+class MerkleTree:
+    """Hash tree over the posts in ``store``, kept up to date with its writes."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()  # the tree
+        self._dirty_lock = threading.Lock()  # the posts written since the last refresh
+        self._leaves = {}  # leaf prefix -> {post id: post hash}
+        self._hashes = {}  # node prefix -> hash, for nodes with nothing changed below
+        self._version = None
+        self._listening = hasattr(store, "listeners")
+        self._dirty = set()
+        if self._listening:
+            store.listeners.append(self._touch)
+            with self._dirty_lock:
+                self._dirty.update(post["id"] for post in store)
+
+    def root(self):
+        return self.nodes([""])[""]["hash"]
+
+    def nodes(self, prefixes):
+        """Return ``{prefix: node}`` for the nodes named by ``prefixes``."""
+        with self._lock:
+            self._refresh()
+            nodes = {}
+            for prefix in prefixes:
+                if len(prefix) == DEPTH:
+                    nodes[prefix] = {"hash": self._node_hash(prefix), "posts": dict(self._leaves.get(prefix, {}))}
+                elif len(prefix) < DEPTH and all(c in HEX for c in prefix):
+                    nodes[prefix] = {"hash": self._node_hash(prefix),
+                                     "children": [self._node_hash(prefix + c) for c in HEX]}
+            return nodes
+
+    def records(self, ids):
+        """Return ``{id: post or None}``."""
+        return {post_id: records.to_dict(self.store.get(post_id)) for post_id in ids}
+
+    def apply(self, posts=(), delete=()):
+        """Write ``posts`` (added or replaced) and delete the posts with the ``delete`` ids."""
+        for post in posts:
+            self.store.add(post)
+        for post_id in delete:
+            self.store.delete(post_id)
+
+    def _touch(self, record):
+        # A store listener: called with the store's write lock held, so only
+        # note which posts changed
+        op, *args = record
+        if op == "extend":
+            ids = [post["id"] for post in args[0]]
+        else:
+            ids = [args[0]["id"] if op == "add" else args[0]]
+        with self._dirty_lock:
+            self._dirty.update(ids)
+
+    def _refresh(self):
+        # Caller holds self._lock. Writes go on meanwhile: a post written
+        # after its hash is taken here is marked dirty again
+        if not self._listening:
+            version = self.store.data_version
+            if version != self._version:
+                self._version = version
+                self._leaves, self._hashes = {}, {}
+                self._dirty = {post["id"] for post in self.store}
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        for post_id in dirty:
+            leaf = leaf_of(post_id)
+            post = self.store.get(post_id)
+            if post is None:
+                self._leaves.get(leaf, {}).pop(post_id, None)
+            else:
+                self._leaves.setdefault(leaf, {})[post_id] = post_hash(post)
+            for depth in range(DEPTH + 1):
+                self._hashes.pop(leaf[:depth], None)
+
+    def _node_hash(self, prefix):
+        node = self._hashes.get(prefix)
+        if node is None:
+            if len(prefix) == DEPTH:
+                posts = self._leaves.get(prefix, {})
+                node = _hash("".join(f"{post_id} {posts[post_id]}\n" for post_id in sorted(posts)))
+            else:
+                node = _hash("".join(self._node_hash(prefix + c) for c in HEX))
+            self._hashes[prefix] = node
+        return node
+
+
+class RemoteTree:
+    """The tree of a running app, e.g. ``http://<host>/app1``, over HTTP."""
+
+    def __init__(self, url, token=handoff.TOKEN, timeout=30):
+        self.url = url.rstrip("/") + MERKLE_PATH
+        self.token = token
+        self.timeout = timeout
+        self.requests = 0
+        self.bytes = 0  # response bytes received
+
+    def root(self):
+        return self._call("", None)["hash"]
+
+    def nodes(self, prefixes):
+        return self._call("", {"nodes": list(prefixes)})
+
+    def records(self, ids):
+        return self._call("/records", {"ids": list(ids)})
+
+    def apply(self, posts=(), delete=()):
+        self._call("/apply", {"posts": list(posts), "delete": list(delete)})
+
+    def _call(self, path, payload):
+        data = json.dumps(payload, default=records.json_default).encode() if payload is not None else None
+        req = urllib.request.Request(self.url + path, data, {"Authorization": f"Bearer {self.token}",
+                                                             "Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            body = response.read()
+        self.requests += 1
+        self.bytes += len(body)
+        return json.loads(body)
+
+
+def diff(a, b):
+    """Return the ids of the posts that differ between trees ``a`` and ``b``, sorted.
+
+    Either tree may be a ``MerkleTree`` or a ``RemoteTree``.
+    """
+    ids = []
+    frontier = [""]
+    while frontier:
+        left, right = a.nodes(frontier), b.nodes(frontier)
+        below = []
+        for prefix in frontier:
+            mine, theirs = left[prefix], right[prefix]
+            if mine["hash"] == theirs["hash"]:
+                continue
+            if "posts" in mine:
+                posts, other = mine["posts"], theirs["posts"]
+                ids.extend(post_id for post_id in posts.keys() | other.keys()
+                           if posts.get(post_id) != other.get(post_id))
+            else:
+                below.extend(prefix + c for c, x, y in zip(HEX, mine["children"], theirs["children"]) if x != y)
+        frontier = below
+    return sorted(ids)
+
+
+def sync(source, target):
+    """Make ``target`` hold the same posts as ``source``; returns the ids that differed."""
+    ids = diff(source, target)
+    records = source.records(ids)
+    target.apply([post for post in records.values() if post is not None],
+                 [post_id for post_id, post in records.items() if post is None])
+    return ids
+
+
+def init_app(app, app_prefix, store, token=handoff.TOKEN):
+    """Keep a Merkle tree over ``store`` and register its routes, when a handoff token is configured."""
+    if not token:
+        return None
+    tree = app.extensions["blog_merkle"] = MerkleTree(store)
+
+    def merkle_root():
+        handoff.require_token(token)
+        return jsonify(hash=tree.root(), posts=len(store))
+
+    def merkle_nodes():
+        handoff.require_token(token)
+        return jsonify(tree.nodes(request.get_json(force=True)["nodes"]))
+
+    def merkle_records():
+        handoff.require_token(token)
+        return jsonify(tree.records(request.get_json(force=True)["ids"]))
+
+    def merkle_apply():
+        handoff.require_token(token)
+        payload = request.get_json(force=True)
+        tree.apply(payload.get("posts", ()), payload.get("delete", ()))
+        return jsonify(hash=tree.root(), posts=len(store))
+
+    app.add_url_rule(app_prefix + MERKLE_PATH, "merkle_root", merkle_root)
+    app.add_url_rule(app_prefix + MERKLE_PATH, "merkle_nodes", merkle_nodes, methods=["POST"])
+    app.add_url_rule(app_prefix + MERKLE_PATH + "/records", "merkle_records", merkle_records, methods=["POST"])
+    app.add_url_rule(app_prefix + MERKLE_PATH + "/apply", "merkle_apply", merkle_apply, methods=["POST"])
+    return tree
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare, or sync, the posts of two running blog apps.")
+    parser.add_argument("command", choices=["diff", "sync"])
+    parser.add_argument("source", help="e.g. http://blue/app1")
+    parser.add_argument("target", help="e.g. http://green/app1; sync makes it match the source")
+    args = parser.parse_args(argv)
+
+    source, target = RemoteTree(args.source), RemoteTree(args.target)
+    started = time.monotonic()
+    ids = diff(source, target) if args.command == "diff" else sync(source, target)
+    print(f"{len(ids)} posts differ ({source.requests + target.requests} requests, "
+          f"{(source.bytes + target.bytes) / 1024:.1f} KiB, {time.monotonic() - started:.2f}s)")
+    for post_id in ids[:20]:
+        print(f"  {post_id}")
+    if args.command == "diff" and ids:
+        sys.exit(1)
+    if args.command == "sync" and target.root() != source.root():
+        print("Still different: the source was written to during the sync", file=sys.stderr)
+        sys.exit(1)
+
+
+def _hash(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Continuous replication from the live color to a standby.
+
+The handoff in ``blog.handoff`` copies the whole store once, at switch
+time, so the switch waits for a full export and import. With replication
+the new color copies the store when it starts and then follows every
+write the live color makes, so at switch time only the last few writes
+are left to catch up on.
+
+Change feed
+    Every write to the store (new post, edit, delete, comment) gets the
+    next sequence number and is kept in memory, the last
+    ``BLOG_CHANGELOG_SIZE`` of them (default 100000). ``GET
+    /appN/admin/changes?after=<seq>&epoch=<epoch>&wait=<seconds>`` returns
+    the writes after ``seq`` as newline-delimited JSON, one ``{"seq",
+    "ts", "op"}`` line each (``op`` is the record the journal would log,
+    see ``blog.journal``). When there are none yet the request waits up
+    to ``wait`` seconds for one (a long poll), so a caught-up standby
+    hears of a write as soon as it is made. The ``X-Blog-Changes-Head``
+    header carries the latest sequence number. The epoch changes every
+    time the app starts; a standby asking with another epoch, or for
+    writes that have already dropped out of memory, gets a 410 and must
+    be restarted to copy the store again. The export (``blog.handoff``)
+    records the sequence number it is exact as of, which is where a
+    standby starts to follow. When the server starts draining it closes
+    the feed (``close_feeds``): waiting long polls return at once and
+    later ones get a 503, so none holds the shutdown up.
+Standby
+    When ``BLOG_REPLICATE_FROM`` is set to the live app's URL
+    (``http://<host>/app1``, or ``http://<host>{prefix}`` for a process
+    serving several apps, see ``blog.handoff.source_for``), the app imports
+    the live store at startup, with the same token and timeout as the
+    handoff, and a background thread then long-polls the change feed and
+    applies each write in order. It starts from the import, not its seed or
+    its own data directory: run standbys with ``BLOG_STORE=memory`` (the
+    default) or an empty data directory. If the import fails, the app still
+    starts, empty, and the thread keeps retrying it every second; until it
+    succeeds the deep health check fails and a promote answers 503.
+Lag
+    ``GET /appN/admin/replication`` reports the app's own feed position
+    and, on a standby, ``lag_entries`` (writes the live color has made
+    that are not applied yet), ``lag_seconds`` (how long the standby has
+    been behind, 0 when caught up) and the time since it last heard from
+    the live color.
+Switch
+    ``POST /appN/admin/replication/promote?timeout=<seconds>`` asks the
+    live color for its latest sequence number, waits until the standby
+    has applied it, and then stops following; it answers 200 once caught
+    up and 503 if the timeout (default 10s) ran out first. Shift traffic
+    after it returns. From then on the standby is a primary with its own
+    feed, which the next standby can follow.
+
+On ECS, set ``BLOG_HANDOFF_TOKEN`` on both services and
+``BLOG_REPLICATE_FROM`` on the new one. On EC2 the switch replaces the
+app in place, so there is no standby and the switch script keeps using
+the one-off handoff. All routes need the handoff token and do not exist
+without one. The SQLite backend (``BLOG_STORE=sqlite``) is shared by all
+processes on a host and has no change feed. ``bench/replication.py``
+runs a primary and a standby and measures the lag.
+"""
+import collections
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import weakref
+
+from flask import Response, jsonify, request
+
+from blog import handoff, journal, records
+
+REPLICATE_FROM = os.environ.get("BLOG_REPLICATE_FROM", "")
+CHANGELOG_SIZE = int(os.environ.get("BLOG_CHANGELOG_SIZE", "100000"))
+
+CHANGES_PATH = "/admin/changes"
+STATUS_PATH = "/admin/replication"
+PROMOTE_PATH = "/admin/replication/promote"
+
+# Seconds a feed request waits for a write, and the most it may ask for
+MAX_WAIT = 30
+# Writes per feed response
+BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+# Every ChangeLog in this process, for close_feeds()
+_feeds = weakref.WeakSet()
+
+
+class Gone(Exception):
+    """The feed no longer holds the writes a standby needs next."""
+
+
+class ChangeLog:
+    """Sequence-numbered record of the latest writes to one store."""
+
+    def __init__(self, size=CHANGELOG_SIZE):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.last_seq = 0
+        self._entries = collections.deque(maxlen=size)  # (seq, ts, record)
+        self._cond = threading.Condition()
+        self.closed = False
+        _feeds.add(self)
+
+    def append(self, record):
+        """Number ``record``; called by the store with its write lock held."""
+        with self._cond:
+            self.last_seq += 1
+            self._entries.append((self.last_seq, time.time(), record))
+            self._cond.notify_all()
+
+    def close(self):
+        """Stop waiting for writes: long polls in progress return at once, later ones don't wait."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def since(self, after, wait=0.0, limit=BATCH_SIZE):
+        """Return up to ``limit`` entries after sequence number ``after``.
+
+        Waits up to ``wait`` seconds for one if there are none yet, unless
+        the feed is closed; raises ``Gone`` when ``after`` is not a
+        position in this feed any more.
+        """
+        deadline = time.monotonic() + wait
+        with self._cond:
+            if after > self.last_seq:
+                raise Gone(f"position {after} is ahead of the feed ({self.last_seq})")
+            while self.last_seq == after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.closed:
+                    return []
+                self._cond.wait(remaining)
+            first = self._entries[0][0]
+            if after < first - 1:
+                raise Gone(f"writes after {after} are gone; the feed starts at {first}")
+            start = after - first + 1
+            return list(itertools.islice(self._entries, start, start + limit))
+
+
+class Replica:
+    """Follows the change feed of the app at ``source`` into ``store``."""
+
+    def __init__(self, store, source, token=handoff.TOKEN):
+        self.store = store
+        self.source = source.rstrip("/")
+        self.token = token
+        self.seq = 0  # the source's sequence number last applied here
+        self.head = 0  # ... and the latest one it has reported
+        self.epoch = None
+        self.error = None
+        self._contact = None
+        self._caught_up = time.monotonic()
+        self._stopped = False
+        self._cond = threading.Condition()
+
+    def sync(self, timeout=handoff.IMPORT_TIMEOUT):
+        """Copy the source's store into ``store``, which must be empty; returns the post count."""
+        started = time.monotonic()
+        with handoff.open_export(self.source, self.token, timeout) as lines:
+            header, posts = handoff.read_export(lines, started + timeout)
+        if "seq" not in header:
+            raise ValueError(f"{self.source} has no change feed")
+        self.store.extend(reversed(posts))
+        with self._cond:
+            self.seq = self.head = header["seq"]
+            self.epoch = header["epoch"]
+            self._contact = time.monotonic()
+            self.error = None
+        return len(posts)
+
+    def start(self):
+        threading.Thread(target=self._run, name="replica", daemon=True).start()
+
+    def status(self):
+        with self._cond:
+            now = time.monotonic()
+            lag = max(self.head - self.seq, 0)
+            return {
+                "source": self.source,
+                "following": not self._stopped,
+                "synced": self.epoch is not None,
+                "applied_seq": self.seq,
+                "source_seq": self.head,
+                "lag_entries": lag,
+                "lag_seconds": round(now - self._caught_up, 3) if lag else 0.0,
+                "last_contact_seconds": round(now - self._contact, 3) if self._contact else None,
+                "error": self.error,
+            }
+
+    def promote(self, timeout):
+        """Apply the source's writes up to its latest one, then stop following.
+
+        Returns whether the standby caught up before ``timeout`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        if self.epoch is None:
+            # Never copied the store: nothing to catch up from, keep trying
+            return False
+        try:
+            with self._open(STATUS_PATH, timeout) as response:
+                target = json.load(response)["seq"]
+        except (OSError, ValueError, KeyError) as e:
+            # The live color is already gone: what it reported last is all there is
+            logger.warning("Could not ask %s for its latest write (%s); promoting at %d",
+                           self.source, e, self.head)
+            target = self.head
+        with self._cond:
+            self.head = max(self.head, target)
+            while self.seq < target and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._stopped = True
+            return self.seq >= target
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                if self.epoch is None:
+                    # The copy at startup failed (see init_app)
+                    count = self.sync()
+                    print(f"copied {count} posts from {self.source} after all; following its changes "
+                          f"from #{self.seq}", file=sys.stderr, flush=True)
+                else:
+                    self._poll()
+            except Gone as e:
+                logger.error("Replication from %s stopped: %s; restart this app to copy the store again",
+                             self.source, e)
+                with self._cond:
+                    self.error = str(e)
+                    self._stopped = True
+            except (OSError, ValueError) as e:
+                logger.warning("Replication from %s failed (%s); retrying", self.source, e)
+                with self._cond:
+                    self.error = str(e)
+                time.sleep(1)
+
+    def _poll(self):
+        path = f"{CHANGES_PATH}?after={self.seq}&epoch={self.epoch}&wait={MAX_WAIT}"
+        try:
+            response = self._open(path, MAX_WAIT + 10)
+        except urllib.error.HTTPError as e:
+            if e.code == 410:
+                raise Gone(e.read().decode(errors="replace").strip()) from None
+            raise
+        with response:
+            head = int(response.headers["X-Blog-Changes-Head"])
+            for line in response:
+                entry = json.loads(line)
+                op, *args = entry["op"]
+                with self._cond:
+                    if self._stopped:
+                        return
+                    journal.apply(self.store, op, args)
+                    self.seq = entry["seq"]
+                    self._cond.notify_all()
+        with self._cond:
+            self.head = max(self.head, head)
+            self._contact = time.monotonic()
+            self.error = None
+            if self.seq >= self.head:
+                self._caught_up = self._contact
+
+    def _open(self, path, timeout):
+        return urllib.request.urlopen(
+            urllib.request.Request(self.source + path, headers={"Authorization": f"Bearer {self.token}"}),
+            timeout=timeout)
+
+
+def close_feeds():
+    """Close every change feed in this process; called by blog.server when it starts draining."""
+    for changes in list(_feeds):
+        changes.close()
+
+
+def init_app(app, app_prefix, store, service_name, token=handoff.TOKEN, source=REPLICATE_FROM):
+    """Attach a change feed to ``store`` and register its routes; follow ``source`` if set."""
+    if not token or not hasattr(store, "listeners"):
+        return None
+    replica = None
+    if source:
+        replica = Replica(store, source, token)
+        started = time.monotonic()
+        try:
+            count = replica.sync()
+        except (OSError, ValueError) as e:  # TimeoutError is an OSError
+            # Like a failed handoff import, the app still starts; the follower retries the copy
+            replica.error = str(e)
+            print(f"{service_name}: copying the posts from {source} failed after "
+                  f"{time.monotonic() - started:.2f}s ({e}); starting empty and retrying",
+                  file=sys.stderr, flush=True)
+        else:
+            print(f"{service_name}: copied {count} posts from {source} in {time.monotonic() - started:.2f}s; "
+                  f"following its changes from #{replica.seq}", file=sys.stderr, flush=True)
+    # After the initial copy, so the feed does not start with the whole store
+    # (a copy retried by the follower does go through it)
+    changes = app.extensions["blog_changes"] = ChangeLog()
+    app.extensions["blog_replica"] = replica
+    store.listeners.append(changes.append)
+    if replica is not None:
+        replica.start()
+
+    def changes_feed():
+        handoff.require_token(token)
+        after = request.args.get("after", 0, type=int)
+        wait = min(request.args.get("wait", 0, type=float), MAX_WAIT)
+        if request.args.get("epoch", changes.epoch) != changes.epoch:
+            return Response(f"this feed is epoch {changes.epoch}\n", 410, mimetype="text/plain")
+        try:
+            entries = changes.since(after, wait)
+        except Gone as e:
+            return Response(f"{e}\n", 410, mimetype="text/plain")
+        if not entries and changes.closed:
+            # Shutting down: the standby retries, against whichever color is live by then
+            return Response("this app is shutting down\n", 503, mimetype="text/plain")
+        body = b"".join(json.dumps({"seq": seq, "ts": ts, "op": record}, separators=(",", ":"),
+                                    default=records.json_default).encode() + b"\n"
+                        for seq, ts, record in entries)
+        response = Response(body, mimetype="application/x-ndjson")
+        response.headers["X-Blog-Changes-Head"] = str(changes.last_seq)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    def replication_status():
+        handoff.require_token(token)
+        status = {"seq": changes.last_seq, "epoch": changes.epoch}
+        if replica is not None:
+            status.update(replica.status())
+        return jsonify(status)
+
+    def promote():
+        handoff.require_token(token)
+        if replica is None:
+            return jsonify(seq=changes.last_seq, epoch=changes.epoch, caught_up=True)
+        caught_up = replica.promote(request.args.get("timeout", 10, type=float))
+        return jsonify(dict(replica.status(), caught_up=caught_up)), 200 if caught_up else 503
+
+    app.add_url_rule(app_prefix + CHANGES_PATH, "changes_feed", changes_feed)
+    app.add_url_rule(app_prefix + STATUS_PATH, "replication_status", replication_status)
+    app.add_url_rule(app_prefix + PROMOTE_PATH, "promote", promote, methods=["POST"])
+    return replica
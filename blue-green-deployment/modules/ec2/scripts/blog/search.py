@@ -0,0 +1,124 @@
+"""Incremental inverted index behind the /appN/search route.
+
+Every post is tokenized once when it is written. Each field (title,
+content, author) gets its own postings, token -> set of post ids, and the
+lower-cased text of every field is kept: the post record's own
+``search_text`` (see ``blog.records``), or lower-cased here for a plain
+dict. A query then only touches the
+postings of its own tokens, so its cost follows the number of hits rather
+than the size of the blog.
+
+Two modes are supported:
+
+``substring``
+    The original behaviour: the lower-cased query is a substring of the
+    title, content or author. This still scans every post, but against the
+    cached lower-cased text instead of calling ``.lower()`` per request.
+``index``
+    A post matches when, in at least one field, every word of the query
+    appears as a whole word, in any order. Only this mode uses the
+    postings, but it matches differently: "deploy" no longer finds
+    "Deployment", while "green blue" now finds "Blue/Green".
+
+The mode defaults to ``substring``, so search finds what it always did;
+``BLOG_SEARCH_MODE=index`` opts in to the index.
+"""
+import itertools
+import os
+import re
+
+SEARCH_FIELDS = ("title", "content", "author")
+SEARCH_MODES = ("index", "substring")
+DEFAULT_SEARCH_MODE = os.environ.get("BLOG_SEARCH_MODE", "substring")
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Return the set of lower-cased word tokens in ``text``."""
+    return set(_TOKEN_RE.findall(text.lower()))
+
+
+class SearchIndex:
+    """Per-field postings plus a normalized-text cache, kept up to date by PostStore.
+
+    Writes must be serialized by the caller; searches need no lock.
+    """
+
+    def __init__(self, mode=DEFAULT_SEARCH_MODE):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        self.mode = mode
+        self._postings = {field: {} for field in SEARCH_FIELDS}
+        self._text = {}  # post id -> lower-cased field values
+        self._rank = {}  # post id -> insertion counter, newest highest
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._text)
+
+    def __contains__(self, post_id):
+        return post_id in self._text
+
+    def add(self, post):
+        """Index a new post or re-index an edited one."""
+        post_id = post["id"]
+        if post_id in self._text:
+            self._unindex(post_id)
+        else:
+            self._rank[post_id] = next(self._counter)
+        text = getattr(post, "search_text", None)
+        if text is None:
+            text = tuple((post.get(field) or "").lower() for field in SEARCH_FIELDS)
+        self._text[post_id] = text
+        for field, value in zip(SEARCH_FIELDS, text):
+            postings = self._postings[field]
+            for token in tokenize(value):
+                postings.setdefault(token, set()).add(post_id)
+
+    def remove(self, post_id):
+        if post_id in self._text:
+            self._unindex(post_id)
+            del self._text[post_id]
+            del self._rank[post_id]
+
+    def _unindex(self, post_id):
+        for field, value in zip(SEARCH_FIELDS, self._text[post_id]):
+            postings = self._postings[field]
+            for token in tokenize(value):
+                ids = postings[token]
+                ids.discard(post_id)
+                if not ids:
+                    del postings[token]
+
+    def search(self, query, mode=None):
+        """Return matching post ids, newest first.
+
+        Safe to call while a writer updates the index; a post being
+        written at that moment may be missing from, or linger in, the hits.
+        """
+        mode = mode or self.mode
+        query = query.lower()
+        tokens = tokenize(query)
+        if mode == "substring" or not tokens:
+            # list() copies atomically, so a concurrent write can't break the loop
+            hits = [post_id for post_id, text in list(self._text.items())
+                    if any(query in value for value in text)]
+        else:
+            hits = set()
+            for postings in self._postings.values():
+                hits |= self._match_all(postings, tokens)
+        rank = self._rank
+        return sorted((post_id for post_id in hits if post_id in rank),
+                      key=lambda post_id: rank.get(post_id, -1), reverse=True)
+
+    @staticmethod
+    def _match_all(postings, tokens):
+        sets = []
+        for token in tokens:
+            ids = postings.get(token)
+            if not ids:
+                return set()
+            sets.append(ids)
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
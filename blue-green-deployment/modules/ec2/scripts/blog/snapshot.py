@@ -0,0 +1,471 @@
+"""Memory-mapped binary snapshots of the post store.
+
+Loading a large blog into the in-memory ``PostStore`` (parsing every post,
+indexing it for search) takes longer than the ECS health-check grace
+period allows a green task. ``MappedPostStore`` instead opens a snapshot
+file with ``mmap`` and reads nothing up front, so a task is ready in
+milliseconds whatever the size of the blog; the OS pages in only what
+requests touch.
+
+The file is laid out as::
+
+    header | string heap | post records | id table
+
+* the header holds the record count and where each section starts;
+* each post is a fixed-size record of (offset, length) pairs pointing
+  into the heap: id, title, content, author, date and its comments as
+  a JSON array. Records are in listing order, oldest first, so post
+  ``i`` lives at a computable offset;
+* the id table is an open-addressing hash table of (id hash, record
+  number) slots, so a lookup by id reads a slot or two and one record.
+
+Writes never touch the file: new posts, edits, deletes and comments land
+in an in-memory overlay on top of it, as ``Post`` records (see
+``blog.records``) like those of ``PostStore``. ``BLOG_STORE=mmap`` pairs
+the store with the write-ahead log (``blog.journal``), which makes the
+overlay durable; when the log is compacted the overlay is merged with the
+old file into a new snapshot, which is mapped in its place. The merge
+runs without holding writes off; what they change meanwhile stays in the
+overlay of the new snapshot.
+
+Search has no prebuilt index here: it scans the records (paging in every
+title, content and author), then the overlay.
+"""
+import array
+import datetime
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from collections import namedtuple
+
+from blog.pagination import DEFAULT_PAGE_SIZE, Page
+from blog.records import Comment, Post, json_default
+from blog.search import DEFAULT_SEARCH_MODE, SEARCH_FIELDS, SEARCH_MODES, tokenize
+
+MAGIC = b"BLOGMAP1"
+# magic, log segment the snapshot is followed by, record count,
+# records offset, id table offset, id table slots
+HEADER = struct.Struct("<8sQQQQQ")
+FIELDS = ("id", "title", "content", "author", "date", "comments")
+RECORD = struct.Struct("<" + "QI" * len(FIELDS))  # (heap offset, length) per field
+SLOT = struct.Struct("<QQ")  # id hash, record number + 1 (0 = empty slot)
+
+# Overlay: post id -> (post, version), or None once deleted; tail: ids of
+# posts not in the file, in the order they were added; base_version: the
+# version of every post read from the file
+_State = namedtuple("_State", "base overlay tail tail_pos base_version")
+_MISSING = object()
+
+
+def _hash(post_id):
+    return int.from_bytes(hashlib.blake2b(post_id.encode(), digest_size=8).digest(), "little")
+
+
+def write_snapshot(path, posts, segment=0):
+    """Write ``posts`` (dicts, oldest first) to a snapshot file at ``path``.
+
+    The file is written next to ``path`` and renamed into place, so a
+    crash never leaves a half-written snapshot behind.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    # 8 bytes per post, however many are streamed through
+    hashes = array.array("Q")
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f, tempfile.TemporaryFile() as records:
+        f.write(HEADER.pack(MAGIC, 0, 0, 0, 0, 0))
+        offset = HEADER.size
+        for post in posts:
+            refs = []
+            for field in FIELDS:
+                if field == "comments":
+                    data = json.dumps(post.get("comments") or [], separators=(",", ":"),
+                                      default=json_default).encode()
+                else:
+                    data = (post.get(field) or "").encode()
+                f.write(data)
+                refs += (offset, len(data))
+                offset += len(data)
+            records.write(RECORD.pack(*refs))
+            hashes.append(_hash(post["id"]))
+        records_offset = offset
+        records.seek(0)
+        shutil.copyfileobj(records, f)
+        # A power of two at least twice the count keeps probe chains short
+        slots = 1 << max(len(hashes) * 2, 1).bit_length()
+        table = bytearray(slots * SLOT.size)
+        for number, value in enumerate(hashes):
+            slot = value & (slots - 1)
+            while SLOT.unpack_from(table, slot * SLOT.size)[1]:
+                slot = (slot + 1) & (slots - 1)
+            SLOT.pack_into(table, slot * SLOT.size, value, number + 1)
+        table_offset = records_offset + len(hashes) * RECORD.size
+        f.write(table)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, segment, len(hashes), records_offset, table_offset, slots))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f.name, path)
+
+
+class SnapshotFile:
+    """Read-only, lazily paged view of a snapshot file."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.segment = self.count = 0
+        self._mm = None
+        if path is None or os.path.getsize(path) == 0:
+            return
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.segment, self.count, self._records, self._table, self._slots = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a post snapshot")
+
+    def find(self, post_id):
+        """Record number of ``post_id``, or None."""
+        if not self.count:
+            return None
+        value = _hash(post_id)
+        slot = value & (self._slots - 1)
+        while True:
+            stored, number = SLOT.unpack_from(self._mm, self._table + slot * SLOT.size)
+            if not number:
+                return None
+            if stored == value and self.field(number - 1, 0) == post_id:
+                return number - 1
+            slot = (slot + 1) & (self._slots - 1)
+
+    def field(self, number, index):
+        offset, length = RECORD.unpack_from(self._mm, self._records + number * RECORD.size)[2 * index:2 * index + 2]
+        return self._mm[offset:offset + length].decode()
+
+    def read(self, number):
+        """Decode record ``number`` into a post dict."""
+        refs = RECORD.unpack_from(self._mm, self._records + number * RECORD.size)
+        mm = self._mm
+        post = {field: mm[refs[2 * i]:refs[2 * i] + refs[2 * i + 1]].decode() for i, field in enumerate(FIELDS)}
+        post["comments"] = json.loads(post["comments"])
+        return post
+
+
+class MappedPostStore:
+    """``PostStore`` interface over a mapped snapshot file plus a write overlay.
+
+    Readers never lock; each write replaces a whole entry of the overlay,
+    and a merge swaps in file and overlay together. Writers are serialized.
+    Posts handed out are read-only, as with ``PostStore``.
+    """
+
+    def __init__(self, path=None, search_mode=DEFAULT_SEARCH_MODE):
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {search_mode!r}, expected one of {SEARCH_MODES}")
+        self.search_mode = search_mode
+        self._lock = threading.Lock()
+        self._clock = itertools.count(1)
+        self.journal = None
+        self.listeners = []
+        self.load_snapshot(path)
+
+    def load_snapshot(self, path):
+        """Map the snapshot at ``path`` (None for none), dropping the overlay.
+
+        Returns the log segment the snapshot is followed by.
+        """
+        with self._lock:
+            base = SnapshotFile(path)
+            self._map(base)
+            self._live = base.count
+            mtime = os.path.getmtime(path) if path else datetime.datetime.now().timestamp()
+            self.last_modified = datetime.datetime.fromtimestamp(int(mtime), datetime.timezone.utc)
+        return base.segment
+
+    def save_snapshot(self, path, between_writes=None):
+        """Merge the overlay into a new snapshot at ``path`` and map it.
+
+        ``between_writes()`` is called first, with writes held off, and
+        returns the log segment it starts (see ``blog.journal``). The file
+        is written from the posts as of then, like ``checkpoint``, while
+        writes go on; the ones made in the meantime are kept on top of the
+        new snapshot.
+        """
+        with self._lock:
+            segment = between_writes() if between_writes else 0
+            state = self._state
+            frozen = state._replace(overlay=dict(state.overlay), tail=list(state.tail))
+        write_snapshot(path, self._oldest_first(frozen), segment)
+        base = SnapshotFile(path)
+        with self._lock:
+            state = self._state
+            # Entries replaced since the cut; one left as it was is in the file
+            overlay = {post_id: entry for post_id, entry in state.overlay.items()
+                       if frozen.overlay.get(post_id, _MISSING) is not entry}
+            tail = state.tail[len(frozen.tail):]
+            # A post deleted before the cut and added again since is in
+            # neither the file nor the new tail: list it at the top
+            listed = set(tail)
+            tail += [post_id for post_id, entry in overlay.items()
+                     if entry is not None and post_id not in listed and base.find(post_id) is None]
+            self._map(base, overlay, tail)
+        return segment
+
+    def checkpoint(self, between_writes):
+        """Call ``between_writes()`` with writes held off; return the posts as of then, oldest first."""
+        with self._lock:
+            between_writes()
+            state = self._state
+            # The overlay is changed in place: copy what the walk needs
+            state = state._replace(overlay=dict(state.overlay), tail=list(state.tail))
+        return list(self._oldest_first(state))
+
+    def _map(self, base, overlay=None, tail=()):
+        # Caller holds the lock. One attribute swap replaces file and overlay
+        # together; readers still using the old file keep it mapped
+        base_version = next(self._clock)
+        self.data_version = base_version
+        tail = list(tail)
+        tail_pos = {post_id: base.count + i for i, post_id in enumerate(tail)}
+        self._state = _State(base, overlay or {}, tail, tail_pos, base_version)
+
+    def __iter__(self):
+        state = self._state
+        for i in range(state.base.count + len(state.tail) - 1, -1, -1):
+            post = self._post_at(state, i)
+            if post is not None:
+                yield post
+
+    def __len__(self):
+        return self._live
+
+    def __contains__(self, post_id):
+        return self.get(post_id) is not None
+
+    def indexed(self, post_id):
+        """Whether search can find ``post_id``: it scans the records, so whether the record reads."""
+        return self.get(post_id) is not None
+
+    def get(self, post_id):
+        """Return the post with ``post_id``, or None."""
+        entry = self._entry(self._state, post_id)
+        return entry[0] if entry is not None else None
+
+    def version(self, post_id):
+        """Return the post's version; it changes on every write to the post."""
+        entry = self._entry(self._state, post_id)
+        return entry[1] if entry is not None else 0
+
+    def add(self, post):
+        """Add a new post at the top of the listing.
+
+        Adding a post whose id is already stored (or was deleted) replaces
+        it in place.
+        """
+        post = Post.from_dict(post)
+        with self._lock:
+            state = self._state
+            post_id = post["id"]
+            new = self._entry(state, post_id) is None
+            appended = new and post_id not in state.overlay and state.base.find(post_id) is None
+            # Readers walk the tail without the lock and look every id in it
+            # up in the overlay: the entry must be there before the id is
+            self._write(state, post_id, post)
+            if new:
+                self._live += 1
+            if appended:
+                state.tail_pos[post_id] = state.base.count + len(state.tail)
+                state.tail.append(post_id)
+            seq = self._log("add", post)
+        self._sync(seq)
+        return post
+
+    def extend(self, posts):
+        """Add ``posts``, oldest first, in a single write.
+
+        Much faster than ``add`` for loading many posts: one journal record
+        and one fsync. Their ids must be new to the store and unique.
+        """
+        posts = [Post.from_dict(post) for post in posts]
+        if not posts:
+            return
+        with self._lock:
+            state = self._state
+            ids = {post["id"] for post in posts}
+            # Deleted ids count as taken: add() would put them back in place
+            if len(ids) < len(posts) or any(post_id in state.overlay or state.base.find(post_id) is not None
+                                            for post_id in ids):
+                raise ValueError("extend() needs posts with new, unique ids")
+            for post in posts:
+                post_id = post["id"]
+                # The entry before the id, as in add()
+                self._write(state, post_id, post)
+                state.tail_pos[post_id] = state.base.count + len(state.tail)
+                state.tail.append(post_id)
+            self._live += len(posts)
+            seq = self._log("extend", posts)
+        self._sync(seq)
+
+    def update(self, post_id, **fields):
+        """Store a copy of a post with ``fields`` overwritten; returns it or None."""
+        with self._lock:
+            post = self.get(post_id)
+            if post is None:
+                return None
+            post = Post.from_dict(post).replace(**fields)
+            self._write(self._state, post_id, post)
+            seq = self._log("update", post_id, fields)
+        self._sync(seq)
+        return post
+
+    def delete(self, post_id):
+        """Remove a post; returns the removed post or None."""
+        with self._lock:
+            post = self.get(post_id)
+            if post is None:
+                return None
+            self._write(self._state, post_id, None)
+            self._live -= 1
+            seq = self._log("delete", post_id)
+        self._sync(seq)
+        return post
+
+    def add_comment(self, post_id, comment):
+        """Store a copy of a post with ``comment`` appended; returns it or None."""
+        with self._lock:
+            post = self.get(post_id)
+            if post is None:
+                return None
+            post = Post.from_dict(post)
+            post = post.replace(comments=post.comments + (Comment.from_dict(comment),))
+            self._write(self._state, post_id, post)
+            seq = self._log("add_comment", post_id, comment)
+        self._sync(seq)
+        return post
+
+    def search(self, query):
+        """Return the posts matching ``query``, newest first (see ``blog.search``)."""
+        query = query.lower()
+        tokens = tokenize(query)
+        if self.search_mode == "substring" or not tokens:
+            def matches(values):
+                return any(query in value for value in values)
+        else:
+            def matches(values):
+                return any(tokens <= tokenize(value) for value in values)
+        state = self._state
+        base = state.base
+        fields = [FIELDS.index(field) for field in SEARCH_FIELDS]
+        hits = []
+        for i in range(base.count + len(state.tail) - 1, -1, -1):
+            if i < base.count:
+                post_id = base.field(i, 0)
+                if post_id not in state.overlay:
+                    if matches([base.field(i, f).lower() for f in fields]):
+                        hits.append(base.read(i))
+                    continue
+            else:
+                post_id = state.tail[i - base.count]
+            entry = state.overlay.get(post_id)
+            if entry is not None and matches(entry[0].search_text):
+                hits.append(entry[0])
+        return hits
+
+    def page(self, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        """Return the ``Page`` of posts older than ``after`` or newer than ``before``.
+
+        Without a (known) cursor this is the first page.
+        """
+        state = self._state
+        end = state.base.count + len(state.tail)
+        entries = []
+        before_pos = self._position(state, before)
+        if before_pos is not None:
+            entries = self._walk(state, before_pos + 1, 1, limit, end)[::-1]
+        if len(entries) < limit:
+            after_pos = self._position(state, after)
+            start = after_pos - 1 if after_pos is not None else end - 1
+            entries = self._walk(state, start, -1, limit, end)
+        if not entries:
+            return Page([], None, None, limit)
+        posts = [entry[0] for entry in entries]
+        older = self._walk(state, self._position(state, posts[-1]["id"]) - 1, -1, 1, end)
+        newer = self._walk(state, self._position(state, posts[0]["id"]) + 1, 1, 1, end)
+        return Page(posts,
+                    posts[-1]["id"] if older else None,
+                    posts[0]["id"] if newer else None,
+                    limit,
+                    [entry[1] for entry in entries])
+
+    def _write(self, state, post_id, post):
+        # Caller holds the lock
+        version = next(self._clock)
+        state.overlay[post_id] = (post, version) if post is not None else None
+        self.data_version = version
+        self.last_modified = _utcnow()
+
+    def _log(self, *record):
+        """Hand a write to the listeners and the journal, if any. Caller holds the lock."""
+        for listener in self.listeners:
+            listener(record)
+        return self.journal.append(record) if self.journal is not None else 0
+
+    def _sync(self, seq):
+        # Outside the lock, so other writers can join the same fsync
+        if seq:
+            self.journal.wait(seq)
+
+    def _entry(self, state, post_id):
+        """(post, version) of a live post, or None."""
+        if post_id in state.overlay:
+            return state.overlay[post_id]
+        number = state.base.find(post_id)
+        return (state.base.read(number), state.base_version) if number is not None else None
+
+    def _position(self, state, post_id):
+        """Listing position of ``post_id`` (live or deleted), or None."""
+        if post_id is None:
+            return None
+        if post_id in state.tail_pos:
+            return state.tail_pos[post_id]
+        return state.base.find(post_id)
+
+    def _entry_at(self, state, i):
+        """(post, version) at listing position ``i``, or None if deleted."""
+        base = state.base
+        if i < base.count:
+            post_id = base.field(i, 0)
+            if post_id not in state.overlay:
+                return base.read(i), state.base_version
+        else:
+            post_id = state.tail[i - base.count]
+        return state.overlay[post_id]
+
+    def _post_at(self, state, i):
+        entry = self._entry_at(state, i)
+        return entry[0] if entry is not None else None
+
+    def _walk(self, state, start, step, count, end):
+        """Collect up to ``count`` live (post, version) entries from ``start`` in direction ``step``."""
+        entries = []
+        i = start
+        while 0 <= i < end and len(entries) < count:
+            entry = self._entry_at(state, i)
+            if entry is not None:
+                entries.append(entry)
+            i += step
+        return entries
+
+    def _oldest_first(self, state):
+        for i in range(state.base.count + len(state.tail)):
+            post = self._post_at(state, i)
+            if post is not None:
+                yield post
+
+
+def _utcnow():
+    # Whole seconds, the resolution of Last-Modified / If-Modified-Since
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
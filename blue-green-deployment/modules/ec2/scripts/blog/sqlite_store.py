@@ -0,0 +1,454 @@
+"""SQLite storage backend for the blog apps.
+
+``SQLitePostStore`` has the same interface as the in-memory ``PostStore``
+but keeps posts and comments in a SQLite database, so they survive a
+restart, a task replacement or a blue/green switch (when the database sits
+on a volume both colors mount), and can be shared by pre-forked workers.
+Select it with ``BLOG_STORE=sqlite`` (see ``blog.store.open_store``).
+
+* The database runs in WAL mode: readers never block the writer or each
+  other, and each read sees one consistent snapshot.
+* ``posts`` has indexed ``id``, ``author`` and ``date`` columns. Its
+  ``seq`` primary key is the listing order, so a page is an index range
+  scan from the cursor, like the slots of the memory store.
+* Comments live in their own table. ``posts.comment_count`` is maintained
+  by triggers, so the listing shows counts without reading any comments.
+* ``posts`` also keeps the lower-cased title, content and author, written
+  with the post, so search compares plain columns instead of case-folding
+  every row through a Python function on every query.
+* Every thread (and every forked worker) opens its own connection on first
+  use. Statements are constant strings with parameters, which the
+  connection's statement cache keeps prepared.
+* Writes within a process take a lock before ``BEGIN IMMEDIATE``, so its
+  threads queue for the database one at a time instead of all waiting out
+  SQLite's busy timeout. Writers in other processes (pre-forked workers)
+  can still hold the database; a ``BEGIN`` that times out on them is
+  retried, for up to ``WRITE_RETRY_TIMEOUT`` seconds.
+* ``state`` holds the data version and last-modified time, so the
+  conditional-GET validators follow writes made by any worker. The post
+  count is cached under the data version it was counted at, so health
+  probes and metrics scrapes only count the table after a write.
+
+WAL needs shared memory between the processes using the database: keep
+it on a local disk or EBS volume, not EFS.
+"""
+import contextlib
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from blog.pagination import DEFAULT_PAGE_SIZE, Page
+from blog.search import DEFAULT_SEARCH_MODE, SEARCH_FIELDS, SEARCH_MODES, tokenize
+
+POST_FIELDS = ("id", "title", "content", "author", "date")
+# Cursor positions of deleted posts are kept for the most recent this many
+KEEP_DELETED = 10000
+COMMENT_FIELDS = ("id", "content", "author", "date")
+# Lower-cased copy of each search field, written with the post
+LOWER_COLUMNS = tuple("lower_" + field for field in SEARCH_FIELDS)
+# Seconds a write keeps retrying BEGIN while another process holds the database
+WRITE_RETRY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- listing order, oldest first
+    id TEXT NOT NULL UNIQUE,
+    title TEXT,
+    content TEXT,
+    author TEXT,
+    date TEXT,
+    version INTEGER NOT NULL,
+    comment_count INTEGER NOT NULL DEFAULT 0,
+    lower_title TEXT,
+    lower_content TEXT,
+    lower_author TEXT
+);
+CREATE INDEX IF NOT EXISTS posts_author ON posts (author);
+CREATE INDEX IF NOT EXISTS posts_date ON posts (date);
+
+CREATE TABLE IF NOT EXISTS comments (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    post_id TEXT NOT NULL REFERENCES posts (id) ON DELETE CASCADE,
+    id TEXT,
+    content TEXT,
+    author TEXT,
+    date TEXT
+);
+CREATE INDEX IF NOT EXISTS comments_post ON comments (post_id, seq);
+
+CREATE TRIGGER IF NOT EXISTS comment_added AFTER INSERT ON comments BEGIN
+    UPDATE posts SET comment_count = comment_count + 1 WHERE id = NEW.post_id;
+END;
+CREATE TRIGGER IF NOT EXISTS comment_removed AFTER DELETE ON comments BEGIN
+    UPDATE posts SET comment_count = comment_count - 1 WHERE id = OLD.post_id;
+END;
+
+-- Listing position of deleted posts, so a page cursor pointing at one
+-- still works (like the empty slots of the memory store)
+CREATE TABLE IF NOT EXISTS deleted_posts (
+    id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS state (
+    singleton INTEGER PRIMARY KEY CHECK (singleton = 0),
+    data_version INTEGER NOT NULL,
+    last_modified INTEGER NOT NULL  -- unix seconds
+);
+"""
+
+_CARD_COLUMNS = "seq, id, title, content, author, date, version, comment_count"
+_SELECT_CARD = f"SELECT {_CARD_COLUMNS} FROM posts"
+_INSERT_POST = ("INSERT INTO posts (id, title, content, author, date, version, "
+                "lower_title, lower_content, lower_author) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+# Connection-level settings; journal_mode=WAL is stored in the file itself
+_PRAGMAS = ("PRAGMA journal_mode = WAL", "PRAGMA synchronous = NORMAL",
+            "PRAGMA foreign_keys = ON", "PRAGMA busy_timeout = 5000")
+
+
+class SQLitePostStore:
+    """Posts and comments in a SQLite database, with the ``PostStore`` interface.
+
+    Posts are returned as new dicts. Listing and search results carry a
+    ``comment_count`` instead of the comments; ``get`` returns both.
+    """
+
+    def __init__(self, path, posts=(), search_mode=DEFAULT_SEARCH_MODE):
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {search_mode!r}, expected one of {SEARCH_MODES}")
+        self.path = path
+        self.search_mode = search_mode
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Serializes this process's write transactions (see _write)
+        self._write_lock = threading.Lock()
+        self._count = (None, 0)  # (data version, number of posts) as last counted
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        with self._write() as conn:
+            _add_lower_columns(conn)
+            conn.execute("INSERT OR IGNORE INTO state VALUES (0, 0, ?)", (_now(),))
+            # Seed a fresh database only; workers starting together race here
+            if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM posts)").fetchone()[0]:
+                for post in reversed(list(posts() if callable(posts) else posts)):
+                    self._insert(conn, post, self._bump(conn))
+
+    def _conn(self):
+        """This thread's connection, opened on first use (and again after a fork)."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                   cached_statements=64)
+            conn.row_factory = sqlite3.Row
+            for pragma in _PRAGMAS:
+                conn.execute(pragma)
+            local.conn, local.pid = conn, os.getpid()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return local.conn
+
+    @contextlib.contextmanager
+    def _write(self):
+        """This thread's connection inside a write transaction.
+
+        Threads of this process take turns on ``_write_lock``; only other
+        processes can make ``BEGIN IMMEDIATE`` wait, and it is retried
+        until ``WRITE_RETRY_TIMEOUT`` runs out.
+        """
+        conn = self._conn()
+        with self._write_lock, _transaction(conn, immediate=True):
+            yield conn
+
+    def close(self):
+        """Close every connection opened by this process."""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    @property
+    def data_version(self):
+        """Latest version handed out; changes on every write, by any worker."""
+        return self._conn().execute("SELECT data_version FROM state").fetchone()[0]
+
+    @property
+    def last_modified(self):
+        seconds = self._conn().execute("SELECT last_modified FROM state").fetchone()[0]
+        return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+    def __iter__(self):
+        for row in self._conn().execute(_SELECT_CARD + " ORDER BY seq DESC"):
+            yield _card(row)
+
+    def __len__(self):
+        conn = self._conn()
+        with _transaction(conn):
+            version = conn.execute("SELECT data_version FROM state").fetchone()[0]
+            counted_at, count = self._count
+            if version != counted_at:
+                count = conn.execute("SELECT count(*) FROM posts").fetchone()[0]
+                self._count = (version, count)
+        return count
+
+    def __contains__(self, post_id):
+        return self._conn().execute("SELECT 1 FROM posts WHERE id = ?", (post_id,)).fetchone() is not None
+
+    def indexed(self, post_id):
+        """Whether search can find ``post_id``: its lower-cased columns are filled in."""
+        return self._conn().execute(
+            f"SELECT 1 FROM posts WHERE id = ? AND {' AND '.join(f'{c} IS NOT NULL' for c in LOWER_COLUMNS)}",
+            (post_id,)).fetchone() is not None
+
+    def get(self, post_id):
+        """Return the post with ``post_id`` and its comments, or None."""
+        conn = self._conn()
+        with _transaction(conn):
+            row = conn.execute(_SELECT_CARD + " WHERE id = ?", (post_id,)).fetchone()
+            if row is None:
+                return None
+            post = _card(row)
+            post["comments"] = [dict(comment) for comment in conn.execute(
+                "SELECT id, content, author, date FROM comments WHERE post_id = ? ORDER BY seq", (post_id,))]
+        return post
+
+    def version(self, post_id):
+        """Return the post's version; it changes on every write to the post."""
+        row = self._conn().execute("SELECT version FROM posts WHERE id = ?", (post_id,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def add(self, post):
+        """Add a new post at the top of the listing.
+
+        Adding a post whose id is already stored replaces it in place.
+        """
+        with self._write() as conn:
+            version = self._bump(conn)
+            values = [post.get(field) for field in POST_FIELDS[1:]]
+            replaced = conn.execute(
+                "UPDATE posts SET title = ?, content = ?, author = ?, date = ?, version = ?, "
+                "lower_title = ?, lower_content = ?, lower_author = ? WHERE id = ?",
+                (*values, version, *_lowered(post), post["id"])).rowcount
+            if replaced:
+                conn.execute("DELETE FROM comments WHERE post_id = ?", (post["id"],))
+                self._insert_comments(conn, post)
+            else:
+                self._insert(conn, post, version)
+        return post
+
+    def extend(self, posts):
+        """Append ``posts``, oldest first, in a single transaction.
+
+        Much faster than ``add`` for loading many posts. Their ids must be
+        new to the store and unique.
+        """
+        posts = list(posts)
+        if not posts:
+            return
+        with self._write() as conn:
+            first = conn.execute("SELECT data_version FROM state").fetchone()[0] + 1
+            conn.execute("UPDATE state SET data_version = data_version + ?, last_modified = ?", (len(posts), _now()))
+            try:
+                conn.executemany(_INSERT_POST,
+                                 ((*(post.get(field) for field in POST_FIELDS), version, *_lowered(post))
+                                  for version, post in enumerate(posts, first)))
+            except sqlite3.IntegrityError:
+                raise ValueError("extend() needs posts with new, unique ids") from None
+            conn.executemany("DELETE FROM deleted_posts WHERE id = ?", ((post["id"],) for post in posts))
+            conn.executemany("INSERT INTO comments (post_id, id, content, author, date) VALUES (?, ?, ?, ?, ?)",
+                             ((post["id"], *(comment.get(field) for field in COMMENT_FIELDS))
+                              for post in posts for comment in post.get("comments") or ()))
+
+    def update(self, post_id, **fields):
+        """Overwrite fields of a post; returns the updated post or None."""
+        unknown = set(fields) - set(POST_FIELDS[1:])
+        if unknown:
+            raise ValueError(f"Unknown post fields {sorted(unknown)}")
+        with self._write() as conn:
+            if conn.execute("SELECT 1 FROM posts WHERE id = ?", (post_id,)).fetchone() is None:
+                return None
+            values = dict(fields)
+            values.update(("lower_" + field, (value or "").lower())
+                          for field, value in fields.items() if field in SEARCH_FIELDS)
+            assignments = "".join(f"{column} = ?, " for column in values)
+            conn.execute(f"UPDATE posts SET {assignments}version = ? WHERE id = ?",
+                         (*values.values(), self._bump(conn), post_id))
+        return self.get(post_id)
+
+    def delete(self, post_id):
+        """Remove a post and its comments; returns the removed post or None."""
+        with self._write() as conn:
+            post = self.get(post_id)
+            if post is not None:
+                conn.execute("INSERT OR REPLACE INTO deleted_posts SELECT id, seq FROM posts WHERE id = ?",
+                             (post_id,))
+                conn.execute("DELETE FROM deleted_posts WHERE rowid <= "
+                             "(SELECT max(rowid) FROM deleted_posts) - ?", (KEEP_DELETED,))
+                conn.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+                self._bump(conn)
+        return post
+
+    def add_comment(self, post_id, comment):
+        """Append a comment to a post; returns the updated post or None."""
+        with self._write() as conn:
+            version = self._bump(conn)
+            if not conn.execute("UPDATE posts SET version = ? WHERE id = ?", (version, post_id)).rowcount:
+                # Nothing was written: roll the version bump back with the rest
+                raise _Rollback
+            conn.execute("INSERT INTO comments (post_id, id, content, author, date) VALUES (?, ?, ?, ?, ?)",
+                         (post_id, *(comment.get(field) for field in COMMENT_FIELDS)))
+        return self.get(post_id)
+
+    def search(self, query):
+        """Return the posts matching ``query``, newest first (see ``blog.search``)."""
+        query = query.lower()
+        tokens = tokenize(query)
+        fields = " OR ".join(f"instr({column}, ?)" for column in LOWER_COLUMNS)
+        if self.search_mode == "substring" or not tokens:
+            rows = self._conn().execute(f"{_SELECT_CARD} WHERE {fields} ORDER BY seq DESC",
+                                        (query,) * len(SEARCH_FIELDS))
+            return [_card(row) for row in rows]
+        # Narrow down to posts containing the rarest-looking (longest) token,
+        # then apply the whole-word rule of the memory index
+        needle = max(tokens, key=len)
+        rows = self._conn().execute(f"{_SELECT_CARD} WHERE {fields} ORDER BY seq DESC",
+                                    (needle,) * len(SEARCH_FIELDS))
+        return [_card(row) for row in rows
+                if any(tokens <= tokenize(row[field] or "") for field in SEARCH_FIELDS)]
+
+    def page(self, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        """Return the ``Page`` of posts older than ``after`` or newer than ``before``.
+
+        Without a (known) cursor this is the first page. One extra row is
+        read in each direction to tell whether there is a next page.
+        """
+        conn = self._conn()
+        with _transaction(conn):
+            rows = []
+            before_seq = self._seq(conn, before)
+            if before_seq is not None:
+                rows = conn.execute(_SELECT_CARD + " WHERE seq > ? ORDER BY seq LIMIT ?",
+                                    (before_seq, limit)).fetchall()[::-1]
+            if len(rows) < limit:
+                after_seq = self._seq(conn, after)
+                if after_seq is not None:
+                    rows = conn.execute(_SELECT_CARD + " WHERE seq < ? ORDER BY seq DESC LIMIT ?",
+                                        (after_seq, limit)).fetchall()
+                else:
+                    rows = conn.execute(_SELECT_CARD + " ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+            if not rows:
+                return Page([], None, None, limit)
+            older = conn.execute("SELECT 1 FROM posts WHERE seq < ? LIMIT 1", (rows[-1]["seq"],)).fetchone()
+            newer = conn.execute("SELECT 1 FROM posts WHERE seq > ? LIMIT 1", (rows[0]["seq"],)).fetchone()
+        posts = [_card(row) for row in rows]
+        return Page(posts,
+                    posts[-1]["id"] if older else None,
+                    posts[0]["id"] if newer else None,
+                    limit,
+                    [row["version"] for row in rows])
+
+    @staticmethod
+    def _seq(conn, post_id):
+        if post_id is None:
+            return None
+        row = (conn.execute("SELECT seq FROM posts WHERE id = ?", (post_id,)).fetchone()
+               or conn.execute("SELECT seq FROM deleted_posts WHERE id = ?", (post_id,)).fetchone())
+        return row[0] if row is not None else None
+
+    @staticmethod
+    def _bump(conn):
+        """Hand out the next data version. Caller holds a write transaction."""
+        conn.execute("UPDATE state SET data_version = data_version + 1, last_modified = ?", (_now(),))
+        return conn.execute("SELECT data_version FROM state").fetchone()[0]
+
+    def _insert(self, conn, post, version):
+        conn.execute(_INSERT_POST, (*(post.get(field) for field in POST_FIELDS), version, *_lowered(post)))
+        conn.execute("DELETE FROM deleted_posts WHERE id = ?", (post["id"],))
+        self._insert_comments(conn, post)
+
+    @staticmethod
+    def _insert_comments(conn, post):
+        conn.executemany("INSERT INTO comments (post_id, id, content, author, date) VALUES (?, ?, ?, ?, ?)",
+                         ((post["id"], *(comment.get(field) for field in COMMENT_FIELDS))
+                          for comment in post.get("comments") or ()))
+
+
+class _Rollback(Exception):
+    """Raised inside ``_transaction`` to roll back without an error."""
+
+
+@contextlib.contextmanager
+def _transaction(conn, immediate=False):
+    """BEGIN ... COMMIT on an autocommit connection; ROLLBACK on an exception.
+
+    ``immediate`` takes the write lock up front, so two writers never
+    deadlock upgrading from a read, and keeps retrying while another
+    process holds it.
+    """
+    if conn.in_transaction:
+        # Nested, e.g. get() inside delete(): part of the outer transaction
+        yield conn
+        return
+    if immediate:
+        _begin_immediate(conn)
+    else:
+        conn.execute("BEGIN")
+    try:
+        yield conn
+    except _Rollback:
+        conn.execute("ROLLBACK")
+        return
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _begin_immediate(conn):
+    deadline = time.monotonic() + WRITE_RETRY_TIMEOUT
+    while True:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            # busy_timeout already waited; nothing was written yet, so try again
+            if not _is_busy(e) or time.monotonic() >= deadline:
+                raise
+
+
+def _card(row):
+    return {field: row[field] for field in (*POST_FIELDS, "comment_count")}
+
+
+def _lowered(post):
+    # SQLite's lower() only folds ASCII; match str.lower() used by the memory index
+    return tuple((post.get(field) or "").lower() for field in SEARCH_FIELDS)
+
+
+def _add_lower_columns(conn):
+    """Add and fill the lower-cased search columns of a database created without them."""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(posts)")}
+    missing = [column for column in LOWER_COLUMNS if column not in columns]
+    if not missing:
+        return
+    for column in missing:
+        conn.execute(f"ALTER TABLE posts ADD COLUMN {column} TEXT")
+    rows = conn.execute("SELECT seq, title, content, author FROM posts").fetchall()
+    conn.executemany("UPDATE posts SET lower_title = ?, lower_content = ?, lower_author = ? WHERE seq = ?",
+                     ((*_lowered(dict(row)), row["seq"]) for row in rows))
+
+
+def _is_busy(error):
+    # sqlite_errorcode is only there from Python 3.11 on
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF == 5  # SQLITE_BUSY
+    return "database is locked" in str(error)
+
+
+def _now():
+    return int(datetime.datetime.now(datetime.timezone.utc).timestamp())
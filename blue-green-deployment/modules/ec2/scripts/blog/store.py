@@ -0,0 +1,363 @@
+"""In-memory post storage for the blog apps.
+
+``PostStore`` keeps the newest-first listing the pages render together with
+an id -> position map, so looking a post up by id costs the same whether the
+blog holds two posts or a few hundred thousand. It also maintains the
+search index (see ``blog.search``) on every write.
+
+Posts are kept in append-only slots, oldest first; deleting a post leaves
+an empty slot behind until enough of them pile up to compact the slots.
+Every post therefore has a stable position, which is what lets the listing
+be paged by cursor (see ``blog.pagination``) without copying or slicing
+the whole list.
+
+The store is safe to share between request threads. All of its state is an
+immutable ``_Snapshot``; readers pick up the current one with a single
+attribute read and never take a lock, and every page or lookup they do
+sees one consistent version of the blog. Writers are serialized by a lock
+and publish a new snapshot when they are done. The slots are split into
+fixed-size chunks, so a write copies one chunk and the (short) tuple of
+chunks rather than every post. Posts are kept as compact ``Post``
+records (see ``blog.records``), which read like the dicts they are given
+as; they are never modified once stored: an edit or a new comment stores
+a new record.
+
+``open_store`` picks the backend for an app: this store, this store with a
+write-ahead log (``BLOG_STORE=wal``, see ``blog.journal``), a memory-mapped
+snapshot with the same log (``BLOG_STORE=mmap``, see ``blog.snapshot``), or
+the SQLite one in ``blog.sqlite_store`` (``BLOG_STORE=sqlite``).
+"""
+import datetime
+import itertools
+import os
+import threading
+from collections import namedtuple
+
+from blog.pagination import DEFAULT_PAGE_SIZE, Page
+from blog.records import Comment, Post
+from blog.journal import Journal
+from blog.search import DEFAULT_SEARCH_MODE, SearchIndex
+from blog.snapshot import MappedPostStore
+from blog.sqlite_store import SQLitePostStore
+
+# "memory" keeps posts in this process only; "wal" adds a write-ahead log
+# to it (see blog.journal); "mmap" serves a memory-mapped snapshot plus the
+# log (see blog.snapshot); "sqlite" keeps them in a database
+# (see blog.sqlite_store)
+STORE_BACKENDS = ("memory", "wal", "mmap", "sqlite")
+DEFAULT_BACKEND = os.environ.get("BLOG_STORE", "memory")
+# Where persistent backends keep their files, one set per service
+DATA_DIR = os.environ.get("BLOG_DATA_DIR", "data")
+
+# Compact the slots once this many deleted slots have piled up
+# (and they outnumber the live posts)
+COMPACT_THRESHOLD = 1024
+
+# Slots per chunk; a write copies one chunk. Must be a power of two.
+CHUNK_SIZE = 512
+_CHUNK_SHIFT = CHUNK_SIZE.bit_length() - 1
+_CHUNK_MASK = CHUNK_SIZE - 1
+
+# chunks: tuple of tuples of (post, version) entries, None for a deleted post
+# pos: post id -> slot index; writers only ever add to it (see _locate)
+_Snapshot = namedtuple("_Snapshot", "chunks length pos live data_version last_modified")
+
+
+def open_store(name, posts=(), backend=DEFAULT_BACKEND):
+    """Open the post store for service ``name`` with the selected backend.
+
+    ``posts`` seeds a store that starts out empty: a new one, or for the
+    persistent backends, one whose data directory has never been written.
+    It may be a function returning the posts, called only in that case.
+    """
+    if backend == "memory":
+        return PostStore(posts() if callable(posts) else posts)
+    if backend in ("wal", "mmap"):
+        store = PostStore() if backend == "wal" else MappedPostStore()
+        journal = Journal(os.path.join(DATA_DIR, name))
+        # Not "nothing replayed": a blog whose posts were all deleted stays empty
+        fresh = not journal.exists()
+        journal.open(store)
+        if fresh:
+            store.extend(reversed(list(posts() if callable(posts) else posts)))
+        return store
+    if backend == "sqlite":
+        os.makedirs(DATA_DIR, exist_ok=True)
+        return SQLitePostStore(os.path.join(DATA_DIR, name + ".sqlite3"), posts)
+    raise ValueError(f"Unknown store backend {backend!r}, expected one of {STORE_BACKENDS}")
+
+
+class PostStore:
+    """Ordered collection of posts with constant-time lookup by id.
+
+    Iterating the store yields posts newest first, the order the listing
+    page shows them in.
+    """
+
+    def __init__(self, posts=(), search_mode=DEFAULT_SEARCH_MODE):
+        self._lock = threading.Lock()
+        self._clock = itertools.count(1)  # versions, unique for the store's lifetime
+        self._index = SearchIndex(search_mode)
+        self._snap = _Snapshot((), 0, {}, 0, 0, _utcnow())
+        # A blog.journal.Journal, when set, records every write (see open_store)
+        self.journal = None
+        # Called with every write's record, under the lock and after it is
+        # visible to readers (blog.replication, blog.merkle)
+        self.listeners = []
+        self.extend(reversed(list(posts)))
+
+    @property
+    def data_version(self):
+        """Latest version handed out; changes on every write."""
+        return self._snap.data_version
+
+    @property
+    def last_modified(self):
+        return self._snap.last_modified
+
+    def __iter__(self):
+        snap = self._snap
+        for i in range(snap.length - 1, -1, -1):
+            entry = _slot(snap, i)
+            if entry is not None:
+                yield entry[0]
+
+    def __len__(self):
+        return self._snap.live
+
+    def __contains__(self, post_id):
+        return _locate(self._snap, post_id) is not None
+
+    def indexed(self, post_id):
+        """Whether search can find ``post_id``; constant time, for the health probe."""
+        return post_id in self._index
+
+    def get(self, post_id):
+        """Return the post with ``post_id``, or None."""
+        entry = _entry(self._snap, post_id)
+        return entry[0] if entry is not None else None
+
+    def version(self, post_id):
+        """Return the post's version; it changes on every write to the post."""
+        entry = _entry(self._snap, post_id)
+        return entry[1] if entry is not None else 0
+
+    def add(self, post):
+        """Add a new post at the top of the listing.
+
+        Adding a post whose id is already stored replaces it in place.
+        """
+        post = Post.from_dict(post)
+        with self._lock:
+            snap = self._snap
+            i = _locate(snap, post["id"])
+            if i is not None:
+                self._publish(snap, i, (post, next(self._clock)))
+            else:
+                pos = snap.pos
+                if post["id"] in pos:
+                    # Re-adding a deleted id moves it; older snapshots must
+                    # keep their own position for it
+                    pos = dict(pos)
+                pos[post["id"]] = snap.length
+                self._publish(snap._replace(pos=pos, live=snap.live + 1),
+                              snap.length, (post, next(self._clock)))
+            self._index.add(post)
+            seq = self._log("add", post)
+        self._sync(seq)
+        return post
+
+    def extend(self, posts):
+        """Append ``posts``, oldest first, in a single write.
+
+        Much faster than ``add`` for loading many posts. Their ids must be
+        new to the store and unique.
+        """
+        posts = [Post.from_dict(post) for post in posts]
+        if not posts:
+            return
+        with self._lock:
+            snap = self._snap
+            pos = snap.pos
+            ids = {post["id"] for post in posts}
+            if len(ids) < len(posts) or not ids.isdisjoint(pos):
+                raise ValueError("extend() needs posts with new, unique ids")
+            # Refill the last chunk if it has room, then add whole ones
+            entries = list(snap.chunks[-1]) if snap.chunks and len(snap.chunks[-1]) < CHUNK_SIZE else []
+            keep = len(snap.chunks) - (1 if entries else 0)
+            for i, post in enumerate(posts, snap.length):
+                pos[post["id"]] = i
+                entries.append((post, next(self._clock)))
+                self._index.add(post)
+            chunks = snap.chunks[:keep] + tuple(
+                tuple(entries[i:i + CHUNK_SIZE]) for i in range(0, len(entries), CHUNK_SIZE))
+            self._snap = snap._replace(chunks=chunks, length=snap.length + len(posts),
+                                       live=snap.live + len(posts), data_version=entries[-1][1],
+                                       last_modified=_utcnow())
+            seq = self._log("extend", posts)
+        self._sync(seq)
+
+    def update(self, post_id, **fields):
+        """Store a copy of a post with ``fields`` overwritten; returns it or None."""
+        with self._lock:
+            snap = self._snap
+            i = _locate(snap, post_id)
+            if i is None:
+                return None
+            post = _slot(snap, i)[0].replace(**fields)
+            self._publish(snap, i, (post, next(self._clock)))
+            self._index.add(post)
+            seq = self._log("update", post_id, fields)
+        self._sync(seq)
+        return post
+
+    def delete(self, post_id):
+        """Remove a post; returns the removed post or None."""
+        with self._lock:
+            snap = self._snap
+            i = _locate(snap, post_id)
+            if i is None:
+                return None
+            post = _slot(snap, i)[0]
+            self._publish(snap._replace(live=snap.live - 1), i, None)
+            self._index.remove(post_id)
+            snap = self._snap
+            dead = snap.length - snap.live
+            if dead > COMPACT_THRESHOLD and dead > snap.live:
+                self._compact()
+            seq = self._log("delete", post_id)
+        self._sync(seq)
+        return post
+
+    def add_comment(self, post_id, comment):
+        """Store a copy of a post with ``comment`` appended; returns it or None."""
+        with self._lock:
+            snap = self._snap
+            i = _locate(snap, post_id)
+            if i is None:
+                return None
+            post = _slot(snap, i)[0]
+            post = post.replace(comments=post.comments + (Comment.from_dict(comment),))
+            self._publish(snap, i, (post, next(self._clock)))
+            seq = self._log("add_comment", post_id, comment)
+        self._sync(seq)
+        return post
+
+    def checkpoint(self, between_writes):
+        """Call ``between_writes()`` with writes held off; return the posts as of then.
+
+        The posts are listed oldest first. Used by the journal to cut its
+        log at the exact point a snapshot is taken.
+        """
+        with self._lock:
+            between_writes()
+            snap = self._snap
+        return [entry[0] for chunk in snap.chunks for entry in chunk if entry is not None]
+
+    def search(self, query):
+        """Return the posts matching ``query``, newest first."""
+        snap = self._snap
+        # The index may be a write ahead of (or behind) this snapshot
+        entries = (_entry(snap, post_id) for post_id in self._index.search(query))
+        return [entry[0] for entry in entries if entry is not None]
+
+    def page(self, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        """Return the ``Page`` of posts older than ``after`` or newer than ``before``.
+
+        Without a (known) cursor this is the first page. Only the slots
+        between the cursor and the end of the page are visited.
+        """
+        snap = self._snap
+        entries = []
+        before_pos = _position(snap, before)
+        if before_pos is not None:
+            entries = _walk(snap, before_pos + 1, 1, limit)[::-1]
+        if len(entries) < limit:
+            after_pos = _position(snap, after)
+            start = after_pos - 1 if after_pos is not None else snap.length - 1
+            entries = _walk(snap, start, -1, limit)
+        if not entries:
+            return Page([], None, None, limit)
+        posts = [entry[0] for entry in entries]
+        older = _walk(snap, snap.pos[posts[-1]["id"]] - 1, -1, 1)
+        newer = _walk(snap, snap.pos[posts[0]["id"]] + 1, 1, 1)
+        return Page(posts,
+                    posts[-1]["id"] if older else None,
+                    posts[0]["id"] if newer else None,
+                    limit,
+                    [entry[1] for entry in entries])
+
+    def _log(self, *record):
+        """Hand a write to the listeners and the journal, if any. Caller holds the lock."""
+        for listener in self.listeners:
+            listener(record)
+        return self.journal.append(record) if self.journal is not None else 0
+
+    def _sync(self, seq):
+        # Outside the lock, so other writers can join the same fsync
+        if seq:
+            self.journal.wait(seq)
+
+    def _publish(self, snap, i, entry):
+        """Publish ``snap`` with slot ``i`` set to ``entry``. Caller holds the lock."""
+        chunks = snap.chunks
+        c = i >> _CHUNK_SHIFT
+        if c == len(chunks):  # appending past the last chunk
+            chunks = chunks + ((entry,),)
+        else:
+            chunk = chunks[c]
+            j = i & _CHUNK_MASK
+            chunk = chunk[:j] + (entry,) + chunk[j + 1:]
+            chunks = chunks[:c] + (chunk,) + chunks[c + 1:]
+        version = entry[1] if entry is not None else next(self._clock)
+        self._snap = snap._replace(chunks=chunks, length=max(snap.length, i + 1),
+                                   data_version=version, last_modified=_utcnow())
+
+    def _compact(self):
+        # Caller holds the lock. Snapshots already handed out keep their
+        # own chunks and position map.
+        snap = self._snap
+        entries = [entry for chunk in snap.chunks for entry in chunk if entry is not None]
+        chunks = tuple(tuple(entries[i:i + CHUNK_SIZE]) for i in range(0, len(entries), CHUNK_SIZE))
+        pos = {entry[0]["id"]: i for i, entry in enumerate(entries)}
+        self._snap = snap._replace(chunks=chunks, length=len(entries), pos=pos)
+
+
+def _slot(snap, i):
+    return snap.chunks[i >> _CHUNK_SHIFT][i & _CHUNK_MASK]
+
+
+def _position(snap, post_id):
+    """Slot index of ``post_id`` in ``snap`` (live or deleted), or None."""
+    # Writers add to a shared position map while readers use it, so an id
+    # may point past the end of an older snapshot: it isn't in that one
+    i = snap.pos.get(post_id)
+    return i if i is not None and i < snap.length else None
+
+
+def _locate(snap, post_id):
+    """Slot index of the live post ``post_id`` in ``snap``, or None."""
+    i = _position(snap, post_id)
+    return i if i is not None and _slot(snap, i) is not None else None
+
+
+def _entry(snap, post_id):
+    i = _position(snap, post_id)
+    return _slot(snap, i) if i is not None else None
+
+
+def _walk(snap, start, step, count):
+    """Collect up to ``count`` live (post, version) entries from slot ``start`` in direction ``step``."""
+    entries = []
+    i = start
+    while 0 <= i < snap.length and len(entries) < count:
+        entry = _slot(snap, i)
+        if entry is not None:
+            entries.append(entry)
+        i += step
+    return entries
+
+
+def _utcnow():
+    # Whole seconds, the resolution of Last-Modified / If-Modified-Since
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
@@ -4,6 +4,8 @@ import time
 import socket
 import urllib.request
 import glob
+import secrets
+import subprocess
 
 # Fetch public IP using IMDSv2
 def get_instance_public_ip():
@@ -78,6 +80,32 @@ print(f"App name: {app_name}")
 print(f"Mode: {mode}")
 print(f"Using app script: {app_script}")
 
+# Hand the running app's posts over to the new one (see blog/handoff.py).
+# The token lives in a root-only environment file shared by both colors.
+handoff_env_file = "/home/ec2-user/.blog_handoff.env"
+if not os.path.exists(handoff_env_file):
+    with open(handoff_env_file, "w") as f:
+        f.write(f"BLOG_HANDOFF_TOKEN={secrets.token_urlsafe(32)}\n")
+    os.chmod(handoff_env_file, 0o600)
+with open(handoff_env_file) as f:
+    handoff_token = f.read().strip().partition("=")[2]
+
+handoff_file = f"/home/ec2-user/handoff_{app_suffix}.ndjson"
+print(f"📦 Exporting posts from the running app to {handoff_file}")
+# --read-only: the app refuses writes from here on, so none are lost before it stops.
+# The token goes through the environment, not the command line (visible in ps).
+export = subprocess.run(
+    ["python3", "-m", "blog.handoff", "export", f"http://127.0.0.1/app{app_number}",
+     "--out", handoff_file, "--read-only"],
+    cwd="/home/ec2-user",
+    env=dict(os.environ, BLOG_HANDOFF_TOKEN=handoff_token),
+)
+if export.returncode == 0:
+    import_env = f"Environment=BLOG_IMPORT_FROM={handoff_file}\n"
+else:
+    print("⚠️ Export failed (is the running app older than the handoff?); the new app starts from its seed posts")
+    import_env = ""
+
 # Stop existing service
 print(f"🔻 Stopping existing service: {service_name}")
 os.system(f"sudo systemctl stop {service_name} 2>/dev/null || true")
@@ -92,7 +120,8 @@ After=network.target
 [Service]
 User=root
 WorkingDirectory=/home/ec2-user
-ExecStart=/usr/bin/python3 {app_script}
+EnvironmentFile={handoff_env_file}
+{import_env}ExecStart=/usr/bin/python3 {app_script}
 Restart=always
 
 [Install]
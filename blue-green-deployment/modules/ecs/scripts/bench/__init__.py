@@ -0,0 +1,5 @@
+"""Benchmarks for the blog apps.
+
+Run from ``modules/ecs/scripts`` so the app modules are importable, e.g.
+``python -m bench.templates``.
+"""
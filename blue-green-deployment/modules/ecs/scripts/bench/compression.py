@@ -0,0 +1,73 @@
+"""Bytes on the wire and CPU per request for each compression level.
+
+Fetches uncompressed bodies from the app (listing page, a post page, the
+stylesheet, /health) and compresses each at every gzip level, and every
+brotli quality when ``brotli`` is installed. CPU is process time per
+compression; the last column is how many responses per second that cost
+alone would allow on a 256-CPU-unit (0.25 vCPU) Fargate task.
+
+    python -m bench.compression [--app app_1] [--posts 50] [--rounds 200]
+"""
+import argparse
+import importlib
+import re
+import time
+
+from blog import compression
+
+FARGATE_VCPU = 0.25
+
+
+def sample_bodies(module, posts):
+    client = module.app.test_client()
+    prefix = module.app_prefix
+    for i in range(posts):
+        client.post(prefix + "/create_post", data={
+            "title": f"Benchmark post {i}",
+            "content": "Blue-green deployment keeps two production environments side by side. " * 8,
+            "author": "Bench",
+        })
+    listing = client.get(prefix + "/").get_data()
+    post_id = re.search(rb'/post/([^"]+)"', listing).group(1).decode()
+    stylesheet = re.search(rb'href="([^"]+\.css)"', listing).group(1).decode()
+    return {
+        "listing": listing,
+        "post": client.get(prefix + "/post/" + post_id).get_data(),
+        "stylesheet": client.get(stylesheet).get_data(),
+        "health": client.get(prefix + "/health").get_data(),
+    }
+
+
+def cpu_per_call(data, encoding, level, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        compression.compress(data, encoding, level)
+    return (time.process_time() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="app_1", help="app module to sample (default: app_1)")
+    parser.add_argument("--posts", type=int, default=50, help="posts to create before sampling (default: 50)")
+    parser.add_argument("--rounds", type=int, default=200, help="compressions per measurement (default: 200)")
+    args = parser.parse_args()
+
+    bodies = sample_bodies(importlib.import_module(args.app), args.posts)
+    levels = [("gzip", level) for level in range(1, 10)]
+    if compression.brotli is not None:
+        levels += [("br", quality) for quality in range(0, 12)]
+    else:
+        print("brotli not installed; reporting gzip only\n")
+
+    print(f"{'payload':<12}{'encoding':<10}{'level':>6}{'bytes':>9}{'ratio':>8}{'cpu us/req':>12}{'req/s @0.25vCPU':>17}")
+    for name, data in bodies.items():
+        print(f"{name:<12}{'identity':<10}{'-':>6}{len(data):>9}{1:>8.2f}{0:>12.1f}{'-':>17}")
+        for encoding, level in levels:
+            size = len(compression.compress(data, encoding, level))
+            cpu = cpu_per_call(data, encoding, level, args.rounds)
+            print(f"{name:<12}{encoding:<10}{level:>6}{size:>9}{len(data) / size:>8.2f}"
+                  f"{cpu * 1e6:>12.1f}{FARGATE_VCPU / cpu:>17.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Synthetic blogs at scale: generation and loading speed, and memory.
+
+For each size, generates the blog with ``blog.dataset`` and streams it
+into each backend in a fresh process: the in-memory ``PostStore`` (through
+``fill``), and the files of the ``wal``, ``mmap`` and ``sqlite`` backends
+(through ``write_service``). Reports posts per second, the size on disk
+and the process's peak resident memory, which for the file backends stays
+flat however many posts go through. The written data is then opened with
+the backend's own store and its post count checked. Exits non-zero if a
+count is off.
+
+    python -m bench.dataset [--sizes 10000,1000000] [--backends memory,wal,mmap,sqlite] [--memory-limit 100000]
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Runs in a fresh interpreter: prints seconds, peak RSS in KiB, bytes on disk and posts read back
+LOAD = """
+import json, os, resource, sys, time
+from blog import dataset
+backend, count, seed, data_dir = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+started = time.perf_counter()
+if backend == "memory":
+    from blog.store import PostStore
+    store = PostStore()
+    dataset.fill(store, dataset.generate(count, seed))
+    seconds, size, found = time.perf_counter() - started, 0, len(store)
+else:
+    path = dataset.write_service(backend, "bench", dataset.generate(count, seed), data_dir)
+    seconds, size = time.perf_counter() - started, os.path.getsize(path)
+    if backend == "mmap":
+        from blog.snapshot import MappedPostStore
+        found = len(MappedPostStore(path))
+    elif backend == "sqlite":
+        from blog.sqlite_store import SQLitePostStore
+        found = len(SQLitePostStore(path))
+    else:
+        from blog import journal
+        with open(path, "rb") as f:
+            found = next(journal.decode(f))["posts"]
+print(json.dumps([seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, size, found]))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,1000000", help="comma-separated post counts")
+    parser.add_argument("--backends", default="memory,wal,mmap,sqlite", help="comma-separated backends")
+    parser.add_argument("--seed", type=int, default=0, help="generator seed (default: 0)")
+    parser.add_argument("--memory-limit", type=int, default=100000,
+                        help="largest size to load into the in-memory store (default: 100000)")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'posts':>10}{'backend':>9}{'seconds':>9}{'posts/s':>10}{'disk MiB':>10}{'peak RSS MiB':>14}")
+    for count in (int(size) for size in args.sizes.split(",")):
+        for backend in args.backends.split(","):
+            if backend == "memory" and count > args.memory_limit:
+                continue
+            directory = tempfile.mkdtemp()
+            try:
+                output = subprocess.run([sys.executable, "-c", LOAD, backend, str(count), str(args.seed), directory],
+                                        check=True, capture_output=True, text=True).stdout
+            finally:
+                shutil.rmtree(directory)
+            seconds, rss, size, found = json.loads(output)
+            disk = f"{size / 2**20:>10.1f}" if size else f"{'-':>10}"
+            print(f"{count:>10}{backend:>9}{seconds:>9.1f}{count / seconds:>10.0f}{disk}{rss / 1024:>14.0f}"
+                  f"{'' if found == count else f'  READ BACK {found}'}", flush=True)
+            failed = failed or found != count
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Graceful shutdown under load: SIGTERM mid-load must not fail a request.
+
+Starts ``app_1`` with the production server, wrapped so that
+``/app1/slow`` takes ``--slow`` seconds, and drives it from client
+threads on keep-alive connections: listing and post pages, new posts and
+a few slow requests. Mid-load the server gets SIGTERM. A client stops
+once a response tells it ``Connection: close``, as a load balancer moves
+a draining target's traffic elsewhere.
+
+Checks that every request sent got a complete 2xx/3xx answer (the slow
+ones in flight at SIGTERM included), that ``/ready`` turned 503 while
+``/health`` stayed 200, and that the server exited on its own within the
+drain timeout. Exits non-zero otherwise.
+
+    python -m bench.drain [--clients 16] [--slow 2] [--drain-delay 1] [--drain-timeout 10]
+"""
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from bench.tenants import free_port
+
+PREFIX = "/app1"
+
+SLOW_APP = """
+import time
+from app_1 import app as blog
+
+def app(environ, start_response):
+    if environ["PATH_INFO"] == "/app1/slow":
+        time.sleep(float(environ["QUERY_STRING"]))
+        start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "4")])
+        return [b"done"]
+    return blog(environ, start_response)
+"""
+
+
+class Client(threading.Thread):
+    """Sends requests on one keep-alive connection until told to close it."""
+
+    def __init__(self, port, n, slow, stop):
+        super().__init__()
+        self.port = port
+        self.n = n
+        self.slow = slow
+        self.stop = stop
+        self.sent = 0
+        self.failures = []
+
+    def run(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        k = 0
+        while not self.stop.is_set():
+            method, path, body = self.next_request(k)
+            k += 1
+            self.sent += 1
+            try:
+                headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException) as e:
+                self.failures.append(f"{method} {path}: {type(e).__name__}: {e}")
+                break
+            if not 200 <= response.status < 400:
+                self.failures.append(f"{method} {path}: HTTP {response.status}")
+            if response.getheader("Connection", "").lower() == "close":
+                break
+        conn.close()
+
+    def next_request(self, k):
+        if self.n == 0:
+            return "GET", f"{PREFIX}/slow?{self.slow}", None
+        if k % 5 == 0:
+            return "POST", PREFIX + "/create_post", urlencode(
+                {"title": f"Client {self.n} post {k}", "content": "Draining", "author": "Bench"})
+        return "GET", PREFIX + "/", None
+
+
+def get(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16, help="client connections (default: 16)")
+    parser.add_argument("--slow", type=float, default=2, help="seconds a slow request takes (default: 2)")
+    parser.add_argument("--load", type=float, default=2, help="seconds of load before SIGTERM (default: 2)")
+    parser.add_argument("--drain-delay", type=float, default=1, help="server --drain-delay (default: 1)")
+    parser.add_argument("--drain-timeout", type=float, default=10, help="server --drain-timeout (default: 10)")
+    args = parser.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "slow_app.py"), "w") as f:
+            f.write(SLOW_APP)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([directory, os.environ.get("PYTHONPATH", "")]))
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "blog.server", "slow_app:app", "--host", "127.0.0.1", "--port", str(port),
+             "--threads", str(args.clients + 4), "--drain-delay", str(args.drain_delay),
+             "--drain-timeout", str(args.drain_timeout)],
+            env=env, stdout=subprocess.DEVNULL)
+        try:
+            for _ in range(300):
+                try:
+                    get(port, "/health")
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            problems = []
+            if get(port, PREFIX + "/ready") != 200:
+                problems.append("/ready was not 200 before SIGTERM")
+
+            stop = threading.Event()
+            clients = [Client(port, n, args.slow, stop) for n in range(args.clients)]
+            for client in clients:
+                client.start()
+            time.sleep(args.load)
+            # Slow requests sent just before the signal are still in flight
+            slow = [Client(port, 0, args.slow, stop) for _ in range(4)]
+            for client in slow:
+                client.start()
+            time.sleep(0.2)
+            proc.send_signal(signal.SIGTERM)
+            signalled = time.monotonic()
+            if args.drain_delay > 0.2:
+                if get(port, PREFIX + "/ready") != 503:
+                    problems.append("/ready was not 503 after SIGTERM")
+                if get(port, PREFIX + "/health") != 200:
+                    problems.append("/health was not 200 while draining")
+            try:
+                code = proc.wait(args.drain_delay + args.drain_timeout + 5)
+            except subprocess.TimeoutExpired:
+                code = None
+                problems.append("the server did not exit by itself")
+            exited = time.monotonic() - signalled
+            stop.set()
+            for client in clients + slow:
+                client.join()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+
+    failures = [failure for client in clients + slow for failure in client.failures]
+    print(f"{sum(client.sent for client in clients + slow)} requests, {len(failures)} failed; "
+          f"{len(slow)} slow requests in flight at SIGTERM; server exited with {code} "
+          f"{exited:.1f}s after SIGTERM")
+    for failure in failures[:10]:
+        print(f"  {failure}")
+    if code != 0:
+        problems.append(f"exit status {code}")
+    for problem in problems:
+        print(f"  {problem}")
+    if failures or problems:
+        print("FAILED", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
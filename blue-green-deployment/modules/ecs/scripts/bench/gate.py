@@ -0,0 +1,222 @@
+"""Performance gate: refuse a candidate app version that is slower than the current one.
+
+Starts the current and the candidate ``app_N.py`` scripts side by side on
+two free local ports, each from its own directory and on a fresh
+in-memory store, seeds both with the same posts and replays the same
+workload against both (see ``bench.load``): generated from ``--seed``,
+or recorded with ``bench.load --record`` and given as ``--workload``. The workload is replayed
+``--rounds`` times, alternating which app goes first, so drift on the
+machine hits both alike.
+
+Each script imports the ``blog`` package next to it, and that is where
+the request handling lives. The caller must stage each version in its
+own directory with its own ``blog/``, as the ECS Switch pipeline does
+with the deployed image's ``/app``. Two scripts sharing one ``blog/``
+benchmark the same code. That is why the EC2 switch, which replaces only
+the app script, runs no gate.
+
+The latency distributions are compared with a one-sided Mann-Whitney U
+test, overall and per route with at least ``--min-samples`` requests.
+Each round is sent in ``--batches`` parts, and the requests per second of
+each part are compared with the same test. A regression is a difference
+both large and significant:
+
+p99
+    The candidate's p99 is more than ``--max-p99`` (default 20%) above the
+    current one's, and its latencies are higher at ``--alpha`` (default
+    0.01).
+throughput
+    The candidate served more than ``--max-throughput-drop`` (default 10%)
+    fewer requests per second over the run, and its per-batch throughput
+    is lower at ``--alpha``.
+
+Exits 0 when the candidate passes, 1 on a regression and 2 when the gate
+could not be run (an app failed to start or to answer), so a pipeline can
+refuse to switch on 1 and decide for itself on 2. ``--out`` saves both
+apps' results and the verdicts as JSON.
+
+    python -m bench.gate CURRENT.py CANDIDATE.py [--rounds 3] [--batches 10] [--requests 3000] [--out gate.json]
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+
+from bench import load
+from bench.tenants import free_port
+
+PREFIX = re.compile(r"""^app_prefix\s*=\s*["']([^"']*)["']""", re.M)
+
+
+def mann_whitney(current, candidate):
+    """One-sided p-value that ``candidate``'s values tend to be larger than ``current``'s.
+
+    The normal approximation of the U statistic, with the tie correction
+    and a continuity correction; fine for the hundreds of samples a gate
+    compares.
+    """
+    n1, n2 = len(candidate), len(current)
+    if not n1 or not n2:
+        return 1.0
+    values = sorted([(value, 1) for value in candidate] + [(value, 0) for value in current])
+    rank_sum = 0.0
+    ties = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j < len(values) and values[j][0] == values[i][0]:
+            j += 1
+        # Ranks i+1..j share their average
+        rank = (i + 1 + j) / 2
+        rank_sum += rank * sum(side for _, side in values[i:j])
+        ties += (j - i) ** 3 - (j - i)
+        i = j
+    n = n1 + n2
+    u = rank_sum - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def app_prefix(script):
+    with open(script) as f:
+        match = PREFIX.search(f.read())
+    return match.group(1) if match else ""
+
+
+def measure(scripts, ops, args):
+    """Per app: (samples, seconds, rates) over every round; both started, seeded and warmed up alike.
+
+    ``rates`` has the requests per second of each batch.
+    """
+    procs, drivers, prefixes, ids = [], [], [], []
+    with tempfile.TemporaryDirectory() as data_dir:
+        # A fresh store each, whatever the environment says the apps should load or follow
+        env = {"BLOG_STORE": "memory", "BLOG_DATA_DIR": data_dir, "BLOG_IMPORT_FROM": "",
+               "BLOG_REPLICATE_FROM": ""}
+        try:
+            for script in scripts:
+                port = free_port()
+                procs.append(load.start_server(script, port, threads=args.clients + 4, env=env))
+                drivers.append(load.SocketDriver("127.0.0.1", port))
+                prefixes.append(app_prefix(script))
+            for driver, prefix in zip(drivers, prefixes):
+                ids.append(load.prepare(driver, prefix, args.posts, args.seed))
+                if args.warmup:
+                    load.run(driver, prefix, load.workload(args.warmup, args.seed + 1), ids[-1], args.clients)
+            size = -(-len(ops) // args.batches)
+            batches = [ops[i:i + size] for i in range(0, len(ops), size)]
+            results = [([], 0.0, []) for _ in scripts]
+            for round_ in range(args.rounds):
+                order = range(len(scripts)) if round_ % 2 == 0 else reversed(range(len(scripts)))
+                for k in order:
+                    all_samples, total, rates = results[k]
+                    for batch in batches:
+                        samples, seconds = load.run(drivers[k], prefixes[k], batch, ids[k], args.clients)
+                        all_samples.extend(samples)
+                        total += seconds
+                        rates.append(len(samples) / seconds)
+                    results[k] = (all_samples, total, rates)
+            return results
+        finally:
+            for proc in procs:
+                proc.terminate()
+                proc.wait()
+
+
+def compare(current, candidate, args):
+    """Verdict rows: (check, current, candidate, change, p-value, regressed)."""
+    (current_samples, current_seconds, current_rates), (candidate_samples, candidate_seconds, candidate_rates) = \
+        current, candidate
+    routes = sorted({route for route, _, _ in current_samples})
+    rows = []
+    for route in [None] + routes:
+        a = [latency for name, latency, _ in current_samples if route is None or name == route]
+        b = [latency for name, latency, _ in candidate_samples if route is None or name == route]
+        if route is not None and min(len(a), len(b)) < args.min_samples:
+            continue
+        p_value = mann_whitney(a, b)
+        a_p99 = load.percentile(sorted(a), 0.99)
+        b_p99 = load.percentile(sorted(b), 0.99)
+        change = b_p99 / a_p99 - 1
+        rows.append((f"p99 {route or 'all'}", a_p99 * 1000, b_p99 * 1000, change, p_value,
+                     change > args.max_p99 and p_value < args.alpha))
+        if route is None:
+            a_rate = len(current_samples) / current_seconds
+            b_rate = len(candidate_samples) / candidate_seconds
+            change = b_rate / a_rate - 1
+            # Its own test: whether the candidate's batches ran at lower rates
+            rate_p_value = mann_whitney(candidate_rates, current_rates)
+            rows.append(("throughput", a_rate, b_rate, change, rate_p_value,
+                         -change > args.max_throughput_drop and rate_p_value < args.alpha))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("current", help="the app script serving now, e.g. app_1.py")
+    parser.add_argument("candidate", help="the app script about to replace it")
+    parser.add_argument("--workload", help="replay a workload recorded with bench.load --record")
+    parser.add_argument("--requests", type=int, default=3000, help="requests per round, if generated (default: 3000)")
+    parser.add_argument("--seed", type=int, default=0, help="workload and seed-post seed (default: 0)")
+    parser.add_argument("--rounds", type=int, default=3, help="times the workload is replayed per app (default: 3)")
+    parser.add_argument("--batches", type=int, default=10,
+                        help="parts each round is sent in, one throughput sample each (default: 10)")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client connections (default: 8)")
+    parser.add_argument("--posts", type=int, default=500, help="posts created in each app first (default: 500)")
+    parser.add_argument("--warmup", type=int, default=300, help="unmeasured requests per app first (default: 300)")
+    parser.add_argument("--max-p99", type=float, default=0.2, help="allowed p99 increase (default: 0.2 = 20%%)")
+    parser.add_argument("--max-throughput-drop", type=float, default=0.1,
+                        help="allowed throughput decrease (default: 0.1 = 10%%)")
+    parser.add_argument("--alpha", type=float, default=0.01, help="significance level (default: 0.01)")
+    parser.add_argument("--min-samples", type=int, default=200,
+                        help="requests a route needs on each side for its own p99 check (default: 200)")
+    parser.add_argument("--out", help="save both apps' results and the verdicts as JSON to this file")
+    args = parser.parse_args()
+
+    ops = load.load_workload(args.workload) if args.workload else load.workload(args.requests, args.seed)
+    scripts = [os.path.abspath(args.current), os.path.abspath(args.candidate)]
+    try:
+        current, candidate = measure(scripts, ops, args)
+    except (RuntimeError, OSError) as e:
+        print(f"Performance gate could not run: {e}", file=sys.stderr)
+        sys.exit(2)
+    errors = [sum(not ok for _, _, ok in samples) for samples, _, _ in (current, candidate)]
+    if any(errors):
+        print(f"Performance gate could not run: {errors[0]} requests failed on the current app, "
+              f"{errors[1]} on the candidate", file=sys.stderr)
+        sys.exit(2)
+
+    rows = compare(current, candidate, args)
+    print(f"{len(ops)} requests x {args.rounds} rounds per app in {args.batches} batches, {args.clients} clients\n"
+          f"  current:   {args.current}\n  candidate: {args.candidate}\n")
+    print(f"{'check':<22}{'current':>10}{'candidate':>11}{'change':>9}{'p-value':>10}")
+    for check, a, b, change, p_value, regressed in rows:
+        print(f"{check:<22}{a:>10.2f}{b:>11.2f}{change:>+9.1%}{p_value:>10.4f}{'  REGRESSED' if regressed else ''}")
+    regressions = [row[0] for row in rows if row[5]]
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "current": {"script": args.current, **load.summarize(*current[:2])},
+                "candidate": {"script": args.candidate, **load.summarize(*candidate[:2])},
+                "thresholds": {"max_p99": args.max_p99, "max_throughput_drop": args.max_throughput_drop,
+                               "alpha": args.alpha},
+                "checks": [{"check": check, "current": a, "candidate": b, "change": change, "p_value": p_value,
+                            "regressed": regressed} for check, a, b, change, p_value, regressed in rows],
+                "passed": not regressions,
+            }, f, indent=1)
+            f.write("\n")
+    if regressions:
+        print(f"\nFAILED: the candidate regressed ({', '.join(regressions)})", file=sys.stderr)
+        sys.exit(1)
+    print("\nPassed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Write throughput and recovery time of the journaled (BLOG_STORE=wal) post store.
+
+Writer threads apply a mix of mutations (new posts, edits, comments,
+deletes) to a ``PostStore`` with a ``Journal`` in a temporary directory;
+each returns only once its write is fsynced. The same run with a single
+writer shows what group commit saves. Then the store is recovered from
+the raw log, and again from a snapshot after compaction.
+
+    python -m bench.journal [--mutations 1000000] [--threads 16] [--dir /tmp]
+"""
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+
+from blog.journal import Journal
+from blog.store import PostStore
+
+CONTENT = "Blue-green deployment keeps two production environments side by side. " * 3
+
+
+def mutate(store, n, count):
+    """Apply ``count`` mutations as writer ``n``: per 10, 6 adds, 2 edits, 1 comment, 1 delete."""
+    for k in range(count):
+        post_id = f"{n}-{k // 10 * 6 + min(k % 10, 5)}"
+        kind = k % 10
+        if kind < 6:
+            store.add({"id": post_id, "title": f"Post {post_id}", "content": CONTENT, "author": f"writer {n}",
+                       "date": "2024-01-01", "comments": []})
+        elif kind < 8:
+            store.update(post_id, title=f"Edited {post_id}")
+        elif kind == 8:
+            store.add_comment(post_id, {"id": str(k), "content": "Nice post", "author": "reader",
+                                        "date": "2024-01-02"})
+        else:
+            store.delete(f"{n}-{k // 10 * 6}")
+
+
+def open_store(directory):
+    store = PostStore()
+    # No background compaction while measuring
+    journal = Journal(directory, compact_bytes=float("inf"), compact_interval=3600)
+    started = time.perf_counter()
+    replayed = journal.open(store)
+    return store, journal, replayed, time.perf_counter() - started
+
+
+def write(directory, mutations, threads):
+    store, journal, _, _ = open_store(directory)
+    per_thread = mutations // threads
+    workers = [threading.Thread(target=mutate, args=(store, n, per_thread)) for n in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    journal.close()
+    total = per_thread * threads
+    print(f"{threads:>3} writer(s): {total} mutations in {elapsed:.1f}s = {total / elapsed:,.0f}/s, "
+          f"{journal.commits} fsyncs ({total / max(journal.commits, 1):.1f} records each)")
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mutations", type=int, default=1000000, help="mutations to log (default: 1000000)")
+    parser.add_argument("--threads", type=int, default=16, help="writer threads (default: 16)")
+    parser.add_argument("--dir", help="where to put the log (default: the system temp dir); "
+                                      "use the disk the service will run on")
+    args = parser.parse_args()
+
+    single = tempfile.mkdtemp(dir=args.dir)
+    many = tempfile.mkdtemp(dir=args.dir)
+    try:
+        print("write throughput (each write waits for its fsync)")
+        write(single, min(args.mutations, 20000), 1)
+        written = write(many, args.mutations, args.threads)
+
+        print("\nrecovery")
+        store, journal, replayed, elapsed = open_store(many)
+        assert len(store) == len(written), (len(store), len(written))
+        print(f"  from the log:      {replayed} records in {elapsed:.1f}s = {replayed / elapsed:,.0f}/s")
+        started = time.perf_counter()
+        journal.compact()
+        compacted = time.perf_counter() - started
+        journal.close()
+        store, journal, replayed, elapsed = open_store(many)
+        assert len(store) == len(written), (len(store), len(written))
+        journal.close()
+        print(f"  from the snapshot: {replayed} posts in {elapsed:.1f}s (compaction took {compacted:.1f}s)")
+    finally:
+        shutil.rmtree(single)
+        shutil.rmtree(many)
+
+
+if __name__ == "__main__":
+    main()
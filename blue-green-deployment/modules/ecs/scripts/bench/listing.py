@@ -0,0 +1,85 @@
+"""Requests/sec for the listing page: cards derived per render vs at write time.
+
+For each size, starts ``app_1`` in a fresh process on the in-memory store
+filled with that many generated posts (``BLOG_SYNTHETIC_POSTS``, see
+``blog.dataset``) and with the post-card cache off, so every request
+renders all of its cards. Measures the first page and pages at random
+cursors (``?after=<id>``).
+
+"Before" hands each card the post without its derived fields, so the card
+template computes the excerpt, comment count and "N comments" label on
+every render, as it used to. "After" is the app as it runs: the card reads
+what ``blog.records`` computed when the post was written. The last column
+is "after" with the default card cache on, for reference.
+
+    python -m bench.listing [--sizes 1000,100000] [--requests 2000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Runs in a fresh interpreter (env set by the caller): prints req/s per page and variant
+MEASURE = """
+import json, random, sys, time, types
+import app_1
+requests = int(sys.argv[1])
+app, store = app_1.app, app_1.blog_posts
+client = app.test_client()
+prefix = app_1.app_prefix
+ids = [post["id"] for post in store]
+paths = {"first": [prefix + "/"] * requests,
+         "random": [f"{prefix}/?after={random.Random(i).choice(ids)}" for i in range(requests)]}
+
+class Legacy(types.SimpleNamespace):
+    # A post without the derived fields, as the card template used to get it
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+def measure(pages):
+    for path in pages[:50]:
+        assert client.get(path).status_code == 200
+    started = time.perf_counter()
+    for path in pages:
+        client.get(path)
+    return len(pages) / (time.perf_counter() - started)
+
+post_card = app.jinja_env.globals["post_card"]
+legacy = {post["id"]: Legacy(**post.to_dict()) for post in store}
+app.jinja_env.globals["post_card"] = lambda post, version=None: post_card(legacy[post["id"]], version)
+results = {"before": {page: measure(pages) for page, pages in paths.items()}}
+app.jinja_env.globals["post_card"] = post_card
+results["after"] = {page: measure(pages) for page, pages in paths.items()}
+cache = app.extensions["blog_post_cards"]
+cache.maxsize = int(sys.argv[2])
+results["cached"] = {page: measure(pages) for page, pages in paths.items()}
+print(json.dumps(results))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000", help="comma-separated post counts")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per page and variant (default: 2000)")
+    parser.add_argument("--cache-size", type=int, default=2048, help="card cache size for the last column")
+    args = parser.parse_args()
+
+    scripts = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print(f"{'posts':>8}{'page':>8}{'before req/s':>14}{'after req/s':>13}{'speedup':>9}{'cached req/s':>14}")
+    for count in (int(size) for size in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = dict(os.environ, BLOG_SYNTHETIC_POSTS=str(count), BLOG_STORE="memory", BLOG_DATA_DIR=data_dir,
+                       BLOG_FRAGMENT_CACHE_SIZE="0", BLOG_IMPORT_FROM="", BLOG_REPLICATE_FROM="")
+            output = subprocess.run([sys.executable, "-c", MEASURE, str(args.requests), str(args.cache_size)],
+                                    cwd=scripts, env=env, check=True, capture_output=True, text=True).stdout
+        results = json.loads(output.splitlines()[-1])
+        for page in ("first", "random"):
+            before, after = results["before"][page], results["after"][page]
+            print(f"{count:>8}{page:>8}{before:>14.0f}{after:>13.0f}{after / before:>8.2f}x"
+                  f"{results['cached'][page]:>14.0f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""Load generator for the blog apps: a realistic request mix, per-route latency.
+
+Drives an ``app_N.py``-style app with a seeded mix of the requests a blog
+sees (see ``MIX``): the listing and an older listing page, post pages,
+searches, new posts, edits and comments. Edits, comments and post pages
+go to posts spread over the whole store, found by walking the listing
+after setup. Two ways to reach the app:
+
+``--mode wsgi``
+    In process, through the WSGI interface (no sockets, no server): what
+    the app itself costs per request, for microbenchmarks.
+``--mode socket``
+    Over keep-alive HTTP connections, one per client thread, to the app
+    started under the production server (``blog.server``) on a free local
+    port, or to ``--url``: end-to-end numbers.
+
+Setup first creates ``--posts`` posts through the app. The workload is
+generated from ``--seed`` so runs are comparable; ``--record FILE`` saves
+it as JSON lines and ``--workload FILE`` replays a saved one. Prints
+throughput and p50/p95/p99/max per route; ``--out FILE`` saves the same
+as JSON (with the raw latencies too, given ``--samples``) for comparing
+versions, e.g. with ``bench.gate``.
+
+    python -m bench.load [app_1] [--mode wsgi|socket] [--url URL] [--requests 5000] [--clients 8] [--posts 500]
+"""
+import argparse
+import datetime
+import http.client
+import importlib
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from werkzeug.test import EnvironBuilder
+
+from bench.tenants import free_port
+
+# Relative weights of the routes in a workload
+MIX = {
+    "home": 35,
+    "older_page": 5,
+    "view_post": 30,
+    "search": 10,
+    "create_post": 8,
+    "edit_post": 6,
+    "add_comment": 6,
+}
+SEARCH_TERMS = ("blue", "green", "deployment", "rollback", "listener", "target group", "canary", "health check",
+                "terraform", "no such words")
+WORDS = ("blue", "green", "deployment", "rollback", "listener", "target", "group", "canary", "health", "check",
+         "terraform", "ecs", "fargate", "service", "traffic", "switch", "release", "pipeline", "container", "task")
+AUTHORS = ("Admin", "DevOps Engineer", "SRE", "Release Manager", "Platform Team")
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+POST_LINK = re.compile(r'/post/([^"/?]+)"')
+
+
+def workload(count, seed=0, mix=None):
+    """``count`` requests drawn from ``mix`` (default ``MIX``), the same for the same seed.
+
+    Each is a dict: ``route``, plus ``post`` (an index into the posts
+    found after setup, taken modulo their number) or ``q`` where the route
+    needs one, and ``n`` to make written text unique.
+    """
+    rng = random.Random(seed)
+    routes, weights = zip(*(mix or MIX).items())
+    ops = []
+    for n, route in enumerate(rng.choices(routes, weights, k=count)):
+        op = {"route": route, "n": n}
+        if route in ("older_page", "view_post", "edit_post", "add_comment"):
+            op["post"] = rng.randrange(2**31)
+        elif route == "search":
+            op["q"] = rng.choice(SEARCH_TERMS)
+        ops.append(op)
+    return ops
+
+
+def save_workload(ops, path):
+    with open(path, "w") as f:
+        for op in ops:
+            f.write(json.dumps(op) + "\n")
+
+
+def load_workload(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def build(op, prefix, ids):
+    """(route, method, path, form) of one workload entry."""
+    route = op["route"]
+    rng = random.Random(op["n"])
+    post_id = ids[op["post"] % len(ids)] if "post" in op else None
+    if route == "home":
+        return route, "GET", prefix + "/", None
+    if route == "older_page":
+        return route, "GET", f"{prefix}/?{urlencode({'after': post_id})}", None
+    if route == "view_post":
+        return route, "GET", f"{prefix}/post/{post_id}", None
+    if route == "search":
+        return route, "GET", f"{prefix}/search?{urlencode({'q': op['q']})}", None
+    if route == "create_post":
+        return route, "POST", prefix + "/create_post", {
+            "title": text(rng, 5).capitalize(), "content": text(rng, rng.randint(20, 120)),
+            "author": rng.choice(AUTHORS)}
+    if route == "edit_post":
+        return route, "POST", f"{prefix}/edit_post/{post_id}", {
+            "title": f"Edited: {text(rng, 4)}", "content": text(rng, rng.randint(20, 120)),
+            "author": rng.choice(AUTHORS)}
+    if route == "add_comment":
+        return route, "POST", f"{prefix}/add_comment/{post_id}", {
+            "content": text(rng, rng.randint(3, 30)), "author": rng.choice(AUTHORS)}
+    raise ValueError(f"unknown route {route!r}")
+
+
+class WSGIDriver:
+    """Calls a WSGI app in process; every thread shares it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        return self
+
+    def request(self, method, path, form=None):
+        """Status code of one request, after reading the whole body."""
+        environ = EnvironBuilder(path=path, method=method, data=form).get_environ()
+        status = []
+
+        def start_response(line, headers, exc_info=None):
+            status.append(line)
+
+        result = self.app(environ, start_response)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return int(status[0].split(None, 1)[0]), body
+
+    def close(self):
+        pass
+
+
+class SocketDriver:
+    """Sends requests over HTTP; each session is one keep-alive connection."""
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def session(self):
+        return _Connection(self.host, self.port, self.timeout)
+
+
+class _Connection:
+    def __init__(self, host, port, timeout):
+        self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method, path, form=None):
+        body = urlencode(form) if form is not None else None
+        try:
+            self.conn.request(method, path, body, FORM if form is not None else {})
+            response = self.conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            # The server may close an idle keep-alive connection; retry once on a new one
+            self.conn.close()
+            self.conn.request(method, path, body, FORM if form is not None else {})
+            response = self.conn.getresponse()
+        data = response.read()
+        if response.getheader("Connection", "").lower() == "close":
+            self.conn.close()
+        return response.status, data
+
+    def close(self):
+        self.conn.close()
+
+
+def start_server(script, port, threads=16, env=None):
+    """Serve ``script`` (an app_N.py path or module name) on ``port``; the process.
+
+    The server runs in the script's directory, so it uses the ``blog``
+    package next to the script, and is ``blog.server``; a script from
+    before that server existed is served by werkzeug's threaded server.
+    """
+    directory, name = os.path.split(os.path.abspath(script if script.endswith(".py") else script + ".py"))
+    module = name[:-3]
+    quiet = {}
+    if os.path.exists(os.path.join(directory, "blog", "server.py")):
+        command = ["-m", "blog.server", f"{module}:app", "--host", "127.0.0.1", "--port", str(port),
+                   "--threads", str(threads), "--workers", "1"]
+    else:
+        command = ["-c", f"from werkzeug.serving import run_simple; from {module} import app; "
+                         f"run_simple('127.0.0.1', {port}, app, threaded=True)"]
+        quiet = {"stderr": subprocess.DEVNULL}  # werkzeug logs every request
+    proc = subprocess.Popen([sys.executable, *command], cwd=directory, env=dict(os.environ, **(env or {})),
+                            stdout=subprocess.DEVNULL, **quiet)
+    driver = SocketDriver("127.0.0.1", port)
+    for _ in range(300):
+        if proc.poll() is not None:
+            raise RuntimeError(f"{script} exited with {proc.returncode} before serving")
+        try:
+            driver.session().request("GET", "/health")
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{script} did not start serving on port {port}")
+
+
+def prepare(driver, prefix, posts, seed=0):
+    """Create ``posts`` posts, then return the ids of every post, newest first."""
+    rng = random.Random(seed)
+    session = driver.session()
+    for n in range(posts):
+        status, _ = session.request("POST", prefix + "/create_post", {
+            "title": text(rng, 5).capitalize(), "content": text(rng, rng.randint(20, 200)),
+            "author": rng.choice(AUTHORS)})
+        if status >= 400:
+            raise RuntimeError(f"creating post {n} failed: HTTP {status}")
+    ids = []
+    seen = set()
+    after = None
+    while True:
+        query = {"limit": 100, **({"after": after} if after else {})}
+        status, body = session.request("GET", f"{prefix}/?{urlencode(query)}")
+        # An app without pagination lists everything on every page
+        found = [post_id for post_id in dict.fromkeys(POST_LINK.findall(body.decode())) if post_id not in seen]
+        if status != 200 or not found:
+            break
+        ids += found
+        seen.update(found)
+        after = found[-1]
+    session.close()
+    if not ids:
+        raise RuntimeError(f"no posts listed at {prefix}/")
+    return ids
+
+
+def run(driver, prefix, ops, ids, clients=8):
+    """Send ``ops`` from ``clients`` threads; (samples, seconds).
+
+    A sample is ``(route, seconds, ok)``; 2xx and 3xx (the app redirects
+    after writes) count as ok.
+    """
+    requests = [build(op, prefix, ids) for op in ops]
+    samples = [[] for _ in range(clients)]
+    start = threading.Barrier(clients + 1)
+
+    def client(k):
+        session = driver.session()
+        out = samples[k]
+        start.wait()
+        for route, method, path, form in requests[k::clients]:
+            started = time.perf_counter()
+            try:
+                status, _ = session.request(method, path, form)
+            except (OSError, http.client.HTTPException):
+                status = 0
+            out.append((route, time.perf_counter() - started, 200 <= status < 400))
+        session.close()
+
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return [sample for out in samples for sample in out], time.perf_counter() - started
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def stats(latencies, errors, seconds):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput": round(len(ordered) / seconds, 1) if seconds else None,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        **{f"p{p}_ms": round(percentile(ordered, p / 100) * 1000, 3) if ordered else None for p in (50, 95, 99)},
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else None,
+    }
+
+
+def summarize(samples, seconds, keep_samples=False):
+    """Totals and per-route stats of a run, as saved by ``--out``."""
+    by_route = {}
+    for route, latency, ok in samples:
+        latencies, errors = by_route.setdefault(route, ([], [0]))
+        latencies.append(latency)
+        errors[0] += not ok
+    summary = stats([latency for _, latency, _ in samples], sum(not ok for _, _, ok in samples), seconds)
+    summary["seconds"] = round(seconds, 3)
+    summary["routes"] = {route: stats(latencies, errors[0], seconds)
+                         for route, (latencies, errors) in sorted(by_route.items())}
+    if keep_samples:
+        summary["samples"] = {route: [round(latency, 7) for latency in latencies]
+                              for route, (latencies, _) in sorted(by_route.items())}
+    return summary
+
+
+def report(summary, out=sys.stdout):
+    print(f"{'route':<14}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'max ms':>9}", file=out)
+    for route, row in list(summary["routes"].items()) + [("all", summary)]:
+        print(f"{route:<14}{row['requests']:>9}{row['errors']:>8}{row['throughput']:>9.1f}{row['p50_ms']:>9.2f}"
+              f"{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['max_ms']:>9.2f}", file=out)
+
+
+def metadata(args, target):
+    return {
+        "target": target,
+        "mode": args.mode,
+        "clients": args.clients,
+        "posts": args.posts,
+        "seed": args.seed,
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "host": platform.node(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("app", nargs="?", default="app_1", help="app module or script (default: app_1)")
+    parser.add_argument("--mode", choices=("wsgi", "socket"), default="wsgi", help="how to reach the app (default: wsgi)")
+    parser.add_argument("--url", help="socket mode: an app already running, e.g. http://127.0.0.1:8080/app1")
+    parser.add_argument("--prefix", help="the app's path prefix (default: the module's app_prefix)")
+    parser.add_argument("--requests", type=int, default=5000, help="requests in the workload (default: 5000)")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads (default: 8)")
+    parser.add_argument("--posts", type=int, default=500, help="posts to create before the run (default: 500)")
+    parser.add_argument("--seed", type=int, default=0, help="workload seed (default: 0)")
+    parser.add_argument("--warmup", type=int, default=200, help="requests sent first and not measured (default: 200)")
+    parser.add_argument("--workload", help="replay a workload saved with --record instead of generating one")
+    parser.add_argument("--record", help="save the workload to this file")
+    parser.add_argument("--out", help="save the results as JSON to this file")
+    parser.add_argument("--samples", action="store_true", help="include every latency in --out")
+    args = parser.parse_args()
+
+    ops = load_workload(args.workload) if args.workload else workload(args.requests, args.seed)
+    if args.record:
+        save_workload(ops, args.record)
+
+    proc = None
+    if args.url:
+        args.mode = "socket"
+        url = urlsplit(args.url)
+        driver = SocketDriver(url.hostname, url.port or 80)
+        prefix = args.prefix if args.prefix is not None else url.path.rstrip("/")
+        target = args.url
+    else:
+        module = importlib.import_module(os.path.basename(args.app)[:-3] if args.app.endswith(".py") else args.app)
+        prefix = args.prefix if args.prefix is not None else module.app_prefix
+        target = args.app
+        if args.mode == "wsgi":
+            driver = WSGIDriver(module.app)
+        else:
+            port = free_port()
+            proc = start_server(args.app, port, threads=args.clients + 4)
+            driver = SocketDriver("127.0.0.1", port)
+    try:
+        ids = prepare(driver, prefix, args.posts, args.seed)
+        if args.warmup:
+            run(driver, prefix, workload(args.warmup, args.seed + 1), ids, args.clients)
+        samples, seconds = run(driver, prefix, ops, ids, args.clients)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    summary = summarize(samples, seconds, keep_samples=args.samples)
+    print(f"{target} ({args.mode}): {len(samples)} requests from {args.clients} clients over {len(ids)} posts "
+          f"in {seconds:.2f}s\n")
+    report(summary)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": metadata(args, target), **summary}, f, indent=1)
+            f.write("\n")
+    if summary["errors"]:
+        print(f"{summary['errors']} requests failed", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Merkle diff and delta sync vs a full export, by size of the difference.
+
+Two stores start with the same posts; then 0, 1, 10, ... of the second
+store's posts are changed (edits, new comments, deletes and posts only it
+has), and the two are compared and synced through ``blog.merkle`` in
+process. Every answer a tree gives is JSON-encoded, as it would be over
+HTTP, and its size counted, next to the size of a full export of the
+store. Exits non-zero if a sync leaves the stores different.
+
+    python -m bench.merkle [--posts 100000] [--changes 0,1,10,100,1000]
+"""
+import argparse
+import json
+import sys
+import time
+
+from blog import handoff, merkle
+from blog.store import PostStore
+
+CONTENT = "Blue-green deployment keeps two production environments side by side. " * 4
+
+
+class Counted:
+    """A tree whose answers are measured as if they came over HTTP."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.requests = 0
+        self.bytes = 0
+
+    def nodes(self, prefixes):
+        return self._count(self.tree.nodes(prefixes))
+
+    def records(self, ids):
+        return self._count(self.tree.records(ids))
+
+    def apply(self, posts=(), delete=()):
+        self._count(self.tree.apply(posts, delete))
+
+    def _count(self, answer):
+        self.requests += 1
+        self.bytes += len(json.dumps(answer))
+        return answer
+
+
+def posts(count):
+    for i in range(count):
+        yield {"id": f"p{i}", "title": f"Post {i}", "content": CONTENT, "author": f"author {i % 100}",
+               "date": "2024-01-01", "comments": []}
+
+
+def change(store, count):
+    """Change ``count`` posts of ``store``: a quarter each edited, commented on, deleted and added."""
+    for k in range(count):
+        post_id = f"p{k * 7919 % len(store)}"
+        kind = k % 4
+        if kind == 0:
+            store.update(post_id, title=f"Edited {k}")
+        elif kind == 1:
+            store.add_comment(post_id, {"id": str(k), "content": "Nice", "author": "r", "date": "2024-01-02"})
+        elif kind == 2:
+            store.delete(post_id)
+        else:
+            store.add({"id": f"new{k}", "title": "New", "content": CONTENT, "author": "a", "date": "2024-01-03",
+                       "comments": []})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100000, help="posts in each store (default: 100000)")
+    parser.add_argument("--changes", default="0,1,10,100,1000", help="comma-separated differences to sync")
+    args = parser.parse_args()
+
+    source = PostStore(list(posts(args.posts))[::-1])
+    source_tree = merkle.MerkleTree(source)
+    started = time.perf_counter()
+    source_tree.root()
+    print(f"{args.posts} posts: tree built in {time.perf_counter() - started:.2f}s")
+    export_bytes = sum(len(line) for line in handoff.export_lines(source, "bench"))
+    print(f"full export: {export_bytes / 2**20:.1f} MiB\n")
+
+    failed = False
+    print(f"{'changes':>8}{'differ':>8}{'sync requests':>15}{'diff KiB':>10}{'sync KiB':>10}"
+          f"{'diff ms':>9}{'sync ms':>9}{'vs export':>11}")
+    for count in (int(n) for n in args.changes.split(",")):
+        target = PostStore(list(posts(args.posts))[::-1])
+        target_tree = merkle.MerkleTree(target)
+        target_tree.root()
+        change(target, count)
+
+        a, b = Counted(source_tree), Counted(target_tree)
+        started = time.perf_counter()
+        ids = merkle.diff(a, b)
+        diffed = time.perf_counter() - started
+        diff_bytes = a.bytes + b.bytes
+        # The sync diffs again, then fetches and writes the posts
+        a, b = Counted(source_tree), Counted(target_tree)
+        started = time.perf_counter()
+        merkle.sync(a, b)
+        synced = time.perf_counter() - started
+        sync_bytes = a.bytes + b.bytes
+        if target_tree.root() != source_tree.root():
+            failed = True
+        print(f"{count:>8}{len(ids):>8}{a.requests + b.requests:>15}{diff_bytes / 1024:>10.1f}"
+              f"{sync_bytes / 1024:>10.1f}{diffed * 1000:>9.1f}{synced * 1000:>9.1f}"
+              f"{sync_bytes / export_bytes:>10.2%}{'' if target_tree.root() == source_tree.root() else '  DIFFERENT'}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Overhead of the request metrics (blog.metrics).
+
+Times the same requests through ``app_1``'s WSGI app with and without the
+``Instrumented`` middleware, in process, so the difference is the cost
+of recording: for ``/app1/health`` (answered ahead of Flask, the worst
+case relative to the request) and for the listing page. Also times
+``Metrics.record`` on its own, from one thread and from several at once,
+and rendering ``/metrics``.
+
+    python -m bench.metrics [--requests 20000] [--threads 8]
+"""
+import argparse
+import io
+import threading
+import time
+
+from werkzeug.test import EnvironBuilder
+
+from blog.metrics import Instrumented
+
+import app_1
+
+
+def time_requests(wsgi_app, path, count):
+    base = EnvironBuilder(path=path).get_environ()
+
+    def start_response(status, headers, exc_info=None):
+        return None
+
+    started = time.perf_counter()
+    for _ in range(count):
+        environ = dict(base, **{"wsgi.input": io.BytesIO()})
+        result = wsgi_app(environ, start_response)
+        for _ in result:
+            pass
+        if hasattr(result, "close"):
+            result.close()
+    return (time.perf_counter() - started) / count
+
+
+def time_record(metrics, count, threads):
+    def record():
+        shard = metrics.shard()
+        for _ in range(count):
+            metrics.record(shard, "home", 200, 0.0012)
+
+    workers = [threading.Thread(target=record) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (count * threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000, help="requests per measurement (default: 20000)")
+    parser.add_argument("--threads", type=int, default=8, help="threads recording at once (default: 8)")
+    args = parser.parse_args()
+
+    app = app_1.app
+    instrumented = app.wsgi_app
+    assert isinstance(instrumented, Instrumented)
+    metrics = instrumented.metrics
+
+    print(f"{'path':<16}{'plain us':>10}{'metrics us':>12}{'overhead us':>13}{'overhead':>10}")
+    for path, count in (("/app1/health", args.requests * 5), ("/app1/", args.requests)):
+        # Warm up, then alternate so drift affects both alike
+        time_requests(instrumented, path, count // 10)
+        plain = min(time_requests(instrumented.app, path, count // 2) for _ in range(3))
+        timed = min(time_requests(instrumented, path, count // 2) for _ in range(3))
+        print(f"{path:<16}{plain * 1e6:>10.2f}{timed * 1e6:>12.2f}{(timed - plain) * 1e6:>13.2f}"
+              f"{(timed - plain) / plain:>10.1%}")
+
+    print(f"\nMetrics.record: {time_record(metrics, args.requests * 10, 1) * 1e9:.0f}ns per call from 1 thread, "
+          f"{time_record(metrics, args.requests * 10, args.threads) * 1e9:.0f}ns per call "
+          f"from {args.threads} threads at once")
+    started = time.perf_counter()
+    body = app.test_client().get("/app1/metrics").data
+    print(f"/metrics: {len(body)} bytes rendered in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
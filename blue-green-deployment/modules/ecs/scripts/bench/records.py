@@ -0,0 +1,63 @@
+"""Memory per post: plain dicts vs the compact records of ``blog.records``.
+
+Generates the same synthetic blog (see ``blog.dataset``) twice, each in a
+fresh process under tracemalloc: once kept as the dicts the generator
+yields, as the store used to hold them, and once converted to ``Post`` and
+``Comment`` records, as ``PostStore`` holds them now. A record carries
+its lower-cased search text, which the search index used to keep a copy
+of per post, so the dicts are measured together with that copy. Reports
+the bytes traced per post, which covers the posts' strings as well as
+their containers, how many such posts fit in 400 MiB (the headroom of a
+512 MB task) and the process's peak resident memory. The rest of the
+search index is not included: it is the same for both.
+
+    python -m bench.records [--posts 1000000] [--seed 0]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Runs in a fresh interpreter: prints bytes traced, peak RSS in KiB and posts held
+MEASURE = """
+import gc, json, resource, sys, tracemalloc
+from blog import dataset
+from blog.records import Post
+from blog.search import SEARCH_FIELDS
+variant, count, seed = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+tracemalloc.start()
+if variant == "dict":
+    posts = list(dataset.generate(count, seed))
+    texts = [tuple((post.get(field) or "").lower() for field in SEARCH_FIELDS) for post in posts]
+else:
+    posts = [Post.from_dict(post) for post in dataset.generate(count, seed)]
+gc.collect()
+traced = tracemalloc.get_traced_memory()[0]
+print(json.dumps([traced, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(posts)]))
+"""
+
+HEADROOM = 400 * 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=1000000, help="posts to generate (default: 1000000)")
+    parser.add_argument("--seed", type=int, default=0, help="generator seed (default: 0)")
+    args = parser.parse_args()
+
+    print(f"{args.posts} posts\n")
+    print(f"{'representation':<16}{'bytes/post':>12}{'MiB':>9}{'posts in 400 MiB':>18}{'peak RSS MiB':>14}")
+    per_post = {}
+    for variant in ("dict", "records"):
+        output = subprocess.run([sys.executable, "-c", MEASURE, variant, str(args.posts), str(args.seed)],
+                                check=True, capture_output=True, text=True).stdout
+        traced, rss, count = json.loads(output)
+        per_post[variant] = traced / count
+        print(f"{variant:<16}{per_post[variant]:>12.0f}{traced / 2**20:>9.0f}{HEADROOM // per_post[variant]:>18.0f}"
+              f"{rss / 1024:>14.0f}", flush=True)
+    saved = per_post["dict"] - per_post["records"]
+    print(f"\nrecords save {saved:.0f} bytes per post ({saved / per_post['dict']:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Replication lag between a live app and a standby following it.
+
+Starts ``app_1`` as the live color and, once it holds some posts, a
+second process as its standby (``BLOG_REPLICATE_FROM``), both with the
+production server. Writer threads then create, edit, comment on and
+delete posts on the live app as fast as it takes them while the standby's
+lag is sampled: how long after the live app reports its latest sequence
+number the standby reports having applied it. Finally the standby is
+promoted, as at switch time, and both stores are exported and compared
+post by post.
+
+Exits non-zero if the stores differ or the lag ever exceeded
+``--max-lag`` seconds.
+
+    python -m bench.replication [--posts 500] [--seconds 10] [--writers 4] [--max-lag 1]
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import secrets
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+from blog import handoff
+
+from bench.tenants import free_port
+
+PREFIX = "/app1"
+CONTENT = "Blue-green deployment keeps two production environments side by side. " * 4
+
+
+def start(token, source=None):
+    port = free_port()
+    env = dict(os.environ, BLOG_HANDOFF_TOKEN=token, BLOG_STORE="memory", BLOG_REPLICATE_FROM=source or "")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "blog.server", "app_1:app", "--host", "127.0.0.1", "--port", str(port),
+         "--threads", "8", "--workers", "1"],
+        env=env, stdout=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            request(port, "GET", "/health")
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def request(port, method, path, form=None, token=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    headers = {"Content-Type": "application/x-www-form-urlencoded"} if form else {}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    conn.request(method, path, urlencode(form) if form else None, headers)
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response.status, body
+
+
+def write(port, n, stop, counts):
+    """Writer ``n``: per 10 writes, 5 new posts, 2 edits, 2 comments, 1 delete."""
+    ids = []
+    k = 0
+    while not stop.is_set():
+        kind = k % 10
+        if kind < 5 or not ids:
+            request(port, "POST", PREFIX + "/create_post",
+                    {"title": f"Writer {n} post {k}", "content": CONTENT, "author": f"writer {n}"})
+            if kind == 4:
+                _, page = request(port, "GET", PREFIX + "/")
+                ids = re.findall(PREFIX.encode() + rb"/post/([\w-]+)", page)
+        elif kind < 7:
+            request(port, "POST", PREFIX + f"/edit_post/{ids[k % len(ids)].decode()}",
+                    {"title": f"Edited by {n} at {k}", "content": CONTENT, "author": f"writer {n}"})
+        elif kind < 9:
+            request(port, "POST", PREFIX + f"/add_comment/{ids[k % len(ids)].decode()}",
+                    {"content": f"Comment {k}", "author": f"writer {n}"})
+        else:
+            request(port, "GET", PREFIX + f"/delete_post/{ids.pop().decode()}")
+        k += 1
+    counts[n] = k
+
+
+def sample(live_port, standby_port, token, stop, samples):
+    """Time how long the standby takes to apply the live app's latest write, over and over."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        _, body = request(live_port, "GET", PREFIX + "/admin/replication", token=token)
+        target = json.loads(body)["seq"]
+        while True:
+            _, body = request(standby_port, "GET", PREFIX + "/admin/replication", token=token)
+            if json.loads(body)["applied_seq"] >= target:
+                break
+            time.sleep(0.002)
+        samples.append(time.perf_counter() - started)
+        time.sleep(0.05)
+
+
+def export(port, token):
+    status, body = request(port, "GET", PREFIX + "/admin/export", token=token)
+    assert status == 200, status
+    return handoff.read_export(body.splitlines(keepends=True))[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=500, help="posts on the live app before the standby starts")
+    parser.add_argument("--seconds", type=float, default=10, help="how long to write (default: 10)")
+    parser.add_argument("--writers", type=int, default=4, help="writer threads (default: 4)")
+    parser.add_argument("--max-lag", type=float, default=1.0, help="lag in seconds that fails the run (default: 1)")
+    args = parser.parse_args()
+
+    token = secrets.token_urlsafe(16)
+    live, live_port = start(token)
+    standby = None
+    try:
+        for i in range(args.posts):
+            request(live_port, "POST", PREFIX + "/create_post", {"title": f"Post {i}", "content": CONTENT,
+                                                                "author": "Bench"})
+        started = time.perf_counter()
+        standby, standby_port = start(token, f"http://127.0.0.1:{live_port}{PREFIX}")
+        print(f"standby started and copied {args.posts} posts in {time.perf_counter() - started:.1f}s")
+
+        stop = threading.Event()
+        counts = [0] * args.writers
+        samples = []
+        threads = [threading.Thread(target=write, args=(live_port, n, stop, counts)) for n in range(args.writers)]
+        threads.append(threading.Thread(target=sample, args=(live_port, standby_port, token, stop, samples)))
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        print(f"{sum(counts)} writes in {args.seconds:g}s = {sum(counts) / args.seconds:,.0f}/s; "
+              f"{len(samples)} lag samples")
+        print(f"  time for the standby to apply the live app's latest write: "
+              f"median {statistics.median(samples) * 1000:.1f}ms, max {max(samples) * 1000:.1f}ms")
+
+        started = time.perf_counter()
+        status, body = request(standby_port, "POST", PREFIX + "/admin/replication/promote?timeout=10",
+                               token=token)
+        print(f"promotion: HTTP {status} after {(time.perf_counter() - started) * 1000:.0f}ms, "
+              f"{json.loads(body)['applied_seq']} writes applied")
+        expected, actual = export(live_port, token), export(standby_port, token)
+        same = expected == actual
+        print(f"stores: {len(expected)} posts live, {len(actual)} on the standby, "
+              f"{'identical' if same else 'DIFFERENT'}")
+    finally:
+        live.terminate()
+        if standby is not None:
+            standby.terminate()
+
+    if status != 200 or not same or max(samples) > args.max_lag:
+        print("FAILED", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
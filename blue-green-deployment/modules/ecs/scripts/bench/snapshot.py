@@ -0,0 +1,80 @@
+"""Cold start from a memory-mapped snapshot vs loading the in-memory store.
+
+For each blog size a snapshot file is written once, then the time from
+opening it to serving the first listing page and a few posts by id is
+measured, in a fresh process so nothing is already paged in by Python.
+For comparison, the same posts are loaded into the in-memory
+``PostStore`` the way ``BLOG_STORE=wal`` recovers from its snapshot.
+
+    python -m bench.snapshot [--sizes 10000,100000,1000000] [--compare-limit 100000]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from blog.snapshot import write_snapshot
+
+CONTENT = "Blue-green deployment keeps two production environments side by side. " * 4
+
+# Runs in a fresh interpreter: prints the seconds to first page and lookups
+COLD_START = """
+import json, sys, time
+started = time.perf_counter()
+from blog.snapshot import MappedPostStore
+store = MappedPostStore(sys.argv[1])
+opened = time.perf_counter()
+store.page()
+for post_id in json.loads(sys.argv[2]):
+    assert store.get(post_id) is not None
+print(json.dumps([opened - started, time.perf_counter() - started]))
+"""
+
+
+def posts(count):
+    for i in range(count):
+        yield {"id": f"p{i}", "title": f"Post {i}", "content": CONTENT, "author": f"author {i % 100}",
+               "date": "2024-01-01", "comments": [{"id": "c", "content": "Nice", "author": "r", "date": "2024-01-02"}]}
+
+
+def load_in_memory(count):
+    from blog.store import PostStore
+    lines = [json.dumps(post) for post in posts(count)]
+    started = time.perf_counter()
+    PostStore().extend(json.loads(line) for line in lines)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated post counts")
+    parser.add_argument("--compare-limit", type=int, default=100000,
+                        help="largest size to also load into the in-memory store (default: 100000)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"{'posts':>9}{'file MiB':>10}{'write s':>9}{'open ms':>9}{'ready ms':>10}{'in-memory load s':>18}")
+        for count in (int(size) for size in args.sizes.split(",")):
+            path = os.path.join(directory, f"{count}.map")
+            started = time.perf_counter()
+            write_snapshot(path, posts(count))
+            written = time.perf_counter() - started
+            lookups = json.dumps([f"p{random.randrange(count)}" for _ in range(20)])
+            output = subprocess.run([sys.executable, "-c", COLD_START, path, lookups],
+                                    check=True, capture_output=True, text=True).stdout
+            opened, ready = json.loads(output)
+            memory = f"{load_in_memory(count):>18.1f}" if count <= args.compare_limit else f"{'-':>18}"
+            print(f"{count:>9}{os.path.getsize(path) / 2**20:>10.1f}{written:>9.1f}"
+                  f"{opened * 1000:>9.1f}{ready * 1000:>10.1f}{memory}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Concurrent stress check for PostStore: no lost updates under many threads.
+
+Writer threads create, edit and delete posts of their own and all add
+comments to the same few shared posts, while reader threads page through
+the listing, search and look posts up. Afterwards every comment and every
+surviving post must be there, exactly once; readers must never have seen
+an exception or a torn page.
+
+Then the append race: one writer adds ``--race-posts`` posts back to back
+to a fresh store of the same kind, without the write-ahead log so nothing
+slows the adds down, while head readers fetch only the newest post
+(``page(limit=1)``) in a tight loop. They land between the steps of an
+``add``, where a post listed before it can be read shows up as an error.
+Exits non-zero on any failure.
+
+    python -m bench.store_stress [--threads 32] [--ops 1000] [--readers 4] [--race-posts 50000] [--backend sqlite]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from blog import store as blog_store
+from blog.snapshot import MappedPostStore
+from blog.sqlite_store import SQLitePostStore
+
+SHARED_POSTS = 4
+
+
+def writer(store, n, ops, barrier):
+    barrier.wait()
+    for k in range(ops):
+        post_id = f"w{n}-{k}"
+        store.add({"id": post_id, "title": f"draft {n} {k}", "content": "stress", "author": f"w{n}"})
+        store.add_comment(f"shared-{k % SHARED_POSTS}", {"author": f"w{n}", "content": str(k)})
+        store.update(post_id, title=f"final {n} {k}")
+        if k % 2:
+            store.delete(post_id)
+
+
+def reader(store, stop, errors):
+    while not stop.is_set():
+        try:
+            after = None
+            seen = set()
+            while True:
+                page = store.page(after=after, limit=50)
+                for post in page.posts:
+                    if post["id"] in seen:
+                        raise AssertionError(f"{post['id']} listed twice in one walk")
+                    seen.add(post["id"])
+                if page.next_after is None:
+                    break
+                after = page.next_after
+            for post in store.search("stress")[:20]:
+                assert store.version(post["id"]) >= 0
+                store.get(post["id"])
+            len(store)
+        except Exception as exc:  # report, don't stop the other readers
+            errors.append(repr(exc))
+
+
+def head_reader(store, stop, errors):
+    while not stop.is_set():
+        try:
+            for post in store.page(limit=1).posts:
+                post["id"]
+        except Exception as exc:
+            errors.append(repr(exc))
+
+
+def append_race(backend, posts, head_readers):
+    """Add ``posts`` posts to a fresh, unlogged store while head readers list the newest; returns failures."""
+    if backend == "mmap":
+        store = MappedPostStore()
+    elif backend == "sqlite":
+        store = SQLitePostStore(os.path.join(blog_store.DATA_DIR, "race.sqlite3"))
+    else:
+        store = blog_store.PostStore()
+    stop = threading.Event()
+    errors = []
+    readers = [threading.Thread(target=head_reader, args=(store, stop, errors)) for _ in range(head_readers)]
+    for thread in readers:
+        thread.start()
+    try:
+        for k in range(posts):
+            store.add({"id": f"race-{k}", "title": "race", "content": "", "author": ""})
+    finally:
+        stop.set()
+        for thread in readers:
+            thread.join()
+    if len(store) != posts:
+        errors.append(f"append race: {len(store)} posts, expected {posts}")
+    return [f"append race: {error}" for error in errors[:10]]
+
+
+def check(store, threads, ops):
+    failures = []
+    for s in range(SHARED_POSTS):
+        comments = store.get(f"shared-{s}")["comments"]
+        expected = threads * len(range(s, ops, SHARED_POSTS))
+        if len(comments) != expected:
+            failures.append(f"shared-{s}: {len(comments)} comments, expected {expected}")
+        keys = {(c["author"], c["content"]) for c in comments}
+        if len(keys) != len(comments):
+            failures.append(f"shared-{s}: duplicate comments")
+    survivors = [f"w{n}-{k}" for n in range(threads) for k in range(0, ops, 2)]
+    expected_len = SHARED_POSTS + len(survivors)
+    if len(store) != expected_len or len(list(store)) != expected_len:
+        failures.append(f"{len(store)} posts ({len(list(store))} listed), expected {expected_len}")
+    for post_id in survivors:
+        post = store.get(post_id)
+        if post is None or not post["title"].startswith("final"):
+            failures.append(f"{post_id}: lost or stale ({post and post['title']})")
+            break
+    if len(store.search("final")) != len(survivors):
+        failures.append(f"search finds {len(store.search('final'))} edited posts, expected {len(survivors)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32, help="writer threads (default: 32)")
+    parser.add_argument("--ops", type=int, default=1000, help="posts created per writer (default: 1000)")
+    parser.add_argument("--readers", type=int, default=4, help="reader threads (default: 4)")
+    parser.add_argument("--race-posts", type=int, default=50000,
+                        help="posts added during the append race, 0 to skip it (default: 50000)")
+    parser.add_argument("--head-readers", type=int, default=3,
+                        help="threads reading only the newest post during the append race (default: 3)")
+    parser.add_argument("--backend", choices=blog_store.STORE_BACKENDS, default="memory",
+                        help="store backend (default: memory; sqlite uses a temporary directory)")
+    args = parser.parse_args()
+
+    # Switch threads far more often than the default 5ms to force interleaving
+    sys.setswitchinterval(1e-5)
+    blog_store.DATA_DIR = tempfile.mkdtemp()
+    store = blog_store.open_store("stress", [
+        {"id": f"shared-{s}", "title": "shared", "content": "", "author": "", "comments": []}
+        for s in range(SHARED_POSTS)
+    ], backend=args.backend)
+    barrier = threading.Barrier(args.threads)
+    stop = threading.Event()
+    errors = []
+    readers = [threading.Thread(target=reader, args=(store, stop, errors)) for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer, args=(store, n, args.ops, barrier)) for n in range(args.threads)]
+    start = time.perf_counter()
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    failures = check(store, args.threads, args.ops) + errors[:10]
+    writes = args.threads * args.ops * 3.5
+    print(f"{args.backend}: {args.threads} writers x {args.ops} posts, {args.readers} readers: "
+          f"{writes:.0f} writes in {elapsed:.1f}s ({writes / elapsed:.0f}/s)")
+    if args.race_posts:
+        start = time.perf_counter()
+        failures += append_race(args.backend, args.race_posts, args.head_readers)
+        print(f"append race: {args.race_posts} adds, {args.head_readers} head readers, "
+              f"{time.perf_counter() - start:.1f}s")
+    for failure in failures:
+        print("FAIL", failure)
+    if failures:
+        sys.exit(1)
+    print("OK: no lost updates, readers saw no errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Requests/sec for home() and view_post(): per-request compile vs precompiled.
+
+"Before" runs with the Jinja template cache and bytecode cache switched off,
+so every request parses and compiles its templates the way
+``render_template_string(BLOG_TEMPLATE, ...)`` used to. "After" is the app
+as it runs in production.
+
+    python -m bench.templates [--app app_1] [--requests 2000]
+"""
+import argparse
+import importlib
+import time
+
+
+def measure(client, path, requests):
+    for _ in range(50):
+        client.get(path)
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="app_1", help="app module to benchmark (default: app_1)")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per route (default: 2000)")
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.app)
+    client = module.app.test_client()
+    env = module.app.jinja_env
+    routes = {
+        "home()": module.app_prefix + "/",
+        "view_post()": module.app_prefix + "/post/1",
+    }
+
+    cache, bytecode_cache = env.cache, env.bytecode_cache
+    env.cache, env.bytecode_cache = None, None
+    before = {name: measure(client, path, args.requests) for name, path in routes.items()}
+    env.cache, env.bytecode_cache = cache, bytecode_cache
+    after = {name: measure(client, path, args.requests) for name, path in routes.items()}
+
+    print(f"{'route':<14}{'before req/s':>14}{'after req/s':>14}{'speedup':>10}")
+    for name in routes:
+        print(f"{name:<14}{before[name]:>14.0f}{after[name]:>14.0f}{after[name] / before[name]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Resident memory of the three blog tenants: three processes vs one.
+
+Starts the production server once per app (the old layout: one
+interpreter, container or systemd unit per app), then once with all three
+apps mounted in a single process, and drives the same load through both:
+posts created, then listing, post and search pages fetched, per tenant.
+Resident memory (VmRSS, Linux only) is read after startup and after the
+load.
+
+    python -m bench.tenants [--posts 200] [--requests 300]
+"""
+import argparse
+import http.client
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+APPS = ("app_1", "app_2", "app_3")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start(targets):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "blog.server", *(f"{name}:app" for name in targets),
+         "--host", "127.0.0.1", "--port", str(port), "--threads", "4", "--workers", "1"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            request(port, "GET", "/health")
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"server for {targets} did not start")
+
+
+def request(port, method, path, form=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    body = urlencode(form) if form else None
+    headers = {"Content-Type": "application/x-www-form-urlencoded"} if form else {}
+    conn.request(method, path, body, headers)
+    conn.getresponse().read()
+    conn.close()
+
+
+def load(port, prefix, posts, requests):
+    for i in range(posts):
+        request(port, "POST", prefix + "/create_post", {
+            "title": f"Tenant post {i}",
+            "content": "Blue-green deployment keeps two production environments side by side. " * 8,
+            "author": "Bench",
+        })
+    for i in range(requests):
+        request(port, "GET", (prefix + "/", prefix + "/post/1", prefix + "/search?q=tenant")[i % 3])
+
+
+def rss_kib(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=200, help="posts created per tenant (default: 200)")
+    parser.add_argument("--requests", type=int, default=300, help="page requests per tenant (default: 300)")
+    args = parser.parse_args()
+
+    prefixes = {name: "/app" + name[-1] for name in APPS}
+    separate = [start([name]) for name in APPS]
+    combined = start(APPS)
+    try:
+        idle_separate = [rss_kib(proc.pid) for proc, _ in separate]
+        idle_combined = rss_kib(combined[0].pid)
+        for name, (_, port) in zip(APPS, separate):
+            load(port, prefixes[name], args.posts, args.requests)
+        for name in APPS:
+            load(combined[1], prefixes[name], args.posts, args.requests)
+        loaded_separate = [rss_kib(proc.pid) for proc, _ in separate]
+        loaded_combined = rss_kib(combined[0].pid)
+    finally:
+        for proc, _ in separate + [combined]:
+            proc.terminate()
+            proc.wait()
+
+    print(f"{args.posts} posts + {args.requests} page requests per tenant; resident memory in MiB\n")
+    print(f"{'layout':<28}{'idle':>10}{'loaded':>10}{'per tenant':>12}")
+    for name, idle, loaded in zip(APPS, idle_separate, loaded_separate):
+        print(f"{'  process ' + name:<28}{idle / 1024:>10.1f}{loaded / 1024:>10.1f}{loaded / 1024:>12.1f}")
+    print(f"{'three processes, total':<28}{sum(idle_separate) / 1024:>10.1f}"
+          f"{sum(loaded_separate) / 1024:>10.1f}{sum(loaded_separate) / 3 / 1024:>12.1f}")
+    print(f"{'one process, three tenants':<28}{idle_combined / 1024:>10.1f}"
+          f"{loaded_combined / 1024:>10.1f}{loaded_combined / 3 / 1024:>12.1f}")
+    print(f"\none process uses {loaded_combined / sum(loaded_separate):.0%} of the memory of three")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Shared building blocks for the blue-green blog apps (app_1.py, app_2.py, app_3.py)."""
@@ -0,0 +1,61 @@
+"""Fingerprinted static assets for the blog pages.
+
+The stylesheet used to be inlined into every HTML response. It now lives in
+``blog/static`` and is served from memory under a name containing a hash
+of its content (``blog.<hash>.css``) with a far-future, immutable
+``Cache-Control``, so a browser fetches it once per deployed version.
+
+Asset URLs sit under the app prefix so the ALB routes them to the same
+target group as the pages. A request for an outdated fingerprint, e.g. a
+page from the old color during a blue/green cutover, still gets the
+current file, but without the immutable caching. Assets are compressed
+once at startup (see ``blog.compression``).
+"""
+import hashlib
+import os
+from collections import namedtuple
+
+from flask import abort, request
+
+from blog.compression import Payload
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+StaticAsset = namedtuple("StaticAsset", "name filename digest payload")
+
+
+def load_asset(name, mimetype):
+    """Read ``blog/static/<name>`` and fingerprint it."""
+    with open(os.path.join(STATIC_DIR, name), "rb") as f:
+        body = f.read()
+    digest = hashlib.sha256(body).hexdigest()[:12]
+    stem, ext = os.path.splitext(name)
+    return StaticAsset(name, f"{stem}.{digest}{ext}", digest, Payload(body, mimetype))
+
+
+def init_app(app, app_prefix):
+    """Register the asset route and the ``stylesheet_url`` template global."""
+    stylesheet = load_asset("blog.css", "text/css")
+    assets = {stylesheet.name: stylesheet}
+    static_url = app_prefix + "/static/"
+
+    def static_asset(filename):
+        stem, _, ext = filename.rpartition(".")
+        name, _, digest = stem.rpartition(".")
+        if not name:  # unfingerprinted name, e.g. blog.css
+            name, digest = stem, ""
+        asset = assets.get(f"{name}.{ext}")
+        if asset is None:
+            abort(404)
+        response = asset.payload.response(etag=asset.digest)
+        if digest == asset.digest:
+            response.headers["Cache-Control"] = IMMUTABLE
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    app.add_url_rule(static_url + "<filename>", "static_asset", static_asset)
+    app.jinja_env.globals["stylesheet_url"] = static_url + stylesheet.filename
+    app.extensions["blog_assets"] = assets
+    return assets
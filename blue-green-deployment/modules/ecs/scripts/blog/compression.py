@@ -0,0 +1,107 @@
+"""Response compression for the blog apps.
+
+HTML and JSON responses above ``BLOG_COMPRESS_MIN_SIZE`` bytes are gzip
+compressed, or brotli compressed when the optional ``brotli`` package is
+installed and the client accepts it. The encoding is negotiated from
+``Accept-Encoding`` and every compressible response carries
+``Vary: Accept-Encoding`` so the ALB and browsers keep the variants apart.
+
+Payloads that never change (static assets, the /health body) are wrapped
+in a ``Payload``, which compresses them once, at the highest level, when
+the app starts; serving one costs no compression work at all.
+
+``bench/compression.py`` measures bytes on the wire and CPU per request at
+each level, to pick ``BLOG_GZIP_LEVEL`` / ``BLOG_BROTLI_QUALITY``.
+"""
+import gzip
+import json
+import os
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+MIN_SIZE = int(os.environ.get("BLOG_COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("BLOG_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BLOG_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = frozenset((
+    "text/html", "text/css", "text/plain", "application/json", "application/javascript",
+))
+# Preferred first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data, encoding, level=None):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL if level is None else level, mtime=0)
+
+
+def negotiate(accept_encodings, available=ENCODINGS):
+    """Pick the preferred encoding the client accepts, or None for identity."""
+    for encoding in available:
+        if accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def etag_variants(etag):
+    """All ETags a representation of ``etag`` may have been served under."""
+    return (etag,) + tuple(f"{etag}-{encoding}" for encoding in ENCODINGS)
+
+
+class Payload:
+    """A response body that never changes, compressed once up front."""
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.encoded = {}
+        for encoding in ENCODINGS:
+            level = 11 if encoding == "br" else 9
+            data = compress(body, encoding, level)
+            # Tiny bodies can grow when compressed; those are sent as-is
+            if len(data) < len(body):
+                self.encoded[encoding] = data
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(json.dumps(obj, separators=(",", ":"), sort_keys=True).encode(), "application/json")
+
+    def response(self, status=200, etag=None):
+        """Build the response for the current request's Accept-Encoding."""
+        encoding = negotiate(request.accept_encodings, tuple(self.encoded))
+        response = Response(self.encoded[encoding] if encoding else self.body, status, mimetype=self.mimetype)
+        response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if etag:
+            response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+        return response
+
+
+def init_app(app, min_size=MIN_SIZE):
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_TYPES or response.direct_passthrough:
+            return response
+        response.vary.add("Accept-Encoding")
+        if response.status_code != 200 or "Content-Encoding" in response.headers:
+            return response
+        data = response.get_data()
+        encoding = negotiate(request.accept_encodings)
+        if len(data) < min_size or encoding is None:
+            return response
+        response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
+
+    # Hooks run in reverse order of registration; going first in the list
+    # makes this one run after every other hook has set its headers
+    app.after_request_funcs.setdefault(None, []).insert(0, compress_response)
@@ -0,0 +1,97 @@
+"""Rendered-fragment cache for the post cards on the listing page.
+
+Each card (title, author, date, comment count and excerpt) is rendered
+once and kept as HTML, keyed by post id together with the post's version,
+which the listing page gets along with the post (``Page.versions``).
+Cards without a version (search results) are rendered and not cached.
+Every write that changes what a card shows (editing the post, adding a
+comment, deleting it) gives the post a new version, so a cached card is
+never served stale and the listing page is mostly a join of cached
+fragments.
+
+The cache is a bounded LRU; its size comes from ``BLOG_FRAGMENT_CACHE_SIZE``
+(0 disables it).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from flask import jsonify
+from markupsafe import Markup
+
+DEFAULT_CACHE_SIZE = int(os.environ.get("BLOG_FRAGMENT_CACHE_SIZE", "2048"))
+CARD_TEMPLATE = "_post_card.html"
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered HTML, one entry per key holding its version."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, html)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version, render):
+        """Return the cached fragment for ``key`` at ``version``, rendering it on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        html = render()
+        if self.maxsize > 0:
+            with self._lock:
+                entry = self._entries.get(key)
+                # Never let a slower render of an old version replace a newer one
+                if entry is None or entry[0] < version:
+                    self._entries[key] = (version, html)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+def init_app(app, app_prefix, maxsize=DEFAULT_CACHE_SIZE):
+    """Expose the cached ``post_card(post, version)`` to templates and a stats endpoint.
+
+    Call after ``templates.init_app``.
+    """
+    cache = FragmentCache(maxsize)
+    template = app.jinja_env.get_template(CARD_TEMPLATE)
+
+    def post_card(post, version=None):
+        # The version must come from the snapshot the post was read from
+        # (Page.cards()): looked up again in the live store, it could be
+        # newer than the post and file the old card under the new version
+        if version is None:
+            return Markup(template.render(post=post))
+        return cache.get(post["id"], version, lambda: Markup(template.render(post=post)))
+
+    def cache_stats():
+        return jsonify({"post_cards": cache.stats()})
+
+    app.jinja_env.globals["post_card"] = post_card
+    app.extensions["blog_post_cards"] = cache
+    app.add_url_rule(app_prefix + "/cache_stats", "cache_stats", cache_stats)
+    return cache
@@ -0,0 +1,253 @@
+"""State handoff from the live color to the one replacing it.
+
+A switch used to start the new color with only its seed posts, so
+everything written since the last deploy was lost. Now the running app can
+export its store, and a starting app can import it before it serves a
+request:
+
+Export
+    ``GET /appN/admin/export`` streams every post, comments included, as
+    newline-delimited JSON: a header line, one line per post (newest
+    first) and an end line carrying the count, so a truncated transfer is
+    detected. The request must carry ``Authorization: Bearer <token>``
+    with the token from ``BLOG_HANDOFF_TOKEN``; without one configured
+    the endpoint does not exist. The header also carries the position in
+    the app's change feed the export is exact as of (``blog.replication``).
+    With ``?read_only=1`` the app first stops taking writes: new ones get a
+    503, and the export waits for those in flight. It stays read-only, so
+    nothing written after the export is lost when it is stopped.
+Import
+    When ``BLOG_IMPORT_FROM`` is set, the app loads its posts from there
+    at startup instead of from the seed: either the live app's URL
+    (``http://<host>/app1``) or a file saved with ``python -m blog.handoff
+    export``. The whole transfer must finish within
+    ``BLOG_IMPORT_TIMEOUT`` seconds (default 30, inside the 60s health
+    check grace period); if it fails or runs over, the app starts from
+    its seed posts and says so. The transfer time is printed either way.
+    ``{prefix}`` and ``{service}`` in the value are replaced with the
+    app's own (``source_for``), so one process serving several apps (see
+    ``blog.factory.mount``) gives each its own source, e.g.
+    ``http://<host>{prefix}`` or ``/home/ec2-user/handoff_{service}.ndjson``.
+    Without either, such a process refuses to start.
+
+Persistent backends (``BLOG_STORE=wal``, ``mmap``, ``sqlite``) only
+import when their store starts out empty, like the seed. An imported
+file is renamed to ``<file>.imported`` once its posts were loaded, so a
+later restart does not bring them back.
+
+Only the EC2 switch uses this: ``setup_flask_service_switch.py`` exports
+the running app read-only to a file before stopping it and starts the new
+one with ``BLOG_IMPORT_FROM`` pointing at it. The ECS task definitions
+set none of these variables; to hand over there, set
+``BLOG_HANDOFF_TOKEN`` on both services and ``BLOG_IMPORT_FROM`` on the
+new one to the live color's URL.
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+from flask import Response, abort, g, request
+
+from blog import records
+
+TOKEN = os.environ.get("BLOG_HANDOFF_TOKEN", "")
+IMPORT_FROM = os.environ.get("BLOG_IMPORT_FROM", "")
+IMPORT_TIMEOUT = float(os.environ.get("BLOG_IMPORT_TIMEOUT", "30"))
+
+# Replaced per app in BLOG_IMPORT_FROM and BLOG_REPLICATE_FROM (see source_for)
+SOURCE_PLACEHOLDERS = ("{prefix}", "{service}")
+
+EXPORT_PATH = "/admin/export"
+FORMAT = "blog-export/1"
+# Endpoints that write to the store, refused once an export made the app read-only
+WRITE_ENDPOINTS = frozenset(("create_post", "edit_post", "delete_post", "add_comment"))
+# How long a read-only export waits for the writes in flight
+WRITE_DRAIN_TIMEOUT = 10.0
+
+logger = logging.getLogger(__name__)
+
+
+def export_lines(store, service_name, changes=None):
+    """Yield the export of ``store``, one encoded line at a time.
+
+    ``changes`` is the store's ``blog.replication.ChangeLog``, if it has one.
+    """
+    header = {"format": FORMAT, "service": service_name}
+    if changes is not None:
+        # The change feed position the export is exact as of, for a standby
+        # to tail from (see blog.replication)
+        posts = store.checkpoint(lambda: header.update(seq=changes.last_seq, epoch=changes.epoch))[::-1]
+    else:
+        # One consistent view of the store; posts are encoded as they are sent
+        posts = list(store)
+    header["posts"] = len(posts)
+    yield _line(header)
+    for post in posts:
+        # Listings from the SQLite store carry a comment count, not the comments
+        yield _line(post if "comments" in post else store.get(post["id"]) or post)
+    yield _line({"end": True, "posts": len(posts)})
+
+
+def init_app(app, app_prefix, store, service_name, token=TOKEN):
+    """Register the export route, when a handoff token is configured."""
+    if not token:
+        return
+    writes = _WriteGate()
+
+    @app.before_request
+    def refuse_writes_when_read_only():
+        if request.endpoint in WRITE_ENDPOINTS:
+            if not writes.enter():
+                abort(503, "This app is read-only while its posts are handed over to the next version.")
+            g.blog_writing = True
+
+    @app.teardown_request
+    def end_write(exc=None):
+        if g.pop("blog_writing", False):
+            writes.leave()
+
+    def export_state():
+        require_token(token)
+        if request.args.get("read_only") == "1" and not writes.freeze(WRITE_DRAIN_TIMEOUT):
+            logger.warning("Exporting while writes are still running; they may be missing from the export")
+        changes = app.extensions.get("blog_changes")
+        response = Response(export_lines(store, service_name, changes), mimetype="application/x-ndjson")
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    app.add_url_rule(app_prefix + EXPORT_PATH, "export_state", export_state)
+
+
+def require_token(token):
+    """Abort with a 401 unless the request carries ``Authorization: Bearer <token>``."""
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()):
+        abort(401)
+
+
+def source_for(source, app_prefix, service_name):
+    """``source`` with ``{prefix}`` and ``{service}`` replaced with the app's."""
+    return source.replace("{prefix}", app_prefix).replace("{service}", service_name)
+
+
+def open_export(source, token=TOKEN, timeout=IMPORT_TIMEOUT, read_only=False):
+    """Open an export for reading: the live app's URL or a saved file.
+
+    ``read_only`` makes the app stop taking writes before it exports.
+    """
+    if not source.startswith(("http://", "https://")):
+        return open(source, "rb")
+    url = source if source.endswith(EXPORT_PATH) else source.rstrip("/") + EXPORT_PATH
+    if read_only:
+        url += "?read_only=1"
+    return urllib.request.urlopen(
+        urllib.request.Request(url, headers={"Authorization": f"Bearer {token}"}), timeout=timeout)
+
+
+def read_export(lines, deadline=None):
+    """Parse an export; returns its header and its posts, newest first.
+
+    Raises ValueError for a malformed or truncated export and
+    TimeoutError once ``deadline`` (a ``time.monotonic()`` value) passes.
+    """
+    lines = iter(lines)
+    header = json.loads(next(lines, b"{}"))
+    if header.get("format") != FORMAT:
+        raise ValueError(f"not a {FORMAT} stream")
+    posts = []
+    for line in lines:
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"import still running after {len(posts)} posts")
+        record = json.loads(line)
+        if "id" not in record:
+            if record.get("end") and record.get("posts") == len(posts):
+                return header, posts
+            break
+        posts.append(record)
+    raise ValueError(f"export ended after {len(posts)} of {header.get('posts')} posts")
+
+
+def initial_posts(service_name, seed, source=IMPORT_FROM, token=TOKEN, timeout=IMPORT_TIMEOUT):
+    """The posts a starting app loads: imported from ``source`` if set, else ``seed``.
+
+    Call it only when the store will load them (``blog.store.open_store``
+    takes it as a function): an imported file is renamed once read.
+    """
+    if not source:
+        return seed
+    started = time.monotonic()
+    try:
+        with open_export(source, token, timeout) as lines:
+            _, posts = read_export(lines, started + timeout)
+    except (OSError, ValueError) as e:  # TimeoutError is an OSError
+        print(f"{service_name}: state import from {source} failed after {time.monotonic() - started:.2f}s "
+              f"({e}); starting from the seed posts", file=sys.stderr, flush=True)
+        return seed
+    print(f"{service_name}: imported {len(posts)} posts from {source} in {time.monotonic() - started:.2f}s",
+          file=sys.stderr, flush=True)
+    if os.path.isfile(source):
+        # Imported once: a later restart must not bring these posts back
+        os.replace(source, source + ".imported")
+    return posts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Save a running blog app's export to a file.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("url", help="the running app, e.g. http://127.0.0.1/app1")
+    parser.add_argument("--out", required=True, help="file to write; replaced only once the export is complete")
+    parser.add_argument("--read-only", action="store_true",
+                        help="make the app refuse writes first, so none are lost after the export")
+    parser.add_argument("--timeout", type=float, default=IMPORT_TIMEOUT,
+                        help=f"seconds allowed for the transfer (default: BLOG_IMPORT_TIMEOUT or {IMPORT_TIMEOUT:g})")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    with open_export(args.url, timeout=args.timeout, read_only=args.read_only) as stream:
+        data = stream.read()
+    _, posts = read_export(data.splitlines(keepends=True), started + args.timeout)
+    with open(args.out + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(args.out + ".tmp", args.out)
+    print(f"Exported {len(posts)} posts ({len(data) / 2**20:.1f} MiB) from {args.url} "
+          f"in {time.monotonic() - started:.2f}s to {args.out}")
+
+
+class _WriteGate:
+    """Counts the write requests in flight, and closes for good on ``freeze``."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._running = 0
+        self.frozen = False
+
+    def enter(self):
+        with self._cond:
+            if self.frozen:
+                return False
+            self._running += 1
+            return True
+
+    def leave(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def freeze(self, timeout):
+        """Refuse new writes; returns whether the running ones finished in ``timeout`` seconds."""
+        with self._cond:
+            self.frozen = True
+            return self._cond.wait_for(lambda: not self._running, timeout)
+
+
+def _line(record):
+    return json.dumps(record, separators=(",", ":"), default=records.json_default).encode() + b"\n"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Prometheus metrics for the blog apps.
+
+``GET /metrics`` and ``GET /appN/metrics`` return, in the Prometheus text
+format:
+
+``blog_requests_total{endpoint, code}``
+    Requests served, by Flask endpoint and status code. Requests no route
+    matched are counted under ``endpoint="other"``.
+``blog_request_duration_seconds{endpoint}``
+    A histogram of the time the app took per request, with fixed
+    ``BUCKETS``, measured around the WSGI call (a streamed body, such as
+    the export, is not included).
+``blog_requests_in_flight``
+    Requests being handled right now.
+``blog_store_posts``
+    Posts in the store.
+``blog_cache_hits_total`` / ``blog_cache_misses_total`` / ``blog_cache_hit_ratio``
+    Per cache (``cache="post_cards"``, see ``blog.fragments``).
+``blog_replication_lag_seconds`` / ``blog_replication_lag_entries``
+    On a standby (see ``blog.replication``).
+
+Recording is kept off the request's back: every endpoint, status code
+and bucket has a slot in a flat array preallocated per request thread,
+so recording a request is a few list increments, with no lock and no new
+objects. A scrape adds the threads' arrays up. Status codes outside
+``CODES`` are counted as ``code="other"``. ``bench/metrics.py`` measures
+the overhead.
+"""
+import bisect
+import threading
+import time
+
+from flask import Response, request
+
+# Upper bounds in seconds; the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CODES = (200, 201, 204, 301, 302, 304, 400, 401, 403, 404, 405, 410, 413, 500, 503)
+OTHER = "other"
+
+CACHES = {"post_cards": "blog_post_cards"}  # cache label -> app.extensions key
+
+# Per endpoint: request count, one slot per code plus "other", one per bucket plus +Inf
+_CODE_BASE = 1
+_BUCKET_BASE = _CODE_BASE + len(CODES) + 1
+_STRIDE = _BUCKET_BASE + len(BUCKETS) + 1
+
+
+class Metrics:
+    """Request counters and latency histograms for one app, sharded per thread."""
+
+    def __init__(self, endpoints):
+        self.endpoints = tuple(sorted(endpoints)) + (OTHER,)
+        self._endpoint_index = {endpoint: i for i, endpoint in enumerate(self.endpoints)}
+        self._other = len(self.endpoints) - 1
+        self._code_slot = {code: i for i, code in enumerate(CODES)}
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def shard(self):
+        """This thread's (counts, sums, in-flight) arrays, created on its first request."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = ([0] * (_STRIDE * len(self.endpoints)), [0.0] * len(self.endpoints), [0, 0])
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def record(self, shard, endpoint, code, seconds):
+        counts, sums, _ = shard
+        i = self._endpoint_index.get(endpoint, self._other)
+        base = i * _STRIDE
+        counts[base] += 1
+        counts[base + _CODE_BASE + self._code_slot.get(code, len(CODES))] += 1
+        counts[base + _BUCKET_BASE + bisect.bisect_left(BUCKETS, seconds)] += 1
+        sums[i] += seconds
+
+    def totals(self):
+        """The threads' arrays added up: (counts, sums, in flight)."""
+        counts = [0] * (_STRIDE * len(self.endpoints))
+        sums = [0.0] * len(self.endpoints)
+        in_flight = 0
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard_counts, shard_sums, flight in shards:
+            counts = [a + b for a, b in zip(counts, shard_counts)]
+            sums = [a + b for a, b in zip(sums, shard_sums)]
+            in_flight += flight[0] - flight[1]
+        return counts, sums, in_flight
+
+    def render(self, labels, gauges=()):
+        """The metrics in the Prometheus text format.
+
+        ``labels`` go on every sample; ``gauges`` are extra ``(name, help,
+        type, [(labels, value)])`` families.
+        """
+        counts, sums, in_flight = self.totals()
+        common = ",".join(f'{name}="{value}"' for name, value in labels.items())
+        lines = ["# HELP blog_requests_total Requests served, by endpoint and status code.",
+                 "# TYPE blog_requests_total counter"]
+        for i, endpoint in enumerate(self.endpoints):
+            base = i * _STRIDE
+            for slot, code in enumerate(CODES + (OTHER,)):
+                value = counts[base + _CODE_BASE + slot]
+                if value:
+                    lines.append(f'blog_requests_total{{{common},endpoint="{endpoint}",code="{code}"}} {value}')
+        lines += ["# HELP blog_request_duration_seconds Time the app took per request.",
+                  "# TYPE blog_request_duration_seconds histogram"]
+        for i, endpoint in enumerate(self.endpoints):
+            base = i * _STRIDE
+            if not counts[base]:
+                continue
+            cumulative = 0
+            for slot, bound in enumerate(BUCKETS + ("+Inf",)):
+                cumulative += counts[base + _BUCKET_BASE + slot]
+                lines.append(f'blog_request_duration_seconds_bucket{{{common},endpoint="{endpoint}",le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'blog_request_duration_seconds_sum{{{common},endpoint="{endpoint}"}} {sums[i]:.6f}')
+            lines.append(f'blog_request_duration_seconds_count{{{common},endpoint="{endpoint}"}} {counts[base]}')
+        gauges = [("blog_requests_in_flight", "Requests being handled.", "gauge", [({}, in_flight)])] + list(gauges)
+        for name, help_text, kind, samples in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for sample_labels, value in samples:
+                extra = "".join(f',{key}="{label}"' for key, label in sample_labels.items())
+                lines.append(f"{name}{{{common}{extra}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class Instrumented:
+    """WSGI middleware recording every request to ``metrics``; ``app`` is the wrapped app."""
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    def __call__(self, environ, start_response):
+        shard = self.metrics.shard()
+        flight = shard[2]
+        flight[0] += 1
+        started = time.perf_counter()
+        try:
+            return self.app(environ, start_response)
+        except BaseException:
+            environ["blog.status"] = 500
+            raise
+        finally:
+            # blog.endpoint/blog.status are set by the after_request hook, or by
+            # the WSGI shortcuts in blog.health
+            self.metrics.record(shard, environ.get("blog.endpoint"), environ.get("blog.status"),
+                                time.perf_counter() - started)
+            flight[1] += 1
+
+
+def init_app(app, app_prefix, store, service_name):
+    """Instrument ``app`` and serve its metrics. Call last, once every route is registered."""
+    def metrics_text():
+        gauges = [("blog_store_posts", "Posts in the store.", "gauge", [({}, len(store))])]
+        caches = [(label, app.extensions[key].stats()) for label, key in CACHES.items() if key in app.extensions]
+        if caches:
+            gauges += [
+                ("blog_cache_hits_total", "Cache lookups that hit.", "counter",
+                 [({"cache": label}, stats["hits"]) for label, stats in caches]),
+                ("blog_cache_misses_total", "Cache lookups that missed.", "counter",
+                 [({"cache": label}, stats["misses"]) for label, stats in caches]),
+                ("blog_cache_hit_ratio", "Hits per lookup since the app started.", "gauge",
+                 [({"cache": label}, stats["hit_ratio"]) for label, stats in caches]),
+            ]
+        replica = app.extensions.get("blog_replica")
+        if replica is not None:
+            status = replica.status()
+            gauges += [
+                ("blog_replication_lag_seconds", "How long this standby has been behind.", "gauge",
+                 [({}, status["lag_seconds"])]),
+                ("blog_replication_lag_entries", "Writes this standby has yet to apply.", "gauge",
+                 [({}, status["lag_entries"])]),
+            ]
+        body = metrics.render({"service": service_name}, gauges)
+        return Response(body, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    app.add_url_rule(app_prefix + "/metrics", "metrics", metrics_text)
+    app.add_url_rule("/metrics", "metrics", metrics_text)
+
+    @app.after_request
+    def label_request(response):
+        environ = request.environ
+        environ["blog.endpoint"] = request.endpoint
+        environ["blog.status"] = response.status_code
+        return response
+
+    # /ready is answered ahead of Flask (blog.health) and has no view
+    metrics = app.extensions["blog_metrics"] = Metrics(set(app.view_functions) | {"ready"})
+    app.wsgi_app = Instrumented(app.wsgi_app, metrics)
+    return metrics
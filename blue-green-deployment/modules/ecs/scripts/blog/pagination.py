@@ -0,0 +1,66 @@
+"""Keyset (cursor) pagination for the post listing and search results.
+
+Pages are addressed by post id rather than offset: ``?after=<id>`` is the
+page of posts older than ``<id>`` and ``?before=<id>`` the page newer than
+it, so a page stays stable while posts are added or deleted above it.
+"""
+import itertools
+import os
+from collections import namedtuple
+from urllib.parse import urlencode
+
+DEFAULT_PAGE_SIZE = int(os.environ.get("BLOG_PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = 100
+
+
+def page_args(args):
+    """Read ``(after, before, limit)`` from request args, capping the limit."""
+    limit = args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    return args.get("after") or None, args.get("before") or None, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+class Page(namedtuple("Page", "posts next_after prev_before limit versions", defaults=(None,))):
+    """One page of posts, newest first.
+
+    ``next_after`` / ``prev_before`` are the cursors for the older / newer
+    page, or None when there is no such page. ``versions`` holds each
+    post's version, read from the same snapshot as the post itself, when
+    the store provides them (``page()`` does; search hits don't).
+    """
+
+    __slots__ = ()
+
+    def cards(self):
+        """(post, version) pairs; the version is None where the page has none."""
+        return zip(self.posts, self.versions or itertools.repeat(None))
+
+    def next_query(self, **params):
+        """Query string for the next (older) page, keeping ``params``."""
+        return self._query(params, after=self.next_after)
+
+    def prev_query(self, **params):
+        """Query string for the previous (newer) page, keeping ``params``."""
+        return self._query(params, before=self.prev_before)
+
+    def _query(self, params, **cursor):
+        query = {name: value for name, value in params.items() if value}
+        query.update(cursor)
+        if self.limit != DEFAULT_PAGE_SIZE:
+            query["limit"] = self.limit
+        return urlencode(query)
+
+
+def paginate(posts, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """Page through an already materialized newest-first list (search hits)."""
+    ids = [post["id"] for post in posts]
+    if before in ids and ids.index(before) >= limit:
+        end = ids.index(before)
+        start = end - limit
+    else:
+        start = ids.index(after) + 1 if after in ids else 0
+        end = start + limit
+    page = posts[start:end]
+    return Page(page,
+                page[-1]["id"] if end < len(posts) else None,
+                page[0]["id"] if start > 0 and page else None,
+                limit)
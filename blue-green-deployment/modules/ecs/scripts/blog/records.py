@@ -0,0 +1,150 @@
+"""Compact post and comment records for the in-memory store.
+
+Posts arrive as dicts (from a form, the journal, an import or the seed),
+and a dict per post and another per comment is mostly per-object
+overhead: a six-key dict takes about 270 bytes before any of its values.
+``PostStore`` keeps each post as a ``Post`` instead, a ``__slots__``
+object with one pointer per field and no dict of its own, and its
+comments as a tuple of ``Comment`` records. Authors and dates repeat
+across thousands of posts and comments and are interned, so each distinct
+value is stored once however many records share it.
+
+Records read like the dicts they replace: by attribute in templates
+(``post.title``, ``comment.author``) and as a read-only mapping in Python
+(``post["id"]``, ``post.get("comments")``, ``dict(post)``). They are never
+changed once stored: a write stores a new record (``Post.replace``).
+``to_dict`` turns one back into plain dicts, and ``json_default`` lets
+``json.dumps`` encode records wherever they are written out.
+
+A ``Post`` also carries what the pages and the search index derive from
+it, computed once when the record is built, that is when the post is
+written (``create_post``, ``edit_post``, ``add_comment``), so reads never
+slice or case-fold:
+
+``excerpt``
+    The content as the listing card shows it: the first ``EXCERPT_LENGTH``
+    characters and an ellipsis, or all of it if it is that short.
+``comment_count`` and ``comments_label``
+    The number of comments and the card's "3 comments" ("" for none).
+``search_text``
+    The lower-cased values of ``blog.search.SEARCH_FIELDS``, which the
+    search index keeps rather than lower-casing its own copy.
+
+These are attributes only: they are not part of the mapping, ``to_dict``
+or the JSON written out.
+
+``bench/records.py`` measures the bytes per post of both with tracemalloc.
+"""
+import sys
+from collections.abc import Mapping
+
+from blog.search import SEARCH_FIELDS
+
+EXCERPT_LENGTH = 200
+
+POST_FIELDS = ("id", "title", "content", "author", "date", "comments")
+COMMENT_FIELDS = ("id", "content", "author", "date")
+DERIVED_FIELDS = ("excerpt", "comment_count", "comments_label", "search_text")
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class _Record(Mapping):
+    """Read-only mapping over a record's slots."""
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+
+class Comment(_Record):
+    __slots__ = COMMENT_FIELDS
+    FIELDS = COMMENT_FIELDS
+
+    def __init__(self, id, content, author, date):
+        self.id = id
+        self.content = content
+        self.author = _intern(author)
+        self.date = _intern(date)
+
+    @classmethod
+    def from_dict(cls, comment):
+        if type(comment) is cls:
+            return comment
+        return cls(comment.get("id"), comment.get("content"), comment.get("author"), comment.get("date"))
+
+    def to_dict(self):
+        return {"id": self.id, "content": self.content, "author": self.author, "date": self.date}
+
+
+class Post(_Record):
+    __slots__ = POST_FIELDS + DERIVED_FIELDS
+    FIELDS = POST_FIELDS
+
+    def __init__(self, id, title, content, author, date, comments=()):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.author = _intern(author)
+        self.date = _intern(date)
+        self.comments = comments
+        if content and len(content) > EXCERPT_LENGTH:
+            self.excerpt = content[:EXCERPT_LENGTH] + "..."
+        else:
+            self.excerpt = content
+        self.comment_count = count = len(comments)
+        self.comments_label = f"{count} comment{'s' if count != 1 else ''}" if count else ""
+        self.search_text = tuple((getattr(self, field) or "").lower() for field in SEARCH_FIELDS)
+
+    @classmethod
+    def from_dict(cls, post):
+        """``post`` as a record; a record is returned as it is."""
+        if type(post) is cls:
+            return post
+        comments = post.get("comments")
+        return cls(post["id"], post.get("title"), post.get("content"), post.get("author"), post.get("date"),
+                   tuple(Comment.from_dict(comment) for comment in comments) if comments else ())
+
+    def replace(self, **fields):
+        """A new record with ``fields`` overwritten."""
+        unknown = set(fields) - set(POST_FIELDS[1:])
+        if unknown:
+            raise ValueError(f"Unknown post fields {sorted(unknown)}")
+        values = {field: getattr(self, field) for field in POST_FIELDS}
+        values.update(fields)
+        values["comments"] = tuple(Comment.from_dict(comment) for comment in values["comments"] or ())
+        return Post(**values)
+
+    def to_dict(self):
+        return {"id": self.id, "title": self.title, "content": self.content, "author": self.author,
+                "date": self.date, "comments": [comment.to_dict() for comment in self.comments]}
+
+
+def json_default(obj):
+    """``default`` for ``json.dumps``: encodes records as the dicts they stand for."""
+    if isinstance(obj, _Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def to_dict(post):
+    """A plain dict of ``post``, whether a record or a dict; None stays None."""
+    if post is None or type(post) is dict:
+        return post
+    return post.to_dict() if isinstance(post, _Record) else dict(post)
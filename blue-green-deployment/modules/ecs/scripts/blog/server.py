@@ -0,0 +1,767 @@
+"""Production HTTP server for the blog apps.
+
+``app.run()`` is Flask's single-threaded development server and closes the
+connection after every response. This module serves the same WSGI ``app``
+object with:
+
+* a fixed pool of request threads, sized from the CPUs available to the
+  process (its CPU affinity, capped by the cgroup CPU quota an ECS task
+  or a container runs under) unless ``--threads`` / ``BLOG_THREADS`` says
+  otherwise;
+* request heads read in the accept loop. A connection only gets a request
+  thread once its request line and headers are all in, so clients that
+  send a request slowly (or half of one) wait in the selector instead of
+  holding threads, for up to ``REQUEST_TIMEOUT`` seconds;
+* HTTP/1.1 keep-alive. Idle connections wait in a selector rather than
+  holding a thread, and are closed after ``--keepalive`` seconds. The
+  default of 75s is longer than the ALB's 60s idle timeout, so the ALB
+  always closes first and never reuses a connection the server has dropped;
+* a configurable listen backlog;
+* optional pre-forked worker processes (``--workers``). Each worker imports
+  and builds the app itself, after the fork, so its background threads
+  (health prober, journal flusher, replica follower) run in the worker.
+  A worker that dies is replaced; one that cannot build the app prints
+  the traceback and the server exits 1 instead. Each worker also has its
+  own in-memory post store, so keep the default of 1 unless the store is
+  shared between processes (``BLOG_STORE=sqlite``);
+* graceful shutdown. On SIGTERM (or SIGINT) the server reports itself not
+  ready: ``/ready`` and ``/appN/ready`` answer 503 from then on (see
+  ``blog.health``), every response says ``Connection: close`` and the
+  change feeds are closed, so a standby's long poll (see
+  ``blog.replication``) ends instead of holding the drain up. After
+  ``--drain-delay`` seconds (default 0) it stops accepting connections,
+  closes keep-alive connections once they have been idle for a second
+  and lets the requests in flight finish, for up to
+  ``--drain-timeout`` seconds (default 25, inside the 30s ECS gives a task
+  between SIGTERM and SIGKILL) before it exits regardless. A second
+  signal exits at once. ``bench/drain.py`` checks that no request fails.
+
+Run it as a module or from an app script::
+
+    python -m blog.server app_1:app --port 80
+    python -m blog.server app_1:app app_2:app app_3:app --port 80  # one process, three tenants
+
+    if __name__ == '__main__':
+        server.run(app, port=80)
+"""
+import argparse
+import email.utils
+import importlib
+import io
+import math
+import os
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException, parse_headers
+from urllib.parse import unquote
+
+from blog import factory, replication
+
+SERVER_SOFTWARE = "blog-server/1.0"
+DEFAULT_KEEPALIVE = 75
+DEFAULT_BACKLOG = 1024
+REQUEST_TIMEOUT = 30  # seconds a started request may stall reading or writing
+MAX_LINE = 65536
+# Heads longer than this go to a request thread unfinished, which rejects
+# them or reads the rest under REQUEST_TIMEOUT
+MAX_HEAD = 2 * MAX_LINE
+MAX_CHUNKED_BODY = 16 * 1024 * 1024
+DEFAULT_DRAIN_DELAY = 0
+DEFAULT_DRAIN_TIMEOUT = 25
+DRAIN_IDLE = 1.0  # seconds a keep-alive connection must be idle to be closed while draining
+LOAD_FAILED = 3  # exit status of a worker that could not build the app; its replacement would fail alike
+RESPAWN_DELAY = 1.0  # seconds before replacing a worker that crashed within as long of starting
+
+
+def available_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    return max(1, min(cpus, math.ceil(quota))) if quota else cpus
+
+
+def cgroup_cpu_quota():
+    """CPUs' worth of time the process's cgroup may use per period, or None if unlimited.
+
+    ECS sets this from the task's (or container's) ``cpu``; the affinity
+    mask still shows every CPU of the host.
+    """
+    try:  # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return int(quota) / int(period) if quota != "max" else None
+    except (OSError, ValueError):
+        pass
+    try:  # cgroup v1: quota is -1 when unlimited
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def auto_threads():
+    return max(4, available_cpus() * 4)
+
+
+def auto_workers():
+    return available_cpus() * 2 + 1
+
+
+class BadRequest(Exception):
+    pass
+
+
+class _Body(io.RawIOBase):
+    """``wsgi.input`` for one request: never reads past its Content-Length."""
+
+    def __init__(self, rfile, length):
+        self._rfile = rfile
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:self.remaining]
+        data = self._rfile.read(len(view))
+        view[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def drain(self):
+        while self.remaining > 0 and self.read(min(self.remaining, 65536)):
+            pass
+
+
+class _Reader:
+    """Buffered reads from a socket, topped up by the accept loop or the request thread.
+
+    The accept loop calls ``fill`` once per readable event, which never
+    blocks, until ``head_complete``; the request thread then parses from
+    the buffer and only waits on the socket for a body.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.buffer = bytearray()
+
+    def fill(self):
+        """Receive once into the buffer; returns False at end of stream."""
+        data = self._sock.recv(65536)
+        self.buffer += data
+        return bool(data)
+
+    def head_complete(self):
+        """True once a whole request head (or more than ``MAX_HEAD`` bytes) is buffered."""
+        buffer = self.buffer
+        return b"\n\r\n" in buffer or b"\n\n" in buffer or len(buffer) > MAX_HEAD
+
+    def readline(self, limit=-1):
+        start = 0
+        while True:
+            end = self.buffer.find(b"\n", start)
+            if end >= 0:
+                end += 1
+                break
+            start = len(self.buffer)
+            if 0 <= limit <= start or not self.fill():
+                end = start
+                break
+        if limit >= 0:
+            end = min(end, limit)
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return line
+
+    def read(self, size):
+        """Read ``size`` bytes, fewer only at end of stream."""
+        while len(self.buffer) < size and self.fill():
+            pass
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class Connection:
+    """One client connection; handles a single request per ``handle`` call."""
+
+    def __init__(self, sock, address, server):
+        self.sock = sock
+        self.address = address
+        self.server = server
+        self.last_active = time.monotonic()
+        self.head_started = None  # when the first byte of a request still being read came in
+        sock.setblocking(True)
+        sock.settimeout(REQUEST_TIMEOUT)
+        self.rfile = _Reader(sock)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def receive(self):
+        """Read what the client sent, without blocking; returns False if it closed.
+
+        Only called by the accept loop, after the selector saw the
+        connection readable.
+        """
+        try:
+            if not self.rfile.fill():
+                return False
+        except OSError:
+            return False
+        self.last_active = time.monotonic()
+        if self.head_started is None:
+            self.head_started = self.last_active
+        return True
+
+    def has_pipelined_request(self):
+        """True if another whole request head already sits in the buffer.
+
+        Such a request never wakes the selector, so it has to be served now.
+        Part of a head stays buffered until the selector sees the rest.
+        """
+        if not self.rfile.buffer:
+            return False
+        if self.head_started is None:
+            self.head_started = time.monotonic()
+        return self.rfile.head_complete()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def handle(self):
+        """Serve one request; returns True to keep the connection open."""
+        self.head_started = None
+        try:
+            return self._handle()
+        except (OSError, HTTPException, ValueError):
+            return False
+        finally:
+            self.last_active = time.monotonic()
+
+    def _handle(self):
+        line = self.rfile.readline(MAX_LINE + 1)
+        if not line:
+            return False
+        try:
+            method, target, version, headers, body = self._parse(line)
+        except BadRequest as e:
+            self._send_error("400 Bad Request", str(e))
+            return False
+
+        keep_alive = self._wants_keep_alive(version, headers)
+        environ = self._environ(method, target, version, headers, body)
+        status_headers = []
+        sent = []
+
+        def start_response(status, response_headers, exc_info=None):
+            if exc_info and sent:
+                raise exc_info[1].with_traceback(exc_info[2])
+            status_headers[:] = [status, response_headers]
+            return write
+
+        chunked = False
+
+        def write(data):
+            nonlocal chunked, keep_alive
+            if not sent:
+                status, response_headers = status_headers
+                names = {name.lower() for name, _ in response_headers}
+                code = int(status.split(None, 1)[0])
+                framed = ("content-length" in names or method == "HEAD"
+                          or code in (204, 304) or 100 <= code < 200)
+                if self.server.draining:
+                    keep_alive = False
+                if not framed:
+                    if version == "HTTP/1.1":
+                        chunked = True
+                    else:
+                        keep_alive = False
+                head = [f"HTTP/1.1 {status}"]
+                head += [f"{name}: {value}" for name, value in response_headers]
+                head.append(f"Date: {email.utils.formatdate(usegmt=True)}")
+                head.append(f"Server: {SERVER_SOFTWARE}")
+                if chunked:
+                    head.append("Transfer-Encoding: chunked")
+                head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+                self.sock.sendall(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                sent.append(True)
+            if data and method != "HEAD":
+                if chunked:
+                    data = b"%x\r\n%s\r\n" % (len(data), data)
+                self.sock.sendall(data)
+
+        try:
+            result = self.server.app(environ, start_response)
+            try:
+                for data in result:
+                    write(data)
+                if not sent:
+                    write(b"")
+                if chunked:
+                    self.sock.sendall(b"0\r\n\r\n")
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        except (OSError, HTTPException):
+            return False
+        except Exception:
+            self.server.log_exception(environ)
+            if not sent:
+                self._send_error("500 Internal Server Error", "Internal Server Error")
+            return False
+
+        body.drain()
+        return keep_alive
+
+    def _parse(self, line):
+        if len(line) > MAX_LINE:
+            raise BadRequest("Request line too long")
+        parts = line.decode("latin-1").rstrip("\r\n").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+            raise BadRequest("Malformed request line")
+        method, target, version = parts
+        try:
+            headers = parse_headers(self.rfile)
+        except HTTPException as e:
+            raise BadRequest(f"Malformed headers: {e}") from e
+
+        if headers.get("Expect", "").lower() == "100-continue":
+            self.sock.sendall(b"HTTP/1.1 100 Continue\r\n\r\n")
+        if "chunked" in headers.get("Transfer-Encoding", "").lower():
+            data = self._read_chunked()
+            body = _Body(io.BytesIO(data), len(data))
+        else:
+            try:
+                length = int(headers.get("Content-Length") or 0)
+            except ValueError:
+                raise BadRequest("Invalid Content-Length") from None
+            body = _Body(self.rfile, length)
+        return method, target, version, headers, body
+
+    def _read_chunked(self):
+        data = bytearray()
+        while True:
+            size_line = self.rfile.readline(MAX_LINE)
+            try:
+                size = int(size_line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise BadRequest("Invalid chunk size") from None
+            if size == 0:
+                while self.rfile.readline(MAX_LINE) not in (b"\r\n", b"\n", b""):
+                    pass  # trailers
+                return bytes(data)
+            if len(data) + size > MAX_CHUNKED_BODY:
+                raise BadRequest("Request body too large")
+            data += self.rfile.read(size)
+            self.rfile.readline(MAX_LINE)
+
+    @staticmethod
+    def _wants_keep_alive(version, headers):
+        connection = headers.get("Connection", "").lower()
+        if version == "HTTP/1.1":
+            return "close" not in connection
+        return "keep-alive" in connection
+
+    def _environ(self, method, target, version, headers, body):
+        path, _, query = target.partition("?")
+        if "://" in path:  # absolute-form target
+            path = "/" + path.split("://", 1)[1].partition("/")[2]
+        environ = {
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BufferedReader(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": self.server.multiprocess,
+            "wsgi.run_once": False,
+            "SERVER_SOFTWARE": SERVER_SOFTWARE,
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(path, "latin-1"),
+            "QUERY_STRING": query,
+            "RAW_URI": target,
+            "REMOTE_ADDR": self.address[0] if isinstance(self.address, tuple) else "",
+            "REMOTE_PORT": str(self.address[1]) if isinstance(self.address, tuple) else "",
+            "SERVER_NAME": self.server.host,
+            "SERVER_PORT": str(self.server.port),
+            "SERVER_PROTOCOL": version,
+            "CONTENT_LENGTH": str(body.remaining) if body.remaining else "",
+            # False once the server is shutting down; /ready reports it
+            "blog.ready": not self.server.draining,
+        }
+        for name, value in headers.items():
+            key = name.upper().replace("-", "_")
+            if "_" in name or key == "CONTENT_LENGTH":
+                continue
+            if key == "CONTENT_TYPE":
+                environ[key] = value
+                continue
+            key = "HTTP_" + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _send_error(self, status, message):
+        body = message.encode()
+        head = (f"HTTP/1.1 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        try:
+            self.sock.sendall(head.encode("latin-1") + body)
+        except OSError:
+            pass
+
+
+class Server:
+    """Accept loop plus request thread pool for one process."""
+
+    def __init__(self, app, host="0.0.0.0", port=80, threads=None, backlog=DEFAULT_BACKLOG,
+                 keepalive=DEFAULT_KEEPALIVE, sock=None, multiprocess=False,
+                 drain_delay=DEFAULT_DRAIN_DELAY, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        self.app = app
+        self.host = host
+        self.threads = threads or auto_threads()
+        self.keepalive = keepalive
+        self.multiprocess = multiprocess
+        self.drain_delay = drain_delay
+        self.drain_timeout = drain_timeout
+        self.socket = sock or bind_socket(host, port, backlog)
+        self.port = self.socket.getsockname()[1]
+        self.socket.setblocking(False)
+        self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="blog-request")
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._returned = deque()  # connections handed back by request threads
+        self._idle = {}  # connection -> registered with the selector
+        self._running = False
+        self._in_flight = 0  # connections handed to request threads
+        self._in_flight_lock = threading.Lock()
+        self._drain_started = None  # time.monotonic() of the first stop()
+        self._accepting = False
+        self.draining = False
+
+    def serve_forever(self):
+        self._selector.register(self.socket, selectors.EVENT_READ, "accept")
+        self._selector.register(self._wake_r, selectors.EVENT_READ, "wake")
+        self._running = True
+        self._accepting = True
+        feeds_open = True
+        try:
+            while self._running:
+                if self.draining and feeds_open:
+                    # Here rather than in stop(), which runs in a signal handler
+                    replication.close_feeds()
+                    feeds_open = False
+                if self.draining and self._drained():
+                    break
+                for key, _ in self._selector.select(timeout=0.1 if self.draining else 1.0):
+                    if key.data == "accept":
+                        self._accept()
+                    elif key.data == "wake":
+                        self._wake_r.recv(4096)
+                    else:
+                        self._receive(key.fileobj)
+                self._take_back()
+                self._close_idle()
+        finally:
+            self._shutdown()
+
+    def stop(self):
+        """Start draining, or stop at once if already draining; may be called from a signal handler."""
+        if self.draining:
+            self._running = False
+        else:
+            self._drain_started = time.monotonic()
+            self.draining = True
+        self._wake()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def log_exception(self, environ):
+        print(f"Error handling {environ.get('REQUEST_METHOD')} {environ.get('RAW_URI')}:", file=sys.stderr)
+        traceback.print_exc()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._register(Connection(sock, address, self))
+
+    def _register(self, conn):
+        self._idle[conn] = True
+        self._selector.register(conn, selectors.EVENT_READ, conn)
+
+    def _receive(self, conn):
+        if not conn.receive():
+            self._drop(conn)
+        elif conn.rfile.head_complete():
+            self._dispatch(conn)
+
+    def _dispatch(self, conn):
+        self._selector.unregister(conn)
+        del self._idle[conn]
+        with self._in_flight_lock:
+            self._in_flight += 1
+        self._pool.submit(self._serve, conn)
+
+    def _serve(self, conn):
+        try:
+            keep = conn.handle()
+            while keep and conn.has_pipelined_request():
+                keep = conn.handle()
+            if keep and self._running:
+                self._returned.append(conn)
+            else:
+                conn.close()
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            self._wake()
+
+    def _drained(self):
+        """One step of a graceful shutdown; returns True once it is over."""
+        elapsed = time.monotonic() - self._drain_started
+        if self._accepting and elapsed >= self.drain_delay:
+            # Take what is already queued in the backlog, then stop listening
+            self._accept()
+            self._selector.unregister(self.socket)
+            self.socket.close()
+            self._accepting = False
+        if not self._accepting:
+            # A connection busy a moment ago is likely to send another request
+            # any instant (and be told to close); one idle for a while is not,
+            # so closing it is unlikely to cut off a request on the way
+            self._take_back()
+            quiet = time.monotonic() - DRAIN_IDLE
+            for conn in [conn for conn in self._idle if conn.last_active < quiet]:
+                self._drop(conn)
+        done = not self._accepting and not self._in_flight and not self._idle
+        return done or elapsed >= self.drain_delay + self.drain_timeout
+
+    def _take_back(self):
+        while self._returned:
+            self._register(self._returned.popleft())
+
+    def _close_idle(self):
+        now = time.monotonic()
+        deadline = now - self.keepalive
+        # A client gets REQUEST_TIMEOUT to finish a head it has started
+        stalled = now - REQUEST_TIMEOUT
+        for conn in [conn for conn in self._idle if conn.last_active < deadline
+                     or (conn.head_started is not None and conn.head_started < stalled)]:
+            self._drop(conn)
+
+    def _drop(self, conn):
+        self._selector.unregister(conn)
+        del self._idle[conn]
+        conn.close()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _shutdown(self):
+        self._selector.close()
+        self.socket.close()
+        for conn in list(self._idle):
+            conn.close()
+        self._idle.clear()
+        # Let requests already running finish, unless the drain ran out of time
+        self._pool.shutdown(wait=not self._in_flight)
+        while self._returned:
+            self._returned.popleft().close()
+
+
+def bind_socket(host, port, backlog=DEFAULT_BACKLOG):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def run(app=None, host=None, port=None, threads=None, workers=None, backlog=None, keepalive=None,
+        drain_delay=None, drain_timeout=None, load=None):
+    """Serve ``app`` until SIGTERM/SIGINT; unset options come from BLOG_* env vars.
+
+    ``load``, instead of ``app``, is called to build the app: with several
+    workers, by each one after the fork. A prebuilt ``app`` can only be
+    served by one worker, as its background threads do not survive a fork.
+    Returns the exit status: nonzero when the workers could not build the app.
+    """
+    host = host or os.environ.get("BLOG_HOST", "0.0.0.0")
+    port = int(port if port is not None else os.environ.get("BLOG_PORT", "80"))
+    threads = _count(threads or os.environ.get("BLOG_THREADS", "auto"), auto_threads)
+    workers = _count(workers or os.environ.get("BLOG_WORKERS", "1"), auto_workers)
+    backlog = int(backlog or os.environ.get("BLOG_BACKLOG", DEFAULT_BACKLOG))
+    keepalive = float(keepalive or os.environ.get("BLOG_KEEPALIVE", DEFAULT_KEEPALIVE))
+    if drain_delay is None:
+        drain_delay = os.environ.get("BLOG_DRAIN_DELAY", DEFAULT_DRAIN_DELAY)
+    if drain_timeout is None:
+        drain_timeout = os.environ.get("BLOG_DRAIN_TIMEOUT", DEFAULT_DRAIN_TIMEOUT)
+    drain = (float(drain_delay), float(drain_timeout))
+    if workers > 1 and load is None:
+        raise ValueError("Several workers need the app built in each of them: "
+                         "run python -m blog.server module:app --workers N")
+
+    sock = bind_socket(host, port, backlog)
+    print(f"Serving on http://{host}:{port} with {workers} worker(s) x {threads} thread(s), "
+          f"backlog {backlog}, keep-alive {keepalive:g}s, drain {drain[0]:g}s + {drain[1]:g}s", flush=True)
+    if workers == 1:
+        _serve_in_process(app or load(), host, threads, keepalive, sock, drain, multiprocess=False)
+    else:
+        return _prefork(load, host, threads, keepalive, sock, drain, workers)
+    return 0
+
+
+def _count(value, auto):
+    return auto() if str(value).lower() == "auto" else int(value)
+
+
+def _serve_in_process(app, host, threads, keepalive, sock, drain, multiprocess):
+    drain_delay, drain_timeout = drain
+    server = Server(app, host, threads=threads, keepalive=keepalive, sock=sock, multiprocess=multiprocess,
+                    drain_delay=drain_delay, drain_timeout=drain_timeout)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: server.stop())
+    server.serve_forever()
+    if server.in_flight:
+        # Out of time: the request threads cannot be interrupted, so leave them
+        print(f"Exiting with {server.in_flight} request(s) still in flight", file=sys.stderr, flush=True)
+        os._exit(1)
+
+
+def _prefork(load, host, threads, keepalive, sock, drain, workers):
+    children = {}  # pid -> when it was started
+    stopping = threading.Event()
+    failed = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = LOAD_FAILED
+            try:
+                # Not forward(): a signal before the worker's server is up must
+                # not go on to its siblings through the copied children
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    signal.signal(signum, signal.SIG_DFL)
+                # Built here, so the store's threads belong to this worker
+                app = load()
+                status = 1
+                _serve_in_process(app, host, threads, keepalive, sock, drain, multiprocess=True)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        children[pid] = time.monotonic()
+
+    def forward(signum, _frame):
+        if not stopping.is_set():
+            stopping.set()
+            # The workers stop listening when their drain delay is up; the
+            # socket must not stay open here for connections nobody accepts
+            sock.close()
+        for pid in children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, forward)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if stopping.is_set() or started is None:
+            continue
+        code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        if code == LOAD_FAILED:
+            print(f"Worker {pid} could not load the app (see above); stopping", file=sys.stderr, flush=True)
+            failed = True
+            forward(signal.SIGTERM, None)
+            continue
+        print(f"Worker {pid} exited ({code}); starting a replacement", file=sys.stderr, flush=True)
+        if code and time.monotonic() - started < RESPAWN_DELAY:
+            time.sleep(RESPAWN_DELAY)
+        spawn()
+    sock.close()
+    return 1 if failed else 0
+
+
+def load_app(target):
+    """Import ``module:attribute`` (attribute defaults to ``app``)."""
+    module_name, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "app")
+
+
+def load_apps(targets):
+    """Import every target; several blog apps are mounted by prefix."""
+    factory.check_sources(len(targets))
+    apps = [load_app(target) for target in targets]
+    return apps[0] if len(apps) == 1 else factory.mount(apps)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a blog app with the production server.")
+    parser.add_argument("target", nargs="+",
+                        help="WSGI app as module:attribute, e.g. app_1:app; "
+                             "several blog apps are served from one process by prefix")
+    parser.add_argument("--host", help="bind address (default: BLOG_HOST or 0.0.0.0)")
+    parser.add_argument("--port", type=int, help="port (default: BLOG_PORT or 80)")
+    parser.add_argument("--threads", help="request threads per worker, or 'auto' (default: BLOG_THREADS or auto)")
+    parser.add_argument("--workers", help="worker processes, or 'auto' (default: BLOG_WORKERS or 1)")
+    parser.add_argument("--backlog", type=int, help=f"listen backlog (default: BLOG_BACKLOG or {DEFAULT_BACKLOG})")
+    parser.add_argument("--keepalive", type=float,
+                        help=f"idle keep-alive timeout in seconds (default: BLOG_KEEPALIVE or {DEFAULT_KEEPALIVE})")
+    parser.add_argument("--drain-delay", type=float,
+                        help="seconds to keep accepting connections after SIGTERM, answering /ready with 503 "
+                             f"(default: BLOG_DRAIN_DELAY or {DEFAULT_DRAIN_DELAY})")
+    parser.add_argument("--drain-timeout", type=float,
+                        help="seconds allowed for requests in flight to finish after that "
+                             f"(default: BLOG_DRAIN_TIMEOUT or {DEFAULT_DRAIN_TIMEOUT})")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.getcwd())
+    sys.exit(run(None, args.host, args.port, args.threads, args.workers, args.backlog, args.keepalive,
+                 args.drain_delay, args.drain_timeout, load=lambda: load_apps(args.target)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Precompiled page templates for the blog apps.
+
+The pages used to be one big template string handed to
+``render_template_string`` on every request, which parsed and compiled the
+whole thing each time. The pages now live in ``blog/templates`` as named
+templates that are compiled once when the app starts; compiled bytecode is
+also kept on disk so a restarted container or service skips compilation.
+The stylesheet is a separate, fingerprinted file (see ``blog.assets``).
+"""
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+
+from blog import assets
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Page templates rendered by the routes (base.html is pulled in through them)
+LIST_TEMPLATE = "list.html"
+SEARCH_TEMPLATE = "search.html"
+POST_TEMPLATE = "post.html"
+FORM_TEMPLATE = "form.html"
+TEMPLATE_NAMES = ("base.html", "_post_card.html", LIST_TEMPLATE, SEARCH_TEMPLATE, POST_TEMPLATE, FORM_TEMPLATE)
+
+BYTECODE_CACHE_DIR = os.environ.get(
+    "BLOG_TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "blog-jinja-cache")
+)
+
+
+def init_app(app, app_prefix, platform):
+    """Attach the bytecode cache, page globals and assets, and compile every template.
+
+    Must run before anything touches ``app.jinja_env``; the app has to be
+    created with ``template_folder=TEMPLATE_DIR``.
+    """
+    try:
+        os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(BYTECODE_CACHE_DIR))
+    except OSError as e:
+        # Read-only filesystem: templates are still compiled once per process
+        app.logger.warning("Template bytecode cache disabled: %s", e)
+
+    app.jinja_env.globals.update(app_prefix=app_prefix, platform=platform)
+    assets.init_app(app, app_prefix)
+    for name in TEMPLATE_NAMES:
+        app.jinja_env.get_template(name)